@@ -0,0 +1,75 @@
+"""
+Benchmark of the graph construction on synthetic pipelines.
+
+Compares create_graph with the previous recursive implementation (create_graph_recursive):
+
+    python -m benchmarks.graph_construction --sizes 100 1000 10000 --legacy-max 200
+"""
+import argparse
+import random
+import sys
+import time
+
+from funflow import Functional, create_graph
+from .legacy_graph import create_graph_recursive
+
+
+def identity(*args):
+    return args
+
+
+def create_pipeline(n_layers: int, seed: int = 0) -> list[Functional]:
+    # Each layer consumes the output of the previous layer and of a random earlier layer. The layers are shuffled,
+    # so that most of them are processed before their predecessors.
+    rnd = random.Random(seed)
+    layers = []
+
+    for i in range(n_layers):
+        inputs = ["x"] if i == 0 else list(dict.fromkeys([f"v{i - 1}", f"v{rnd.randint(0, i - 1)}"]))
+        layers.append(Functional(identity, inputs=inputs, outputs=[f"v{i}"], name=f"Layer {i}"))
+
+    rnd.shuffle(layers)
+    return layers
+
+
+def time_graph_construction(builder, layers: list[Functional], repeat: int) -> float:
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        builder(layers, {"x": None})
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--legacy-max", type=int, default=200,
+                        help="Largest pipeline on which the recursive implementation is run.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'layers':>8} {'create_graph [s]':>18} {'recursive [s]':>15} {'speedup':>9}")
+
+    for size in args.sizes:
+        layers = create_pipeline(size)
+        new_time = time_graph_construction(create_graph, layers, args.repeat)
+
+        legacy = "skipped"
+        speedup = ""
+        if size <= args.legacy_max:
+            try:
+                legacy_time = time_graph_construction(create_graph_recursive, layers, args.repeat)
+                legacy = f"{legacy_time:.4f}"
+                speedup = f"{legacy_time / new_time:.1f}x"
+            except RecursionError:
+                legacy = "RecursionError"
+
+        print(f"{size:>8} {new_time:>18.4f} {legacy:>15} {speedup:>9}")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark of the time needed to import funflow in a fresh interpreter, as in a CLI or worker cold start.
+
+Each run imports funflow in a new process with ``-X importtime``. The script reports the best total import time,
+the slowest modules and the third-party modules loaded, and exits with status 1 if the import exceeds the budget
+or loads one of the optional dependencies, which must only be imported on first use:
+
+    python -m benchmarks.import_time --budget 0.3 --output import_time.json
+
+Timings depend on the machine, so the script is not part of the test suite, which only checks that no third-party
+module is loaded.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Maximum import time in seconds, about four times the time measured when it was set, for slower machines
+DEFAULT_BUDGET = 0.5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Optional dependencies that must not be loaded by "import funflow"
+OPTIONAL_MODULES = ["networkx", "graphviz", "numpy", "pandas"]
+
+SCRIPT = "import sys, funflow; print(' '.join(sorted(sys.modules)))"
+
+
+def import_funflow() -> tuple[dict[str, int], list[str]]:
+    """
+    Imports funflow in a new interpreter.
+
+    :return: The cumulative import time of every module in microseconds and the names of the modules loaded.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT],
+                             capture_output=True, text=True, check=True, env=env)
+
+    cumulative_times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        cumulative_times[name.strip()] = int(cumulative)
+
+    return cumulative_times, process.stdout.split()
+
+
+def third_party_modules(modules: list[str]) -> list[str]:
+    top_level = {module.split(".")[0] for module in modules}
+    return sorted(name for name in top_level
+                  if name not in sys.stdlib_module_names and name not in ["funflow", "__main__"]
+                  and not name.startswith("_"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest modules reported.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help=f"Maximum import time in seconds, {DEFAULT_BUDGET} by default.")
+    parser.add_argument("--output", default=None, help="Path of the JSON file with the results.")
+    args = parser.parse_args()
+
+    runs = [import_funflow() for _ in range(args.repeat)]
+    best_times, modules = min(runs, key=lambda run: run[0]["funflow"])
+    total = best_times["funflow"] / 1e6
+
+    slowest = sorted(((name, time) for name, time in best_times.items() if name != "funflow"),
+                     key=lambda item: item[1], reverse=True)[:args.top]
+    third_party = third_party_modules(modules)
+    optional_loaded = [name for name in OPTIONAL_MODULES if name in third_party]
+
+    print(f"import funflow: {total:.4f} s (best of {args.repeat})")
+    print(f"\n{'module':<40} {'cumulative [s]':>15}")
+    for name, time in slowest:
+        print(f"{name:<40} {time / 1e6:>15.4f}")
+    print(f"\nThird-party modules loaded: {', '.join(third_party) if third_party else 'none'}")
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump({"import_time": total, "repeat": args.repeat, "budget": args.budget,
+                       "slowest": dict(slowest), "third_party": third_party}, file, indent=2)
+
+    failures = []
+    if total > args.budget:
+        failures.append(f"the import took {total:.4f} s, more than the budget of {args.budget} s")
+    if optional_loaded:
+        failures.append(f"optional dependencies were loaded: {', '.join(optional_loaded)}")
+
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Previous recursive implementation of create_graph, kept as the reference of benchmarks.graph_construction.
+"""
+import itertools
+from collections import defaultdict
+from typing import Any
+
+from funflow import Layer, Template, TemplateValue, TemplateIndex
+from funflow.template_engine import ordered_to_leveled
+
+
+def any_output_match_input_template(input_template: list[Template], output_template_values: list[TemplateValue]) -> bool:
+    return any(template.match(template_value)
+               for template, template_value in itertools.product(input_template, output_template_values))
+    # for input_name in input_template:
+    #
+    #     actual_input_names = find_actual_input_names(input_name, output_template_values)
+    #     if actual_input_names is not None:
+    #         # print(f"input_name: {input_name}, actual_names: {actual_input_names}")
+    #         return True
+    #
+    # return False
+
+
+def find_node_successor(node: Layer, ordered: list[Layer]):
+    return [ordered_node for ordered_node in ordered
+            if node != ordered_node and any_output_match_input_template(ordered_node.inputs, node.actual_outputs)]
+
+
+def process_node(node: Layer,
+                 ordered: list[Layer],
+                 quarantined: list[Layer],
+                 processing: list[Layer],
+                 state_producers: dict[str, list[Layer]],
+                 user_inputs: dict[str, Any],
+                 state_index: TemplateIndex | None = None,
+                 ):
+    if state_index is None:
+        state_index = TemplateIndex(state_producers.keys())
+
+    node.init(user_inputs, state_producers, state_index)
+
+    actual_outputs = node.actual_outputs
+    actual_inputs = node.actual_inputs
+    # predecessors = node.predecessors
+
+    # print("\nStart Processing Node:", node)
+    # print(f"Predecessor: {list(map(lambda x: x.name, predecessors))}")
+    # print(f"Ordered: {list(map(lambda x: x.name, ordered))}")
+    # print(f"Quarantined: {list(map(lambda x: x.name, quarantined))}")
+
+    if node in quarantined:
+        raise Exception(
+            # f"Cyclical graph detected! Nodes involved: {dict(zip(map(lambda x: x.name, quarantined), quarantined))}")
+            f"Cyclical graph detected! Nodes involved: {list(map(lambda x: x.name, quarantined))}")
+
+    if actual_inputs is not None:
+
+        for actual_name in actual_outputs:
+            if node not in state_producers[str(actual_name)]:
+                state_producers[str(actual_name)].append(node)
+                state_index.add(str(actual_name))
+
+        successors = find_node_successor(node, ordered)
+
+        # print(f"Successors: {list(map(lambda x: x.name, successors))}")  # DEBUG
+        ordered.append(node)
+
+        if successors:
+            quarantined.append(node)
+            # processing.extend(successors)  # extend without duplicates
+
+            for successor in successors:
+                ordered.remove(successor)
+
+            for successor in successors:
+                process_node(successor, ordered, quarantined, processing, state_producers, user_inputs, state_index)
+
+            quarantined.remove(node)
+
+        return True
+
+    return False
+
+
+def create_graph_recursive(layers: list[Layer],
+                           user_inputs: dict) -> tuple[list[list[Layer]], dict[str, list[Layer]]]:
+    state_producers = defaultdict(list)  # state[actual_input_name] => list of producers
+
+    for _input in user_inputs.keys():
+        state_producers[_input] = []
+
+    state_index = TemplateIndex(state_producers.keys())
+
+    nodes = layers.copy()
+    processing = nodes
+    ordered = []
+    quarantined = []
+
+    while nodes:
+        node = nodes.pop(0)
+
+        result_processing = process_node(node, ordered, quarantined, processing, state_producers, user_inputs,
+                                         state_index)
+
+        if not result_processing:
+            nodes.append(node)
+
+    layered = ordered_to_leveled(ordered)
+
+    return layered, state_producers
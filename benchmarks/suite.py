@@ -0,0 +1,316 @@
+"""
+Benchmark suite of the graph construction and execution hot paths on synthetic pipelines.
+
+Measures create_graph, Layer.init, Template.match, TemplateValue parsing, GridMap.call and the overhead per layer
+of Model.call, and writes the results as JSON. When a baseline produced by a previous run is given, every benchmark
+is compared with it and the script exits with status 1 if one of them is slower than the tolerance allows:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json --tolerance 0.2
+
+Timings are the best of ``--repeat`` runs, in seconds per operation.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable
+
+from funflow import Layer, Functional, GridMap, Model, Template, TemplateValue, create_graph
+from funflow import set_parse_cache_size, clear_parse_cache
+from funflow.parse_cache import DEFAULT_PARSE_CACHE_SIZE
+from .graph_construction import create_pipeline
+
+SIZES = {"quick": 100, "full": 1000}
+
+
+def identity(*args):
+    return args
+
+
+def increment(x):
+    return x + 1
+
+
+def add(x, y):
+    return x + y
+
+
+def wide_pipeline(n_layers: int) -> tuple[list[Layer], dict[str, Any]]:
+    # Independent layers reading the same input, all consumed by a single layer
+    layers = [Functional(increment, inputs="x", outputs=f"v{i}", name=f"Layer {i}") for i in range(n_layers - 1)]
+    layers.append(Functional(identity, inputs=[f"v{i}" for i in range(n_layers - 1)], outputs="y", name="Sink"))
+    return layers, {"x": 0}
+
+
+def deep_pipeline(n_layers: int) -> tuple[list[Layer], dict[str, Any]]:
+    # Chain of layers listed in reverse order
+    layers = [Functional(increment, inputs=f"v{i}", outputs=f"v{i + 1}", name=f"Layer {i}")
+              for i in reversed(range(n_layers))]
+    return layers, {"v0": 0}
+
+
+def random_pipeline(n_layers: int) -> tuple[list[Layer], dict[str, Any]]:
+    return create_pipeline(n_layers), {"x": 0}
+
+
+def tag_heavy_pipeline(n_layers: int) -> tuple[list[Layer], dict[str, Any]]:
+    # Every value has several tags, matched with placeholders and propagated to the outputs by the GridMaps
+    n_ids = 10
+    inputs = {f"v0, id: {i}, group: {i % 3}, source: raw, version: 1": i for i in range(n_ids)}
+    inputs["p, source: raw, version: 1"] = 1
+    layers = [GridMap(add, inputs=[f"v{i}, group: {{group}}", "p"], outputs=f"v{i + 1}", name=f"Layer {i}")
+              for i in range(n_layers)]
+    return layers, inputs
+
+
+def gridmap_heavy_pipeline(n_layers: int) -> tuple[list[Layer], dict[str, Any]]:
+    # Chain of GridMaps, each one called once per id
+    n_ids = 10
+    layers = [GridMap(increment, inputs=f"v{i}", outputs=f"v{i + 1}", name=f"Layer {i}") for i in range(n_layers)]
+    return layers, {f"v0, id: {i}": i for i in range(n_ids)}
+
+
+def example_1_pipeline(n_layers: int) -> tuple[list[Layer], dict[str, Any]]:
+    # Pipeline of examples/example_1.py in the current tag syntax, replicated on disjoint names to reach the requested number of layers
+    layers, inputs = [], {}
+
+    for c in range(max(1, n_layers // 18)):
+        layers += [
+            Layer(f"Split {c}", [f"X{c}, country: {{id}}", f"y{c}, country: {{id}}"],
+                  [f"X{c}, country: {{id}}, split: train", f"X{c}, country: {{id}}, split: test",
+                   f"y{c}, country: {{id}}, split: train", f"y{c}, country: {{id}}, split: test"]),
+            Layer(f"Fit Laplacian 1 {c}", [f"y{c}, split: train"], [f"L{c}, method: identity"]),
+            Layer(f"Fit Laplacian 2 {c}", [f"y{c}, split: train", f"n_L_corr{c}, n: {{n}}"],
+                  [f"L{c}, method: corr_{{n}}"]),
+            Layer(f"Fit Laplacian 3 {c}", [f"y{c}, split: train"], [f"L{c}, method: opt"]),
+            Layer(f"Fit ML1 {c}", [f"X{c}, country: {{id}}, split: train", f"y{c}, country: {{id}}, split: train"],
+                  [f"model{c}, country: {{id}}, kind: ml1"]),
+            Layer(f"Fit ML2 {c}", [f"X{c}, country: {{id}}, split: train", f"y{c}, country: {{id}}, split: train"],
+                  [f"model{c}, country: {{id}}, kind: ml2"]),
+            Layer(f"Pred ML1 {c}", [f"model{c}, country: {{id}}, kind: ml1", f"X{c}, country: {{id}}, split: test"],
+                  [f"y_pred{c}, country: {{id}}, kind: ml1"]),
+            Layer(f"Pred ML2 {c}", [f"model{c}, country: {{id}}, kind: ml2", f"X{c}, country: {{id}}, split: test"],
+                  [f"y_pred{c}, country: {{id}}, kind: ml2"]),
+            Layer(f"Combine Y Test {c}", [f"y{c}, split: test"], [f"y_test{c}"]),
+            Layer(f"Combine Y Pred1 {c}", [f"y_pred{c}, kind: ml1"], [f"y_pred_all{c}, kind: ml1"]),
+            Layer(f"Combine Y Pred2 {c}", [f"y_pred{c}, kind: ml2"], [f"y_pred_all{c}, kind: ml2"]),
+            Layer(f"Compute Residuals Test {c}", [f"y_test{c}", f"L{c}, method: {{method}}"],
+                  [f"res{c}, laplacian: {{method}}, model: none"]),
+            Layer(f"Compute Residuals Pred1 {c}", [f"y_pred_all{c}, kind: ml1", f"L{c}, method: {{method}}"],
+                  [f"res{c}, laplacian: {{method}}, model: ml1"]),
+            Layer(f"Compute Residuals Pred2 {c}", [f"y_pred_all{c}, kind: ml2", f"L{c}, method: {{method}}"],
+                  [f"res{c}, laplacian: {{method}}, model: ml2"]),
+            Layer(f"Combine Residuals ML {c}",
+                  [f"res{c}, laplacian: {{method}}, model: ml1", f"res{c}, laplacian: {{method}}, model: ml2"],
+                  [f"res_combined{c}, laplacian: {{method}}"]),
+            Layer(f"Combine Residuals Ensemble {c}",
+                  [f"res{c}, laplacian: {{lapl_method}}, model: none", f"res{c}, laplacian: {{method}}, model: ml1",
+                   f"res{c}, laplacian: {{method}}, model: ml2"],
+                  [f"res_ensemble{c}, laplacian: {{lapl_method}}"]),
+            Layer(f"Trading Strategy {c}", [f"res{c}, laplacian: {{lapl_method}}, model: {{pred_method}}"],
+                  [f"signal{c}, laplacian: {{lapl_method}}, model: {{pred_method}}"]),
+            Layer(f"Compute Returns {c}",
+                  [f"y_test{c}", f"signal{c}, laplacian: {{lapl_method}}, model: {{pred_method}}"],
+                  [f"returns{c}, laplacian: {{lapl_method}}, model: {{pred_method}}"]),
+        ]
+        inputs.update({f"X{c}, country: DE": 1, f"y{c}, country: DE": 1, f"X{c}, country: IT": 1,
+                       f"y{c}, country: IT": 1, f"n_L_corr{c}, n: 10": 10, f"n_L_corr{c}, n: 50": 50})
+
+    return layers, inputs
+
+
+PIPELINES = {
+    "wide": wide_pipeline,
+    "deep": deep_pipeline,
+    "random": random_pipeline,
+    "tag-heavy": tag_heavy_pipeline,
+    "gridmap-heavy": gridmap_heavy_pipeline,
+    "example_1": example_1_pipeline,
+}
+
+# Pipelines whose layers can be executed
+EXECUTABLE_PIPELINES = ["wide", "deep", "random", "tag-heavy", "gridmap-heavy"]
+
+
+def measure(func: Callable[[], Any], repeat: int, number: int = 1) -> dict[str, float]:
+    """
+    Runs ``func`` ``number`` times in each of ``repeat`` runs.
+
+    :return: Best and median time of the runs, in seconds per call of ``func``.
+    """
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+
+    return {"best": min(times), "median": statistics.median(times)}
+
+
+def bench_create_graph(size: int, repeat: int) -> dict[str, dict[str, float]]:
+    results = {}
+
+    for name, pipeline in PIPELINES.items():
+        layers, inputs = pipeline(size)
+        results[f"create_graph/{name}"] = measure(lambda: create_graph(layers, inputs), repeat)
+
+    return results
+
+
+def bench_layer_init(size: int, repeat: int) -> dict[str, dict[str, float]]:
+    # Initialisation of a single layer on the state reached at the end of the graph construction
+    results = {}
+
+    for name in ["wide", "tag-heavy", "example_1"]:
+        layers, inputs = PIPELINES[name](size)
+        _, state_producers = create_graph(layers, inputs)
+        state = dict.fromkeys(state_producers)
+        layer = layers[-1]
+        results[f"layer_init/{name}"] = measure(lambda: layer.init(state, state_producers), repeat, number=10)
+
+    return results
+
+
+def bench_template_match(size: int, repeat: int) -> dict[str, dict[str, float]]:
+    template = Template("v, id: {id}, group: 1")
+    values = [TemplateValue(f"{'v' if i % 2 else 'w'}, id: {i}, group: {i % 3}, step: {i % 7}") for i in range(size)]
+    strings = list(map(str, values))
+
+    return {"template_match/values": measure(lambda: [template.match(value) for value in values], repeat),
+            "template_match/strings": measure(lambda: [template.match(value) for value in strings], repeat)}
+
+
+def bench_template_value_parsing(size: int, repeat: int) -> dict[str, dict[str, float]]:
+    strings = [f"v{i}, id: {i}, group: {i % 3}, source: raw, version: {i % 5}" for i in range(size)]
+
+    def parse():
+        for string in strings:
+            TemplateValue(string)
+
+    cached = measure(parse, repeat)
+    set_parse_cache_size(0)
+    try:
+        uncached = measure(parse, repeat)
+    finally:
+        set_parse_cache_size(DEFAULT_PARSE_CACHE_SIZE)
+        clear_parse_cache()
+
+    return {"template_value_parsing/cached": cached, "template_value_parsing/uncached": uncached}
+
+
+def bench_grid_map_call(size: int, repeat: int) -> dict[str, dict[str, float]]:
+    # Time per combination of a GridMap called on ``size`` values
+    layer = GridMap(increment, inputs="x", outputs="y", name="GridMap")
+    state = {f"x, id: {i}, group: {i % 3}": i for i in range(size)}
+    layer.init(state)
+
+    result = measure(lambda: layer.call(**state), repeat)
+    return {"grid_map_call/per_combination": {key: value / size for key, value in result.items()}}
+
+
+def bench_model_call(size: int, repeat: int) -> dict[str, dict[str, float]]:
+    # Time per layer of a Model call with a compiled plan, i.e. the overhead of the execution on trivial layers
+    results = {}
+
+    for name in EXECUTABLE_PIPELINES:
+        layers, inputs = PIPELINES[name](size)
+        model = Model(layers)
+        model(**inputs)
+
+        result = measure(lambda: model(**inputs), repeat)
+        results[f"model_call/{name}/per_layer"] = {key: value / len(layers) for key, value in result.items()}
+
+    return results
+
+
+BENCHMARKS = [bench_create_graph, bench_layer_init, bench_template_match, bench_template_value_parsing,
+              bench_grid_map_call, bench_model_call]
+
+
+def run_benchmarks(size: int, repeat: int, pattern: str | None = None) -> dict[str, dict[str, float]]:
+    results = {}
+
+    for benchmark in BENCHMARKS:
+        if pattern is None or pattern in benchmark.__name__:
+            results.update(benchmark(size, repeat))
+
+    return results
+
+
+def compare(results: dict[str, dict[str, float]],
+            baseline: dict[str, dict[str, float]],
+            tolerance: float) -> dict[str, dict[str, Any]]:
+    """
+    Compares the best times of the benchmarks found in both results.
+
+    :param tolerance: Relative slowdown above which a benchmark is a regression, e.g. 0.2 for 20%.
+    :return: For each benchmark, the baseline time, the ratio between the current and the baseline time and
+        whether it is a regression.
+    """
+    comparison = {}
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        ratio = result["best"] / baseline[name]["best"] if baseline[name]["best"] > 0 else float("inf")
+        comparison[name] = {"baseline": baseline[name]["best"], "ratio": ratio, "regression": ratio > 1 + tolerance}
+
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=None,
+                        help="Number of layers (or values) of the synthetic pipelines.")
+    parser.add_argument("--quick", action="store_true", help=f"Use pipelines of {SIZES['quick']} layers.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default=None, help="Run only the benchmark functions containing this string.")
+    parser.add_argument("--output", default=None, help="Path of the JSON file with the results.")
+    parser.add_argument("--baseline", default=None, help="Results of a previous run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative slowdown with respect to the baseline reported as a regression.")
+    args = parser.parse_args()
+
+    size = args.size if args.size is not None else SIZES["quick" if args.quick else "full"]
+    results = run_benchmarks(size, args.repeat, args.filter)
+
+    report = {"meta": {"size": size, "repeat": args.repeat, "python": platform.python_version(),
+                       "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+              "results": results}
+
+    comparison = {}
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        if baseline["meta"]["size"] != size:
+            print(f"Warning: the baseline was run with size {baseline['meta']['size']}, not {size}", file=sys.stderr)
+
+        comparison = compare(results, baseline["results"], args.tolerance)
+        report["comparison"] = comparison
+
+    print(f"{'benchmark':<40} {'best [s]':>12} {'median [s]':>12} {'vs baseline':>12}")
+    for name, result in results.items():
+        change = ""
+        if name in comparison:
+            change = f"{comparison[name]['ratio']:.2f}x" + (" !" if comparison[name]["regression"] else "")
+        print(f"{name:<40} {result['best']:>12.3e} {result['median']:>12.3e} {change:>12}")
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    regressions = [name for name, item in comparison.items() if item["regression"]]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
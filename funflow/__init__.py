@@ -1,12 +1,23 @@
 from .layer import Layer
 from .model import Model
+from .plan import ExecutionPlan
+from .executors import LayerExecutionError
 from .functional import Functional
 # from .map import Map
 from .grid_map import GridMap
 from .rename import Rename
+from .cache import Cache
+from .result_cache import ResultCache
+from .disk_cache import DiskCache
+from .fingerprint import fingerprint_value, fingerprint_function
+from .profiling import Profiler, ProfileRecord, ProfileSummary
+from .trace import chrome_trace_events, write_chrome_trace
+from .distributed import DistributedBackend, TCPBackend, TCPWorker, LocalCluster
 
 from .template_engine import create_graph, topological_order_to_nx
 
 from .templates import Template, TemplateValue
+from .template_index import TemplateIndex
 from .tags import Tag
+from .parse_cache import parse_cache_info, set_parse_cache_size, clear_parse_cache
 from .tag_filter import TagFilter, NoTagFilter, ValueTagFilter
\ No newline at end of file
@@ -0,0 +1,182 @@
+import warnings
+from collections.abc import Mapping
+from typing import Any, Self
+from .disk_cache import DiskCache
+from .fingerprint import fingerprint_value, UnhashableValueError
+from .layer import Layer
+from .result_cache import ResultCache, DEFAULT_MAX_ENTRIES
+from .template_index import TemplateIndex
+from .templates import TemplateValue
+
+
+class _ProducersView(Mapping):
+    """
+    View of the state producers in which the Cache layer is replaced by the layer it wraps.
+    """
+
+    def __init__(self, state_producers: Mapping[str, list[Layer]], cache: Layer, layer: Layer):
+        self.__state_producers = state_producers
+        self.__cache = cache
+        self.__layer = layer
+
+    def __getitem__(self, name: str) -> list[Layer]:
+        return [self.__layer if producer is self.__cache else producer for producer in self.__state_producers[name]]
+
+    def __iter__(self):
+        return iter(self.__state_producers)
+
+    def __len__(self) -> int:
+        return len(self.__state_producers)
+
+
+class Cache(Layer):
+    """
+    Layer memoizing the outputs of another layer.
+
+    The outputs are stored under a key made of the fingerprint of the wrapped layer (its definition and the code of
+    its function) and the fingerprint of the actual input values, so a layer is executed again only when one of its
+    inputs changes. Within a Model, wrapping the expensive layers in a Cache makes a call that changes a single
+    input recompute only the layers downstream of it.
+
+    Cached outputs are returned as the same objects every time, so they should not be modified in place.
+    """
+
+    def __init__(self,
+                 layer: Layer,
+                 store: ResultCache | DiskCache | None = None,
+                 max_entries: int | None = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int | None = None,
+                 **kwargs):
+        """
+
+        :param layer: Layer whose outputs are cached.
+        :param store: Store of the outputs, in memory (ResultCache) or on disk (DiskCache). It can be shared by
+            several Cache layers. If None, a new ResultCache bounded by ``max_entries`` and ``max_bytes`` is created.
+        :param max_entries: Maximum number of outputs kept by the new store. None means no limit.
+        :param max_bytes: Maximum estimated size in bytes of the outputs kept by the new store. None means no limit.
+        :param kwargs: Additional arguments passed to Layer.
+        """
+        kwargs.setdefault("name", f"Cache({layer.name})")
+        super().__init__(inputs=layer.inputs, outputs=layer.outputs,
+                         input_type="kwargs", output_type="dict", call_type="dict", **kwargs)
+
+        self.__layer = layer
+        self.__store = store if store is not None else ResultCache(max_entries, max_bytes)
+        self.__layer_fingerprint = None
+
+    def call(self, inputs: dict[str, Any]) -> dict[str, Any]:
+        return self.__call_cached(inputs, list(map(str, self.actual_inputs)), list(map(str, self.actual_outputs)))
+
+    async def call_async(self, inputs: dict[str, Any]) -> dict[str, Any]:
+        return await self.__acall_cached(inputs,
+                                         list(map(str, self.actual_inputs)),
+                                         list(map(str, self.actual_outputs)))
+
+    def _call_initialized(self,
+                          kwargs: dict[str, Any],
+                          actual_input_names: list[str],
+                          actual_output_names: list[str]) -> dict[str, Any]:
+        return self.__call_cached(kwargs, actual_input_names, actual_output_names)
+
+    async def _acall_initialized(self,
+                                 kwargs: dict[str, Any],
+                                 actual_input_names: list[str],
+                                 actual_output_names: list[str]) -> dict[str, Any]:
+        return await self.__acall_cached(kwargs, actual_input_names, actual_output_names)
+
+    def _call_changed(self,
+                      kwargs: dict[str, Any],
+                      actual_input_names: list[str],
+                      actual_output_names: list[str],
+                      changed_names: set[str]) -> dict[str, Any]:
+        # On a miss the wrapped layer recomputes only the outputs depending on the changed inputs (e.g. some
+        # combinations of a GridMap), which are not stored as they are not the full outputs for the key
+        key = self.key(kwargs, actual_input_names, actual_output_names)
+
+        if key is not None and (outputs := self.__store.get(key)) is not None:
+            return outputs
+
+        return self.__layer._call_changed(kwargs, actual_input_names, actual_output_names, changed_names)
+
+    def __call_cached(self,
+                      kwargs: dict[str, Any],
+                      actual_input_names: list[str],
+                      actual_output_names: list[str]) -> dict[str, Any]:
+        key = self.key(kwargs, actual_input_names, actual_output_names)
+
+        if key is not None and (outputs := self.__store.get(key)) is not None:
+            return outputs
+
+        outputs = self.__layer._call_initialized(kwargs, actual_input_names, actual_output_names)
+
+        if key is not None:
+            self.__store.put(key, outputs)
+
+        return outputs
+
+    async def __acall_cached(self,
+                             kwargs: dict[str, Any],
+                             actual_input_names: list[str],
+                             actual_output_names: list[str]) -> dict[str, Any]:
+        key = self.key(kwargs, actual_input_names, actual_output_names)
+
+        if key is not None and (outputs := self.__store.get(key)) is not None:
+            return outputs
+
+        outputs = await self.__layer._acall_initialized(kwargs, actual_input_names, actual_output_names)
+
+        if key is not None:
+            self.__store.put(key, outputs)
+
+        return outputs
+
+    def key(self, kwargs: dict[str, Any], actual_input_names: list[str], actual_output_names: list[str]) -> str | None:
+        """
+        Returns the key of the outputs of the wrapped layer for the given inputs, or None if the layer or the
+        inputs can not be fingerprinted, in which case the outputs are not cached.
+        """
+        try:
+            if self.__layer_fingerprint is None:
+                self.__layer_fingerprint = self.__layer.fingerprint()
+
+            inputs_fingerprint = fingerprint_value(([(name, kwargs[name]) for name in actual_input_names],
+                                                    actual_output_names))
+        except UnhashableValueError as e:
+            warnings.warn(f"Layer '{self.__layer.name}' is executed without cache: {e}", RuntimeWarning)
+            return None
+
+        return f"{self.__layer_fingerprint}-{inputs_fingerprint}"
+
+    def init(self,
+             state: dict[str, Any],
+             state_producers: dict[str, list[Layer]] | None = None,
+             state_index: TemplateIndex | None = None) -> Self:
+        # The names are resolved by the wrapped layer, as if it was in the graph in place of the cache
+        if state_producers is not None:
+            state_producers = _ProducersView(state_producers, self, self.__layer)
+
+        self.__layer.init(state, state_producers, state_index)
+        return self
+
+    def _code(self):
+        return self.__layer.fingerprint()
+
+    @property
+    def layer(self) -> Layer:
+        return self.__layer
+
+    @property
+    def store(self) -> ResultCache | DiskCache:
+        return self.__store
+
+    @property
+    def actual_inputs(self) -> list[TemplateValue]:
+        return self.__layer.actual_inputs
+
+    @property
+    def actual_outputs(self) -> list[TemplateValue]:
+        return self.__layer.actual_outputs
+
+    @property
+    def predecessors(self) -> list[Layer]:
+        return self.__layer.predecessors
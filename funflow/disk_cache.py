@@ -0,0 +1,234 @@
+import math
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+from .optional import loaded_module
+from .result_cache import ResultCacheInfo
+
+ENTRY_FILE = "outputs.pkl"
+TMP_DIRECTORY = ".tmp"
+# Fraction of the bounds freed when they are exceeded, so that the next writes do not scan the directory again
+EVICTION_BATCH = 0.1
+
+
+class DiskCache:
+    """
+    Store of layer outputs in a directory, shared by the processes using the same directory and kept across runs.
+
+    Each entry is a subdirectory named after its key. NumPy arrays are saved as ``.npy`` files and loaded as
+    read-only memory maps, so warm runs neither unpickle nor copy them in memory; the other outputs are pickled.
+    Entries are written in a temporary directory and moved in place with an atomic rename, so concurrent writers
+    never expose partial entries. When the bounds are exceeded, the least recently used entries are deleted until
+    a tenth of the bounds is free.
+
+    Keys are built from layer fingerprints, which include the layer names: layers without an explicit name are
+    named after their creation order, so they should be named to share the entries across programs.
+    """
+
+    def __init__(self,
+                 directory: str | os.PathLike,
+                 max_bytes: int | None = None,
+                 max_entries: int | None = None,
+                 mmap: bool = True):
+        """
+
+        :param directory: Directory of the entries, created if it does not exist.
+        :param max_bytes: Maximum size in bytes of the files of the entries. None means no limit.
+        :param max_entries: Maximum number of entries. None means no limit.
+        :param mmap: If True, the arrays are memory-mapped in read-only mode, otherwise they are read in memory.
+        """
+        assert max_bytes is None or max_bytes >= 0, f"max_bytes must be None or non negative, but got {max_bytes}"
+        assert max_entries is None or max_entries >= 0, \
+            f"max_entries must be None or non negative, but got {max_entries}"
+
+        self.__directory = Path(directory)
+        self.__tmp_directory = self.__directory / TMP_DIRECTORY
+        self.__tmp_directory.mkdir(parents=True, exist_ok=True)
+
+        self.__max_bytes = max_bytes
+        self.__max_entries = max_entries
+        self.__mmap = mmap
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+        # key => size of the entries, least recently used first, built from the directory on the first write.
+        # Other processes sharing the directory are only seen when it is scanned again.
+        self.__index: OrderedDict[str, int] | None = None
+        self.__index_bytes = 0
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        entry = self.__directory / key
+
+        try:
+            with open(entry / ENTRY_FILE, "rb") as f:
+                items = pickle.load(f)
+
+            outputs = {name: self.__load_array(entry / payload) if kind == "array" else payload
+                       for name, kind, payload in items}
+        except (FileNotFoundError, NotADirectoryError):
+            # Missing, or deleted by another process while loading it
+            with self.__lock:
+                self.__misses += 1
+            return None
+
+        try:
+            # The modification time of the entry file records the last use of the entry
+            os.utime(entry / ENTRY_FILE)
+        except (FileNotFoundError, NotADirectoryError):
+            # Evicted by another process after being loaded, the loaded outputs (and memory maps) stay valid
+            pass
+
+        with self.__lock:
+            self.__hits += 1
+            if self.__index is not None and key in self.__index:
+                self.__index.move_to_end(key)
+        return outputs
+
+    def __load_array(self, path: Path) -> Any:
+        import numpy as np  # Arrays are only stored when NumPy is available
+        return np.load(path, mmap_mode="r" if self.__mmap else None, allow_pickle=False)
+
+    def put(self, key: str, outputs: dict[str, Any]):
+        if self.__max_entries == 0:
+            return
+
+        tmp_entry = Path(tempfile.mkdtemp(dir=self.__tmp_directory))
+
+        try:
+            self.__write_entry(tmp_entry, outputs)
+        except Exception as e:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            warnings.warn(f"Unable to store the outputs {list(outputs)} on disk: {e!r}", RuntimeWarning)
+            return
+
+        size = get_directory_size(tmp_entry)
+        if self.__max_bytes is not None and size > self.__max_bytes:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+
+        try:
+            os.rename(tmp_entry, self.__directory / key)
+        except OSError:
+            # Another writer stored the same entry first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.__evict(key, size)
+
+    @staticmethod
+    def __write_entry(entry: Path, outputs: dict[str, Any]):
+        items = []
+        np = loaded_module("numpy")  # Without NumPy, every output is pickled
+
+        for i, (name, value) in enumerate(outputs.items()):
+            # Empty files can not be memory-mapped, so empty arrays are pickled
+            if np is not None and isinstance(value, np.ndarray) and not value.dtype.hasobject and value.nbytes > 0:
+                file_name = f"{i}.npy"
+                np.save(entry / file_name, value, allow_pickle=False)
+                items.append((name, "array", file_name))
+            else:
+                items.append((name, "value", value))
+
+        with open(entry / ENTRY_FILE, "wb") as f:
+            pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __entries(self) -> list[tuple[float, int, Path]]:
+        """
+        Returns the last use time, size and path of every entry.
+        """
+        entries = []
+
+        for entry in os.scandir(self.__directory):
+            if entry.name == TMP_DIRECTORY or not entry.is_dir():
+                continue
+
+            try:
+                last_use = os.stat(os.path.join(entry.path, ENTRY_FILE)).st_mtime
+                entries.append((last_use, get_directory_size(Path(entry.path)), Path(entry.path)))
+            except FileNotFoundError:
+                continue
+
+        return entries
+
+    def __evict(self, key: str, size: int):
+        """
+        Records a new entry and, when the bounds are exceeded, evicts the least recently used entries.
+        """
+        if self.__max_bytes is None and self.__max_entries is None:
+            return
+
+        with self.__lock:
+            if self.__index is not None:
+                self.__index_bytes += size - self.__index.pop(key, 0)
+                self.__index[key] = size
+
+                if not self.__exceeds(len(self.__index), self.__index_bytes):
+                    return
+
+            # The directory is scanned again, as other processes may have added, used or removed entries
+            entries = sorted(self.__entries(), key=lambda entry: entry[0])
+            self.__index = OrderedDict((path.name, entry_size) for _, entry_size, path in entries)
+            self.__index_bytes = sum(self.__index.values())
+
+            if not self.__exceeds(len(self.__index), self.__index_bytes):
+                return
+
+            while self.__index and self.__exceeds(len(self.__index), self.__index_bytes, EVICTION_BATCH):
+                evicted_key, evicted_size = self.__index.popitem(last=False)
+                self.__index_bytes -= evicted_size
+                self.__remove(self.__directory / evicted_key)
+
+    def __exceeds(self, n_entries: int, n_bytes: int, margin: float = 0.0) -> bool:
+        # The margin on the number of entries is rounded down, so small bounds are kept exactly
+        return ((self.__max_entries is not None
+                 and n_entries > self.__max_entries - math.floor(self.__max_entries * margin))
+                or (self.__max_bytes is not None and n_bytes > self.__max_bytes * (1 - margin)))
+
+    def __remove(self, path: Path):
+        # The entry is moved away first, so that readers never see it partially deleted. Memory maps of its
+        # arrays remain valid after the files are deleted.
+        trash = Path(tempfile.mkdtemp(dir=self.__tmp_directory)) / path.name
+
+        try:
+            os.rename(path, trash)
+        except OSError:
+            # Already removed by another process
+            pass
+
+        shutil.rmtree(trash.parent, ignore_errors=True)
+
+    def clear(self):
+        for _, _, path in self.__entries():
+            self.__remove(path)
+
+        with self.__lock:
+            self.__hits = 0
+            self.__misses = 0
+            self.__index = None
+
+    def info(self) -> ResultCacheInfo:
+        entries = self.__entries()
+        return ResultCacheInfo(self.__hits, self.__misses, self.__max_entries, self.__max_bytes,
+                               len(entries), sum(size for _, size, _ in entries))
+
+    @property
+    def directory(self) -> Path:
+        return self.__directory
+
+    def __contains__(self, key: str) -> bool:
+        return (self.__directory / key / ENTRY_FILE).exists()
+
+    def __len__(self) -> int:
+        return len(self.__entries())
+
+    def __reduce__(self):
+        return DiskCache, (self.__directory, self.__max_bytes, self.__max_entries, self.__mmap)
+
+
+def get_directory_size(directory: Path) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
@@ -0,0 +1,513 @@
+import argparse
+import itertools
+import multiprocessing
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, NamedTuple
+from .layer import Layer
+from .release import ConsumerCounts
+from .result_cache import estimate_size
+
+Address = tuple[str, int]
+
+# Length prefix of the messages exchanged with the workers
+_HEADER = struct.Struct("!Q")
+
+
+class RemoteValue(NamedTuple):
+    """
+    Reference to a value kept in the memory of the node that computed it.
+    """
+    key: str
+    node: Any  # Node that computed the value, as listed by the backend
+    nbytes: int
+
+
+class LayerTask(NamedTuple):
+    """
+    Invocation of a layer sent to a node: the layer, its resolved input and output names and its input values.
+    """
+    key: str  # Prefix of the keys of the outputs
+    layer: Layer
+    inputs: dict[str, Any]  # name => value, or RemoteValue for the values held by the nodes
+    actual_input_names: list[str]
+    actual_output_names: list[str]
+    stored_inputs: dict[str, str]  # name of an input sent by value => key under which the node keeps it
+
+
+class TaskResult(NamedTuple):
+    outputs: dict[str, RemoteValue]
+    held: list[str]  # Keys of the other values copied to the node while running the task
+
+
+class DistributedBackend(ABC):
+    """
+    Interface of the clusters running the layers of a plan on several nodes. The outputs of a layer stay in the
+    memory of the node that ran it, and the state of the plan only holds references to them (RemoteValue), so
+    that values are moved between nodes only when a layer needs them. See DistributedRun for the scheduling.
+    """
+
+    @property
+    @abstractmethod
+    def nodes(self) -> list[Any]:
+        pass
+
+    @abstractmethod
+    def run_task(self, node: Any, task: LayerTask) -> TaskResult:
+        """
+        Runs a layer on ``node``, which fetches the inputs it does not hold from the other nodes. If the layer
+        fails, the node drops the inputs it stored or fetched for it.
+
+        :raises Exception: The exception raised by the layer.
+        """
+
+    @abstractmethod
+    def fetch(self, node: Any, keys: list[str]) -> list[Any]:
+        pass
+
+    @abstractmethod
+    def drop(self, node: Any, keys: list[str]):
+        pass
+
+
+class DistributedRun:
+    """
+    Runs the layers submitted by an ExecutionPlan on the nodes of a DistributedBackend, in place of an executor.
+    The plan schedulers only submit a layer once its predecessors have completed, and each layer is sent to the
+    node already holding the largest share (in bytes) of its inputs, or to the least busy node when no node holds
+    them, e.g. for the layers reading only the inputs of the model.
+
+    Values are dropped from the nodes as soon as all the layers reading them have run, unless ``keep`` returns
+    True for their names. An instance is meant for a single run of a plan.
+    """
+    # Every layer is submitted, also when a level has a single layer
+    remote = True
+
+    def __init__(self, backend: DistributedBackend, keep: Callable[[str], bool] | None = None):
+        """
+
+        :param backend: Cluster running the layers.
+        :param keep: Returns True for the names that must be kept until the end of the run, e.g. the outputs.
+            If None, all the names are kept.
+        """
+        self.__backend = backend
+        self.__nodes = list(backend.nodes)
+        assert self.__nodes, "The backend has no nodes"
+
+        self.__keep = keep if keep is not None else lambda name: True
+        self.__run_key = uuid.uuid4().hex
+        self.__task_ids = itertools.count()
+        # Threads waiting for the nodes, the tasks run concurrently on the nodes
+        self.__pool = ThreadPoolExecutor(max_workers=4 * len(self.__nodes))
+        self.__lock = threading.Lock()
+
+        self.__holders: dict[str, set[Any]] = defaultdict(set)  # key => nodes holding the value
+        self.__running: Counter[Any] = Counter()  # node => tasks submitted and not completed
+        self.__uploaded: dict[str, RemoteValue] = dict()  # name of an input sent by value => its copy on a node
+        self.__name_keys: dict[str, set[str]] = defaultdict(set)
+        self.__dropped: set[str] = set()
+        self.__consumers = ConsumerCounts()
+
+    def start(self, layers_input_names: Iterable[list[str]]):
+        """
+        :param layers_input_names: For each layer that will run, the names it reads from the state.
+        """
+        self.__consumers.add(layers_input_names)
+
+    def submit(self,
+               executor: Executor | None,
+               layer: Layer,
+               layer_inputs: dict[str, Any],
+               actual_input_names: list[str],
+               actual_output_names: list[str]) -> Future:
+        """
+        Sends the call of ``layer`` to a node, ``executor`` is not used. The result of the future must be passed to
+        ``receive``.
+        """
+        with self.__lock:
+            node = self.__choose_node(layer_inputs)
+            self.__running[node] += 1
+
+            task_key = f"{self.__run_key}/{next(self.__task_ids)}"
+            inputs, stored_inputs = dict(), dict()
+
+            for name, value in layer_inputs.items():
+                reference = self.__reference(name, value)
+
+                if reference is not None and (isinstance(value, RemoteValue) or node in self.__holders[reference.key]):
+                    inputs[name] = reference
+                else:
+                    # Inputs of the model are sent with the first tasks using them on a node, which keeps a copy
+                    inputs[name] = value
+                    stored_inputs[name] = f"{self.__run_key}/input/{name}"
+
+        task = LayerTask(task_key, layer, inputs, actual_input_names, actual_output_names, stored_inputs)
+        sizes = {name: estimate_size(layer_inputs[name]) for name in stored_inputs}
+        return self.__pool.submit(self.__run_task, node, task, sizes)
+
+    def receive(self, outputs: dict[str, RemoteValue]) -> dict[str, RemoteValue]:
+        """
+        Records the references to the outputs of a layer, which are stored in the state in place of the values.
+        """
+        with self.__lock:
+            for name, reference in outputs.items():
+                self.__name_keys[name].add(reference.key)
+
+        return outputs
+
+    def layer_done(self, input_names: list[str]):
+        """
+        Drops from the nodes the values that no remaining layer reads and that are not kept.
+        """
+        for name in self.__consumers.consume(input_names):
+            if not self.__keep(name):
+                with self.__lock:
+                    keys = self.__name_keys.pop(name, set())
+                    self.__uploaded.pop(name, None)
+                self.__drop(keys)
+
+    def gather(self, state: dict[str, Any]) -> dict[str, Any]:
+        """
+        Replaces the references in ``state`` with their values, fetched from the nodes. The names that are not
+        kept are removed from the state instead.
+        """
+        names_by_node = defaultdict(list)
+
+        for name, value in list(state.items()):
+            if not isinstance(value, RemoteValue):
+                continue
+
+            if value.key in self.__dropped or not self.__keep(name):
+                del state[name]
+            else:
+                names_by_node[value.node].append(name)
+
+        for node, names in names_by_node.items():
+            state.update(zip(names, self.__backend.fetch(node, [state[name].key for name in names])))
+
+        return state
+
+    def close(self):
+        """
+        Drops all the values of the run from the nodes.
+        """
+        self.__pool.shutdown()
+        self.__drop(list(self.__holders.keys()))
+
+    def __reference(self, name: str, value: Any) -> RemoteValue | None:
+        return value if isinstance(value, RemoteValue) else self.__uploaded.get(name)
+
+    def __choose_node(self, layer_inputs: dict[str, Any]) -> Any:
+        local_bytes = Counter()
+
+        for name, value in layer_inputs.items():
+            reference = self.__reference(name, value)
+            if reference is not None:
+                for node in self.__holders[reference.key]:
+                    local_bytes[node] += reference.nbytes
+
+        # Ties are broken by the number of running tasks, then by the order of the nodes
+        return max(self.__nodes, key=lambda node: (local_bytes[node], -self.__running[node]))
+
+    def __run_task(self, node: Any, task: LayerTask, sizes: dict[str, int]) -> dict[str, RemoteValue]:
+        try:
+            result = self.__backend.run_task(node, task)
+        finally:
+            with self.__lock:
+                self.__running[node] -= 1
+
+        outputs = {name: reference._replace(node=node) for name, reference in result.outputs.items()}
+
+        with self.__lock:
+            for key in itertools.chain(result.held, (reference.key for reference in outputs.values())):
+                self.__holders[key].add(node)
+
+            for name, key in task.stored_inputs.items():
+                self.__uploaded.setdefault(name, RemoteValue(key, node, sizes[name]))
+                self.__name_keys[name].add(key)
+
+        return outputs
+
+    def __drop(self, keys: Iterable[str]):
+        keys_by_node = defaultdict(list)
+
+        with self.__lock:
+            for key in keys:
+                self.__dropped.add(key)
+                for node in self.__holders.pop(key, ()):
+                    keys_by_node[node].append(key)
+
+        for node, node_keys in keys_by_node.items():
+            self.__backend.drop(node, node_keys)
+
+
+def send_message(sock: socket.socket, message: Any):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)))
+    sock.sendall(data)
+
+
+def receive_message(sock: socket.socket) -> Any:
+    size, = _HEADER.unpack(_receive_exactly(sock, _HEADER.size))
+    return pickle.loads(_receive_exactly(sock, size))
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytearray:
+    data = bytearray(size)
+    view = memoryview(data)
+
+    while view:
+        received = sock.recv_into(view)
+        if received == 0:
+            raise ConnectionError("The connection was closed before the end of the message")
+        view = view[received:]
+
+    return data
+
+
+def request(address: Address, operation: str, payload: Any, timeout: float | None = None) -> Any:
+    """
+    Sends a request to a TCPWorker and returns its result.
+
+    :raises Exception: The exception raised by the worker while handling the request.
+    """
+    with socket.create_connection(address, timeout=timeout) as sock:
+        send_message(sock, (operation, payload))
+        status, result = receive_message(sock)
+
+    if status == "error":
+        raise result
+    return result
+
+
+class _WorkerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address: Address, worker: "TCPWorker"):
+        super().__init__(address, _WorkerRequestHandler)
+        self.worker = worker
+
+
+class _WorkerRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        operation, payload = receive_message(self.request)
+
+        try:
+            message = ("ok", self.server.worker.handle(operation, payload))
+            send_message(self.request, message)
+        except Exception as e:
+            try:
+                send_message(self.request, ("error", e))
+            except Exception:  # The exception can not be pickled
+                send_message(self.request, ("error", RuntimeError(repr(e))))
+
+
+class TCPWorker:
+    """
+    Node of a TCPBackend. It runs the layers it receives, keeps their outputs in memory and serves them to the
+    coordinator and to the other workers.
+
+    Messages are pickled, so workers must only listen on trusted networks, and the functions of the layers must
+    be importable by the workers, as with process pools.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, max_tasks: int = 1):
+        """
+
+        :param host: Address the worker listens on, which must be reachable by the coordinator and the other
+            workers.
+        :param port: Port the worker listens on, 0 picks a free port.
+        :param max_tasks: Maximum number of layers running at the same time.
+        """
+        assert max_tasks > 0, f"max_tasks must be positive, but got {max_tasks}"
+
+        self.__values: dict[str, Any] = dict()
+        self.__lock = threading.Lock()
+        self.__slots = threading.Semaphore(max_tasks)
+        self.__server = _WorkerServer((host, port), self)
+
+    @property
+    def address(self) -> Address:
+        return self.__server.server_address[:2]
+
+    def serve_forever(self):
+        self.__server.serve_forever()
+
+    def shutdown(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def handle(self, operation: str, payload: Any) -> Any:
+        match operation:
+            case "run":
+                return self.__run(payload)
+            case "get":
+                with self.__lock:
+                    return [self.__values[key] for key in payload]
+            case "drop":
+                with self.__lock:
+                    for key in payload:
+                        self.__values.pop(key, None)
+            case "keys":
+                with self.__lock:
+                    return list(self.__values.keys())
+            case _:
+                raise ValueError(f"Allowed operations are 'run', 'get', 'drop' and 'keys', but got {operation}")
+
+    def __run(self, task: LayerTask) -> TaskResult:
+        inputs, held, missing = dict(), [], defaultdict(list)
+
+        with self.__lock:
+            for name, value in task.inputs.items():
+                if not isinstance(value, RemoteValue):
+                    inputs[name] = value
+                elif value.key in self.__values:
+                    inputs[name] = self.__values[value.key]
+                else:
+                    missing[value.node].append((name, value.key))
+
+            for name, key in task.stored_inputs.items():
+                self.__values[key] = inputs[name]
+                held.append(key)
+
+        # Keys added by this task. The coordinator only records the keys held by a node when the task succeeds, so
+        # they are removed if it fails.
+        added = list(held)
+        try:
+            # Values held by other nodes are fetched from them and kept, as the next layers reading them may run here
+            for node, names_keys in missing.items():
+                values = request(node, "get", [key for _, key in names_keys])
+
+                with self.__lock:
+                    for (name, key), value in zip(names_keys, values):
+                        if key not in self.__values:
+                            added.append(key)
+                        inputs[name] = self.__values[key] = value
+                        held.append(key)
+
+            with self.__slots:
+                outputs = task.layer._call_initialized(inputs, task.actual_input_names, task.actual_output_names)
+        except BaseException:
+            with self.__lock:
+                for key in added:
+                    self.__values.pop(key, None)
+            raise
+
+        references = dict()
+        with self.__lock:
+            for name, value in outputs.items():
+                key = f"{task.key}/{name}"
+                self.__values[key] = value
+                # The coordinator fills in the node
+                references[name] = RemoteValue(key, None, estimate_size(value))
+
+        return TaskResult(references, held)
+
+
+class TCPBackend(DistributedBackend):
+    """
+    Cluster of TCPWorkers, each request is sent on a new connection.
+    """
+
+    def __init__(self, addresses: Iterable[Address], timeout: float | None = None):
+        """
+
+        :param addresses: (host, port) of the workers.
+        :param timeout: Timeout in seconds of the connections, None waits indefinitely for the layers to complete.
+        """
+        self.__addresses = [tuple(address) for address in addresses]
+        self.__timeout = timeout
+
+    @property
+    def nodes(self) -> list[Address]:
+        return self.__addresses
+
+    def run_task(self, node: Address, task: LayerTask) -> TaskResult:
+        return request(node, "run", task, self.__timeout)
+
+    def fetch(self, node: Address, keys: list[str]) -> list[Any]:
+        return request(node, "get", keys, self.__timeout)
+
+    def drop(self, node: Address, keys: list[str]):
+        request(node, "drop", keys, self.__timeout)
+
+    def keys(self, node: Address) -> list[str]:
+        """
+        Returns the keys of the values held by a worker.
+        """
+        return request(node, "keys", None, self.__timeout)
+
+
+def _serve(connection, host: str, max_tasks: int):
+    worker = TCPWorker(host, 0, max_tasks)
+    connection.send(worker.address)
+    connection.close()
+    worker.serve_forever()
+
+
+class LocalCluster:
+    """
+    TCPWorkers running in local processes, e.g. to test a distributed model on a single machine.
+
+        with LocalCluster(4) as cluster:
+            model = Model(layers, backend=cluster.backend())
+    """
+
+    def __init__(self, n_workers: int, max_tasks: int = 1, host: str = "127.0.0.1"):
+        assert n_workers > 0, f"n_workers must be positive, but got {n_workers}"
+
+        self.__processes = []
+        self.__addresses = []
+
+        for _ in range(n_workers):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_serve, args=(sender, host, max_tasks), daemon=True)
+            process.start()
+            sender.close()
+
+            self.__processes.append(process)
+            self.__addresses.append(receiver.recv())
+            receiver.close()
+
+    @property
+    def addresses(self) -> list[Address]:
+        return self.__addresses
+
+    def backend(self, timeout: float | None = None) -> TCPBackend:
+        return TCPBackend(self.__addresses, timeout)
+
+    def close(self):
+        for process in self.__processes:
+            process.terminate()
+        for process in self.__processes:
+            process.join()
+
+    def __enter__(self) -> "LocalCluster":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Starts a worker of a TCPBackend.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--max-tasks", type=int, default=1, help="Maximum number of layers running at once.")
+    args = parser.parse_args()
+
+    worker = TCPWorker(args.host, args.port, args.max_tasks)
+    print(f"Worker listening on {worker.address[0]}:{worker.address[1]}")
+    worker.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
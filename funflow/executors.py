@@ -0,0 +1,108 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor, Future
+from typing import Any, Iterable
+from . import profiling
+from .layer import Layer
+from .distributed import DistributedRun
+from .shared_state import SharedMemoryTransport
+
+EXECUTORS = {
+    "threads": ThreadPoolExecutor,
+    "processes": ProcessPoolExecutor,
+}
+
+# Objects moving the layer calls and their values to the workers, in place of plain executor submissions
+Transport = SharedMemoryTransport | DistributedRun
+
+
+class LayerExecutionError(RuntimeError):
+    """
+    Raised when a layer run by an ExecutionPlan fails. The original exception is available as ``__cause__``.
+    """
+
+    def __init__(self, layer_name: str, error: BaseException):
+        super().__init__(f"Error while executing layer '{layer_name}': {error!r}")
+        self.layer_name = layer_name
+
+
+def create_executor(executor: str | Executor | None, max_workers: int | None = None) -> Executor | None:
+    if executor is None or isinstance(executor, Executor):
+        return executor
+
+    assert executor in EXECUTORS, \
+        f"Allowed executors are {list(EXECUTORS.keys())} or an Executor instance, but got {executor}"
+
+    return EXECUTORS[executor](max_workers=max_workers)
+
+
+def call_layer(layer: Layer,
+               layer_inputs: dict[str, Any],
+               actual_input_names: list[str],
+               actual_output_names: list[str]) -> dict[str, Any]:
+    # Module level function so that it can be pickled by process pools
+    return layer._call_initialized(layer_inputs, actual_input_names, actual_output_names)
+
+
+def submit_layer(executor: Executor | None,
+                 layer: Layer,
+                 call_args: tuple,
+                 transport: Transport | None = None) -> Future:
+    if transport is not None:
+        return transport.submit(executor, layer, *call_args)
+    return profiling.submit(executor, call_layer, layer, *call_args)
+
+
+def get_layer_result(layer: Layer, future: Future, transport: Transport | None = None) -> dict[str, Any]:
+    try:
+        if transport is not None:
+            return transport.receive(profiling.worker_result(future.result()))
+        return profiling.worker_result(future.result())
+    except Exception as e:
+        raise LayerExecutionError(layer.name, e) from e
+
+
+def run_level(level: list[Layer],
+              level_call_args: list[tuple],
+              executor: Executor | None,
+              transport: Transport | None = None) -> list[dict[str, Any]]:
+    """
+    Runs all the layers of a level concurrently on ``executor``, or on the nodes of a remote transport.
+
+    :param level: Layers to be run.
+    :param level_call_args: For each layer, the arguments of ``call_layer`` following the layer.
+    :param transport: If provided, the layers are submitted through it, see ``Transport``.
+    :return: The outputs of the layers, in the same order as ``level``.
+    """
+    futures = [submit_layer(executor, layer, call_args, transport) for layer, call_args in zip(level, level_call_args)]
+
+    results = []
+    try:
+        for layer, future in zip(level, futures):
+            results.append(get_layer_result(layer, future, transport))
+    except LayerExecutionError:
+        # The futures before the failed one have been received
+        discard_layer_results(futures[len(results) + 1:], transport)
+        raise
+
+    return results
+
+
+def discard_layer_results(futures: Iterable[Future], transport: Transport | None = None):
+    """
+    Cancels the layer calls that have not started, after a layer failed. With a transport, the calls already
+    started are waited for and their results are received, so that the transport releases them when it is closed.
+    """
+    started = [future for future in futures if not future.cancel()]
+    if transport is None:
+        return
+
+    for future in started:
+        try:
+            transport.receive(profiling.worker_result(future.result()))
+        except Exception:
+            # The failed calls release their own resources
+            pass
+
+
+def is_remote(transport: Transport | None) -> bool:
+    # Remote transports run every layer, while the layers run in this process when there is a single one to run
+    return transport is not None and transport.remote
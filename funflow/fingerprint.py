@@ -0,0 +1,139 @@
+import functools
+import hashlib
+import pickle
+import types
+from typing import Any
+from .optional import loaded_module
+
+DIGEST_SIZE = 16
+
+
+class UnhashableValueError(TypeError):
+    """
+    Raised when a value can not be fingerprinted, e.g. because it can not be pickled.
+    """
+
+
+def fingerprint_value(value: Any) -> str:
+    """
+    Returns a hex digest of the content of ``value``. Equal values have equal fingerprints, regardless of their
+    identity. NumPy arrays and pandas objects are hashed from their buffers, containers recursively and any other
+    value from its pickled representation.
+
+    :raises UnhashableValueError: If the value, or one of its items, can not be hashed.
+    """
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    _update(hasher, value, set())
+    return hasher.hexdigest()
+
+
+def fingerprint_function(func: Any) -> str:
+    """
+    Returns a hex digest of the code of ``func``: its qualified name, bytecode, constants, defaults and the values
+    of its closure. Editing the body of a function changes its fingerprint. This is the fingerprint of ``func`` as
+    a value, functions are hashed from their code by ``fingerprint_value``.
+    """
+    assert callable(func), f"fingerprint_function expects a callable, but got {type(func)}"
+    return fingerprint_value(func)
+
+
+# Values that can reference themselves, e.g. a recursive nested function through its closure
+_RECURSIVE_TYPES = (list, tuple, dict, functools.partial, types.MethodType, types.FunctionType)
+
+
+def _update(hasher, value: Any, visiting: set[int]):
+    """
+    :param visiting: Ids of the values being hashed that contain ``value``, used to detect cycles.
+    """
+    if not isinstance(value, _RECURSIVE_TYPES):
+        _update_value(hasher, value, visiting)
+        return
+
+    if id(value) in visiting:
+        raise UnhashableValueError(f"Unable to fingerprint a value of type {type(value)} that references itself")
+
+    visiting.add(id(value))
+    try:
+        _update_value(hasher, value, visiting)
+    finally:
+        visiting.discard(id(value))
+
+
+def _update_value(hasher, value: Any, visiting: set[int]):
+    np, pd = loaded_module("numpy"), loaded_module("pandas")
+
+    if np is not None and isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        # Subclasses such as memory maps have the same fingerprint as the arrays with the same content
+        hasher.update(f"ndarray{value.dtype.str}{value.shape}".encode())
+        hasher.update(memoryview(np.ascontiguousarray(value)).cast("B"))
+        return
+
+    # Every value is prefixed with its type, so that e.g. 1 and "1" have different fingerprints
+    hasher.update(type(value).__qualname__.encode())
+
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        hasher.update(repr(value).encode())
+    elif pd is not None and isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        _update_pandas(hasher, value)
+    elif isinstance(value, (list, tuple)):
+        hasher.update(str(len(value)).encode())
+        for item in value:
+            _update(hasher, item, visiting)
+    elif isinstance(value, dict):
+        hasher.update(str(len(value)).encode())
+        for key, item in value.items():
+            _update(hasher, key, visiting)
+            _update(hasher, item, visiting)
+    elif isinstance(value, (set, frozenset)):
+        # Sets are hashed in an order independent of the iteration order
+        for item_fingerprint in sorted(map(fingerprint_value, value)):
+            hasher.update(item_fingerprint.encode())
+    elif isinstance(value, functools.partial):
+        _update(hasher, (value.func, value.args, value.keywords), visiting)
+    elif isinstance(value, types.MethodType):
+        _update(hasher, value.__func__, visiting)
+        _update(hasher, value.__self__, visiting)
+    elif isinstance(value, types.FunctionType):
+        _update_code(hasher, value.__code__, visiting)
+        hasher.update(f"{value.__module__}.{value.__qualname__}".encode())
+        _update(hasher, value.__defaults__, visiting)
+        _update(hasher, value.__kwdefaults__, visiting)
+        for cell in value.__closure__ or ():
+            try:
+                _update(hasher, cell.cell_contents, visiting)
+            except ValueError:  # Empty cell
+                pass
+    elif isinstance(value, types.CodeType):
+        _update_code(hasher, value, visiting)
+    elif isinstance(value, (type, types.BuiltinFunctionType)):
+        hasher.update(f"{value.__module__}.{value.__qualname__}".encode())
+    else:
+        try:
+            hasher.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            raise UnhashableValueError(f"Unable to fingerprint a value of type {type(value)}: {e!r}") from e
+
+
+def _update_code(hasher, code: types.CodeType, visiting: set[int]):
+    hasher.update(code.co_code)
+    hasher.update(repr(code.co_names).encode())
+
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code(hasher, const, visiting)
+        else:
+            _update(hasher, const, visiting)
+
+
+def _update_pandas(hasher, value):
+    pd = loaded_module("pandas")
+
+    if isinstance(value, pd.DataFrame):
+        _update(hasher, [str(column) for column in value.columns], set())
+        _update(hasher, [str(dtype) for dtype in value.dtypes], set())
+    else:
+        hasher.update(f"{value.name}{value.dtype}".encode())
+
+    hashes = pd.util.hash_pandas_object(value, index=not isinstance(value, pd.Index))
+    hasher.update(str(len(value)).encode())
+    hasher.update(memoryview(hashes.to_numpy()).cast("B"))
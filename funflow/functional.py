@@ -16,3 +16,5 @@ class Functional(Layer):
     def call(self, *args, **kwargs):
         return self.__func(*args, **kwargs)
 
+    def _code(self):
+        return self.__func
@@ -1,9 +1,128 @@
+import asyncio
+import inspect
 import itertools
-from typing import Callable, Any
-from .layer import Layer
-from .template_utils import replace_multi_templates, create_name_to_inputs_mapping
+import math
+import threading
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor, wait
+from typing import Callable, Any, Iterator, Self
+from . import profiling
+from .layer import Layer, run_coroutine
+from .optional import loaded_module
+from .shared_state import create_pickled_block, load_pickled_block, unlink_block, start_resource_tracker
+from .template_utils import create_name_to_inputs_mapping, iterate_consistent_combinations
 from .templates import Template, TemplateValue
 
+# A function call is described by the names of its positional arguments and by the mapping from the keyword
+# arguments to the names of their values. In batched mode a call is a list of such descriptions.
+FuncCall = tuple[tuple[str, ...], dict[str, str]]
+
+
+def stack_values(values: list[Any]) -> Any:
+    """
+    Stacks the values along a new first axis if they are all NumPy arrays, otherwise returns them as a list.
+    """
+    np = loaded_module("numpy")
+    if np is not None and values and all(isinstance(value, np.ndarray) for value in values):
+        return np.stack(values)
+
+    return list(values)
+
+
+def get_batch_signature(values: dict[str, Any], func_call: FuncCall) -> tuple:
+    # Function calls with the same signature have inputs that can be stacked together
+    np = loaded_module("numpy")
+
+    def value_signature(name: str):
+        value = values[name]
+        if np is not None and isinstance(value, np.ndarray):
+            return value.shape, value.dtype
+        return None
+
+    arg_names, kwarg_names = func_call
+    return (tuple(map(value_signature, arg_names)),
+            tuple((key, value_signature(name)) for key, name in kwarg_names.items()))
+
+
+def get_func_call_input_names(func_call: FuncCall) -> list[str]:
+    arg_names, kwarg_names = func_call
+    return [*arg_names, *kwarg_names.values()]
+
+
+def get_calls_input_names(func_call: FuncCall | list[FuncCall], batched: bool) -> list[str]:
+    return [name for call in (func_call if batched else [func_call]) for name in get_func_call_input_names(call)]
+
+
+def count_func_outputs(outputs: Any) -> int:
+    if outputs is None:
+        return 0
+    return len(outputs) if isinstance(outputs, (tuple, dict)) else 1
+
+
+def call_func(func: Callable,
+              values: dict[str, Any],
+              func_call: FuncCall | list[FuncCall],
+              batched: bool,
+              layer_name: str | None = None) -> Any:
+    """
+    Calls ``func`` on the values of a combination, or of a batch of combinations in batched mode.
+
+    :param layer_name: If provided and profiling is active, the call is recorded as a combination of the layer.
+    """
+    if layer_name is not None and profiling.active_profilers:
+        input_names = get_calls_input_names(func_call, batched)
+        return profiling.profile_call("combination", layer_name, ", ".join(input_names), len(input_names),
+                                      lambda: call_func(func, values, func_call, batched),
+                                      count_func_outputs)
+
+    if not batched:
+        arg_names, kwarg_names = func_call
+        return func(*(values[name] for name in arg_names), **{key: values[name] for key, name in kwarg_names.items()})
+
+    arg_names_batch, kwarg_names_batch = zip(*func_call)
+    stacked_args = (stack_values([values[name] for name in names]) for names in zip(*arg_names_batch))
+    stacked_kwargs = {key: stack_values([values[kwarg_names[key]] for kwarg_names in kwarg_names_batch])
+                      for key in kwarg_names_batch[0]}
+
+    return func(*stacked_args, **stacked_kwargs)
+
+
+def call_func_chunk(func: Callable,
+                    values: dict[str, Any],
+                    func_calls: list,
+                    batched: bool,
+                    layer_name: str | None = None) -> list[Any]:
+    return [call_func(func, values, func_call, batched, layer_name) for func_call in func_calls]
+
+
+# Function of the GridMap owning the process pool of the worker, sent once per worker
+_worker_func: Callable | None = None
+# Name of the block holding the values shared by the chunks of the current call, and the values loaded from it
+_worker_shared_values: tuple[str | None, dict[str, Any]] = (None, {})
+
+
+def _init_worker(func: Callable):
+    global _worker_func
+    _worker_func = func
+
+
+def _call_worker_func_chunk(shared_block: str | None,
+                            values: dict[str, Any],
+                            func_calls: list,
+                            batched: bool,
+                            layer_name: str) -> list[Any]:
+    """
+    :param shared_block: Block of the values used by several chunks of the call, loaded once by each worker and
+        kept until the next call.
+    :param values: Values used only by this chunk.
+    """
+    global _worker_shared_values
+    if shared_block is not None and _worker_shared_values[0] != shared_block:
+        _worker_shared_values = (shared_block, load_pickled_block(shared_block))
+
+    shared_values = _worker_shared_values[1] if shared_block is not None else {}
+    return call_func_chunk(_worker_func, {**shared_values, **values}, func_calls, batched, layer_name)
+
 
 class GridMap(Layer):
     def __init__(self,
@@ -13,21 +132,240 @@ class GridMap(Layer):
                  func_input_type: str = 'args',
                  func_output_type: str = 'tuple',
                  include_tags: bool = False,
+                 batched: bool = False,
+                 batch_size: int | None = None,
+                 workers: int | None = None,
+                 executor: str | Executor = "threads",
+                 chunk_size: int | None = None,
                  **kwargs):
+        """
+
+        :param func: Function called for each combination of the inputs.
+        :param inputs:
+        :param outputs:
+        :param func_input_type: "args" or "kwargs".
+        :param func_output_type: "tuple" or "dict".
+        :param include_tags: If True and ``func_input_type`` is "kwargs", the function arguments are named after
+            the full input names including the tags.
+        :param batched: If True, ``func`` is called once per batch of combinations. Each input is stacked along a
+            new first axis (NumPy arrays with the same shape and dtype) or collected in a list (other objects), and
+            each output must have the batch size as first dimension.
+        :param batch_size: Maximum number of combinations in a batch. If None, all the compatible combinations are
+            processed in a single batch.
+        :param workers: If provided, the function calls are distributed in chunks over ``workers`` workers.
+        :param executor: "threads", "processes" or an Executor instance used when ``workers`` is provided. With
+            "processes", the pool is created on the first call and reused by the next ones until ``shutdown``, and
+            the function is sent once to each worker process. The values used by several chunks of a call are
+            pickled once and loaded once by each worker, the other values are sent with the chunk using them.
+        :param chunk_size: Number of function calls sent to a worker at a time. If None, the calls are split in
+            about four chunks per worker.
+        :param kwargs: Additional arguments passed to Layer.
+        """
         super().__init__(inputs=inputs, outputs=outputs, **kwargs, output_type="dict", call_type="kwargs")
+
+        assert not (batched and include_tags), "include_tags is not supported in batched mode"
+        assert batch_size is None or batch_size > 0, f"batch_size must be positive, but got {batch_size}"
+        assert workers is None or workers > 0, f"workers must be positive, but got {workers}"
+        assert isinstance(executor, Executor) or executor in ["threads", "processes"], \
+            f"Allowed executors are 'threads', 'processes' or an Executor instance, but got {executor}"
+        assert chunk_size is None or chunk_size > 0, f"chunk_size must be positive, but got {chunk_size}"
+
         self.__func = func
         self.__func_input_type = func_input_type
         self.__func_output_type = func_output_type
         self.__include_tags = include_tags
+        self.__batched = batched
+        self.__batch_size = batch_size
+        self.__workers = workers
+        self.__executor = executor
+        self.__chunk_size = chunk_size
+        self.__pool: ProcessPoolExecutor | None = None
+        self.__pool_lock = threading.Lock()
+
+    def __getstate__(self) -> dict[str, Any]:
+        # The process pool stays in this process, e.g. when the layer is sent to the workers of a Model
+        state = self.__dict__.copy()
+        state["_GridMap__pool"] = None
+        del state["_GridMap__pool_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]):
+        self.__dict__.update(state)
+        self.__pool_lock = threading.Lock()
+
+    def shutdown(self, wait: bool = True) -> Self:
+        """
+        Shuts down the process pool created by the layer, if any. The next parallel call creates a new one.
+        """
+        with self.__pool_lock:
+            pool, self.__pool = self.__pool, None
+
+        if pool is not None:
+            pool.shutdown(wait=wait)
+        return self
 
     def call(self, **kwargs: Any):
-        kwargs = {str(TemplateValue(name)): value for name, value in kwargs.items()}
+        return self.__call_combinations(kwargs)
+
+    def _call_changed(self,
+                      kwargs: dict[str, Any],
+                      actual_input_names: list[str],
+                      actual_output_names: list[str],
+                      changed_names: set[str]) -> dict[str, Any]:
+        """
+        Calls the function only for the combinations using at least one of ``changed_names`` and returns their
+        outputs.
+        """
+        return self.__call_combinations(kwargs, changed_names)
+
+    def __call_combinations(self, kwargs: dict[str, Any], changed_names: set[str] | None = None) -> dict[str, Any]:
+        if inspect.iscoroutinefunction(self.__func):
+            return run_coroutine(self.__acall_combinations(kwargs, changed_names), self.name)
+
+        values, func_calls = self.__get_calls(kwargs, changed_names)
+
+        if self.__workers is None or len(func_calls) <= 1:
+            outputs_list = [call_func(self.__func, values, func_call, self.__batched, self.name)
+                            for _, func_call in func_calls]
+        else:
+            outputs_list = self.__call_parallel(values, [func_call for _, func_call in func_calls])
+
+        result = dict()
+        for (output_template_values, _), outputs in zip(func_calls, outputs_list):
+            result.update(self.__get_outputs(outputs, output_template_values))
+
+        return result
+
+    async def call_async(self, **kwargs: Any):
+        return await self.__acall_combinations(kwargs)
+
+    async def __acall_combinations(self,
+                                   kwargs: dict[str, Any],
+                                   changed_names: set[str] | None = None) -> dict[str, Any]:
+        values, func_calls = self.__get_calls(kwargs, changed_names)
+
+        # All the combinations are awaited concurrently, the results are merged following the combinations order
+        outputs_list = await asyncio.gather(*(self.__call_func_async(values, func_call)
+                                              for _, func_call in func_calls))
+
+        result = dict()
+        for (output_template_values, _), outputs in zip(func_calls, outputs_list):
+            result.update(self.__get_outputs(outputs, output_template_values))
+
+        return result
+
+    async def __call_func_async(self, values: dict[str, Any], func_call: FuncCall | list[FuncCall]) -> Any:
+        if profiling.active_profilers:
+            input_names = get_calls_input_names(func_call, self.__batched)
+            return await profiling.aprofile_call("combination", self.name, ", ".join(input_names), len(input_names),
+                                                 lambda: self.__await_func(values, func_call), count_func_outputs)
+
+        return await self.__await_func(values, func_call)
+
+    async def __await_func(self, values: dict[str, Any], func_call: FuncCall | list[FuncCall]) -> Any:
+        outputs = call_func(self.__func, values, func_call, self.__batched)
+
+        if inspect.isawaitable(outputs):
+            outputs = await outputs
+
+        return outputs
+
+    def __call_parallel(self, values: dict[str, Any], func_calls: list) -> list[Any]:
+        chunk_size = self.__chunk_size
+        if chunk_size is None:
+            chunk_size = max(1, math.ceil(len(func_calls) / (4 * self.__workers)))
+
+        chunks = [func_calls[start:start + chunk_size] for start in range(0, len(func_calls), chunk_size)]
+
+        if isinstance(self.__executor, Executor):
+            return self.__call_chunks(self.__executor, values, chunks)
+
+        if self.__executor == "threads":
+            with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+                return self.__call_chunks(executor, values, chunks)
+
+        with self.__pool_lock:
+            if self.__pool is None:
+                # The workers share the tracker of the blocks created by this process
+                start_resource_tracker()
+                self.__pool = ProcessPoolExecutor(max_workers=self.__workers, initializer=_init_worker,
+                                                  initargs=(self.__func,))
+            pool = self.__pool
+
+        # The values used by several chunks are pickled once in a shared memory block, read once by each worker,
+        # and the other values are sent with the chunk using them
+        chunks_names = [dict.fromkeys(name for func_call in chunk
+                                      for name in get_calls_input_names(func_call, self.__batched))
+                        for chunk in chunks]
+        uses = Counter(name for names in chunks_names for name in names)
+        shared_values = {name: values[name] for name, count in uses.items() if count > 1}
+        shared_block = create_pickled_block(shared_values) if shared_values else None
+
+        futures = []
+        try:
+            for chunk, names in zip(chunks, chunks_names):
+                chunk_values = {name: values[name] for name in names if uses[name] == 1}
+                futures.append(profiling.submit(pool, _call_worker_func_chunk, shared_block, chunk_values, chunk,
+                                                self.__batched, self.name))
+
+            return [outputs for future in futures for outputs in profiling.worker_result(future.result())]
+        finally:
+            if shared_block is not None:
+                wait(futures)
+                unlink_block(shared_block)
+
+    def __call_chunks(self, executor: Executor, values: dict[str, Any], chunks: list[list]) -> list[Any]:
+        futures = [profiling.submit(executor, call_func_chunk, self.__func, values, chunk, self.__batched, self.name)
+                   for chunk in chunks]
+        return [outputs for future in futures for outputs in profiling.worker_result(future.result())]
+
+    def __get_calls(self,
+                    kwargs: dict[str, Any],
+                    changed_names: set[str] | None = None) -> tuple[dict[str, Any], list[tuple[list, Any]]]:
+        """
+        Returns the input values by canonical name and, for each function call, the output template values and the
+        description of the call. In batched mode both are lists with an element per combination in the batch.
+        If ``changed_names`` is provided, only the combinations using at least one of them are returned.
+        """
         input_template_values = list(map(TemplateValue, kwargs.keys()))
+        values = {str(value): kwargs[name] for name, value in zip(kwargs.keys(), input_template_values)}
+        func_calls = list(self.__get_func_calls(input_template_values))
+
+        if changed_names is not None:
+            func_calls = [(output_template_values, func_call) for output_template_values, func_call in func_calls
+                          if not changed_names.isdisjoint(get_func_call_input_names(func_call))]
+
+        if not self.__batched:
+            return values, func_calls
+
+        groups = dict()  # batch signature => list of function calls
+        for output_template_values, func_call in func_calls:
+            groups.setdefault(get_batch_signature(values, func_call), []).append((output_template_values, func_call))
+
+        batches = []
+        for group in groups.values():
+            batch_size = self.__batch_size if self.__batch_size is not None else len(group)
+
+            for start in range(0, len(group), batch_size):
+                output_template_values, batch = zip(*group[start:start + batch_size])
+                batches.append((list(output_template_values), list(batch)))
+
+        return values, batches
+
+    def __get_outputs(self, outputs: Any, output_template_values: list) -> dict[str, Any]:
+        if self.__batched:
+            return self.__get_batched_output_dict(outputs, output_template_values)
+        return self.__get_output_dict(outputs, output_template_values)
+
+    def __get_func_calls(self, input_template_values: list[TemplateValue]) -> Iterator[tuple[list[TemplateValue],
+                                                                                             FuncCall]]:
+        """
+        Yields, for each combination of the inputs, the output template values and the description of the
+        function call.
+        """
         name_to_template_values = create_name_to_inputs_mapping(input_template_values)
 
-        result = dict()
-        for template_values in itertools.product(*[name_to_template_values[input_name.name]
-                                                   for input_name in self.inputs]):
+        for template_values in self.__iterate_combinations(name_to_template_values):
 
             tags = sum(list(map(lambda x: x.tags, template_values)), [])
             output_template_values = [template.instantiate(tags) for template in self.outputs]
@@ -40,32 +378,68 @@ class GridMap(Layer):
                 continue
 
             if self.__func_input_type == "args":
-                func_inputs = (kwargs[str(value)] for value in template_values)
-                outputs = self.__func(*func_inputs)
+                yield output_template_values, (tuple(str(value) for value in template_values), {})
             else:  # self.__func_input_type == "kwargs"
                 if self.__include_tags:
-                    func_inputs = {str(value): kwargs[str(value)] for value in template_values}
+                    func_inputs = {str(value): str(value) for value in template_values}
                 else:
-                    func_inputs = {value.name: kwargs[str(value)] for value in template_values}
-                outputs = self.__func(**func_inputs)
+                    func_inputs = {value.name: str(value) for value in template_values}
+                yield output_template_values, ((), func_inputs)
 
-            # The function returns None then do not add anything to result
-            if outputs is None:
-                continue
+    def __iterate_combinations(self,
+                               name_to_template_values: dict[str, set[TemplateValue]]) -> Iterator[tuple]:
+        candidates = [name_to_template_values[input_name.name] for input_name in self.inputs]
+
+        # Combinations with conflicting tags can not instantiate any output template, so they are pruned early.
+        # Without output templates every combination is valid.
+        if not self.outputs:
+            return itertools.product(*candidates)
+
+        return iterate_consistent_combinations(candidates)
+
+    def __get_output_dict(self, outputs: Any, output_template_values: list[TemplateValue]) -> dict[str, Any]:
+        # The function returns None then do not add anything to result
+        if outputs is None:
+            return {}
+
+        if ((not hasattr(outputs, "__len__") or len(outputs) != len(output_template_values))
+                and (self.__func_output_type == "tuple")):
+            outputs = (outputs,)
 
-            if ((not hasattr(outputs, "__len__") or len(outputs) != len(output_template_values))
-                    and (self.__func_output_type == "tuple")):
+        if self.__func_output_type == "tuple":
+            return {str(templ_value): output_value
+                    for templ_value, output_value in zip(output_template_values, outputs)}
+        else:  # self.__func_output_type == "dict":
+            return {str(templ_value): outputs[templ_value.name] for templ_value in output_template_values}
+
+    def __get_batched_output_dict(self,
+                                  outputs: Any,
+                                  output_template_values_batch: list[list[TemplateValue]]) -> dict[str, Any]:
+        # The function returns None then do not add anything to result
+        if outputs is None:
+            return {}
+
+        n_outputs = len(self.outputs)
+
+        if self.__func_output_type == "tuple":
+            if not isinstance(outputs, tuple) or len(outputs) != n_outputs:
                 outputs = (outputs,)
+            batched_outputs = list(outputs)
+        else:  # self.__func_output_type == "dict":
+            batched_outputs = [outputs[template.name] for template in self.outputs]
 
-            if self.__func_output_type == "tuple":
-                output_dict = {str(templ_value): output_value
-                               for templ_value, output_value in zip(output_template_values, outputs)}
-            else:  # self.__func_output_type == "dict":
-                output_dict = {str(templ_value): outputs[templ_value.name] for templ_value in output_template_values}
+        assert len(batched_outputs) == n_outputs, f"Expected {n_outputs} batched outputs, got {len(batched_outputs)}"
 
-            result.update(output_dict)
+        for batched_output in batched_outputs:
+            assert len(batched_output) == len(output_template_values_batch), \
+                f"Expected batched outputs of length {len(output_template_values_batch)}, got {len(batched_output)}"
 
-        return result
+        return {str(templ_value): batched_output[i]
+                for i, output_template_values in enumerate(output_template_values_batch)
+                for templ_value, batched_output in zip(output_template_values, batched_outputs)}
+
+    def _code(self):
+        return self.__func, self.__func_input_type, self.__func_output_type, self.__include_tags, self.__batched
 
     def _get_actual_outputs(self, state: dict[str, Any]) -> list[TemplateValue] | None:
         # state = {str(TemplateValue(name)): value for name, value in state.items()}
@@ -74,8 +448,7 @@ class GridMap(Layer):
 
         actual_outputs = []
 
-        for template_values in itertools.product(*[name_to_template_values[input_name.name]
-                                                   for input_name in self.inputs]):
+        for template_values in self.__iterate_combinations(name_to_template_values):
             tags = sum(list(map(lambda x: x.tags, template_values)), [])
             output_template_values = [template.instantiate(tags) for template in self.outputs]
 
@@ -1,13 +1,34 @@
-import itertools
+import asyncio
+import inspect
 import warnings
 from abc import abstractmethod, ABC
 from collections import defaultdict
-from typing import Any, Dict, Optional, Self
-from .template_utils import find_actual_input_names, replace_multi_templates, create_tag_to_inputs_mapping
+from typing import Any, Callable, Dict, Optional, Self
+from . import profiling
+from .fingerprint import fingerprint_value
+from .template_index import TemplateIndex
+from .template_utils import replace_multi_templates, create_tag_to_inputs_mapping, iterate_consistent_combinations
 from .templates import Template, TemplateValue
 from pprint import pprint
 
 
+def run_coroutine(coroutine, layer_name: str) -> Any:
+    """
+    Runs the coroutine of an async layer called synchronously.
+
+    :raises RuntimeError: If an event loop is already running in this thread, e.g. in Jupyter or an async
+        application, where the layer must be awaited with ``acall``.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    coroutine.close()
+    raise RuntimeError(f"The layer '{layer_name}' is asynchronous and can not be called synchronously from a running "
+                       f"event loop, use 'await layer.acall(...)' (or 'await model.acall(...)') instead")
+
+
 # TODO: Implement input as list of layers, where all the outputs of the provided layers are taken in input
 
 class Layer:
@@ -79,12 +100,106 @@ class Layer:
     def call(self, *args: Any, **kwargs: Any) -> Any:
         pass
 
+    async def call_async(self, *args: Any, **kwargs: Any) -> Any:
+        """
+        Asynchronous counterpart of ``call``, used by ``acall``. By default, it runs ``call`` and awaits its
+        result when it is awaitable, e.g. when the layer wraps an ``async def`` function.
+        """
+        results = self.call(*args, **kwargs)
+
+        if inspect.isawaitable(results):
+            results = await results
+
+        return results
+
     def __call__(self, *args, **kwargs: Any) -> Dict:
+        self.__print_debug_start(kwargs)
+        args, kwargs, input_names, output_names = self.__prepare_call(args, kwargs)
+        return self.__call_prepared(args, kwargs, input_names, output_names)
+
+    async def acall(self, *args, **kwargs: Any) -> Dict:
+        """
+        Asynchronous counterpart of ``__call__``.
+        """
+        self.__print_debug_start(kwargs)
+        args, kwargs, input_names, output_names = self.__prepare_call(args, kwargs)
+        return await self.__acall_prepared(args, kwargs, input_names, output_names)
+
+    def _call_initialized(self,
+                          kwargs: dict[str, Any],
+                          actual_input_names: list[str],
+                          actual_output_names: list[str]) -> Dict:
+        """
+        Calls the layer with inputs whose names are already canonical, using the actual input and output names
+        resolved in advance (e.g. by an ExecutionPlan) instead of initialising the layer again.
+        """
+        self.__print_debug_start(kwargs)
+        return self.__call_prepared((), kwargs, actual_input_names, actual_output_names)
+
+    async def _acall_initialized(self,
+                                 kwargs: dict[str, Any],
+                                 actual_input_names: list[str],
+                                 actual_output_names: list[str]) -> Dict:
+        """
+        Asynchronous counterpart of ``_call_initialized``.
+        """
+        self.__print_debug_start(kwargs)
+        return await self.__acall_prepared((), kwargs, actual_input_names, actual_output_names)
+
+    def _call_changed(self,
+                      kwargs: dict[str, Any],
+                      actual_input_names: list[str],
+                      actual_output_names: list[str],
+                      changed_names: set[str]) -> Dict:
+        """
+        Calls the layer again after the inputs in ``changed_names`` changed, returning the outputs that were
+        recomputed. By default, the layer is called with all its inputs; layers able to recompute only a part of
+        their outputs override it.
+        """
+        return self._call_initialized(kwargs, actual_input_names, actual_output_names)
+
+    def __call_prepared(self, args: tuple, kwargs: dict[str, Any], input_names: list[str], output_names: list[str]):
+        if profiling.active_profilers:
+            return profiling.profile_layer(self, kwargs,
+                                           lambda: self.__run_prepared(args, kwargs, input_names, output_names))
+
+        return self.__run_prepared(args, kwargs, input_names, output_names)
+
+    def __run_prepared(self, args: tuple, kwargs: dict[str, Any], input_names: list[str], output_names: list[str]):
+        results = self.__dispatch_call(self.call, args, kwargs, input_names)
+
+        # Layers wrapping async functions can also be called synchronously
+        if inspect.iscoroutine(results):
+            results = run_coroutine(results, self.name)
+
+        return self.__process_results(results, output_names)
+
+    async def __acall_prepared(self,
+                               args: tuple,
+                               kwargs: dict[str, Any],
+                               input_names: list[str],
+                               output_names: list[str]):
+        if profiling.active_profilers:
+            return await profiling.aprofile_layer(
+                self, kwargs, lambda: self.__arun_prepared(args, kwargs, input_names, output_names))
+
+        return await self.__arun_prepared(args, kwargs, input_names, output_names)
+
+    async def __arun_prepared(self,
+                              args: tuple,
+                              kwargs: dict[str, Any],
+                              input_names: list[str],
+                              output_names: list[str]):
+        results = await self.__dispatch_call(self.call_async, args, kwargs, input_names)
+        return self.__process_results(results, output_names)
+
+    def __print_debug_start(self, kwargs: dict[str, Any]):
         if self.__debug:
             print(f"Executing layer: {self.name}")
             print(f"- Input: {kwargs}")
             print(f"- Processing...")
 
+    def __prepare_call(self, args: tuple, kwargs: dict[str, Any]) -> tuple[tuple, dict[str, Any], list[str], list[str]]:
         if self.__input_type == "args" and self.__call_type != "auto":
             kwargs = dict(zip(self._inputs, args))
 
@@ -100,23 +215,33 @@ class Layer:
         actual_input_names_str = list(map(str, self.actual_inputs))
         actual_output_names_str = list(map(str, self.actual_outputs))
 
+        return args, kwargs, actual_input_names_str, actual_output_names_str
+
+    def __dispatch_call(self,
+                        method: Callable,
+                        args: tuple,
+                        kwargs: dict[str, Any],
+                        actual_input_names_str: list[str]) -> Any:
         # assert actual_input_names_str is not None, f"The inputs provided do not match the expected input names"
 
         results = None
         match self.__call_type:
             case "auto":
-                results = self.call(*args, **kwargs)
+                results = method(*args, **kwargs)
             case "kwargs":
-                results = self.call(**kwargs)
+                results = method(**kwargs)
             case "dict":
-                results = self.call(kwargs)
+                results = method(kwargs)
             case "args":
                 args = (kwargs[input_name] for input_name in actual_input_names_str)
-                results = self.call(*args)
+                results = method(*args)
             case "tuple":
                 args = (kwargs[input_name] for input_name in actual_input_names_str)
-                results = self.call(args)
+                results = method(args)
 
+        return results
+
+    def __process_results(self, results: Any, actual_output_names_str: list[str]) -> Dict:
         if self.__output_type == "dict":
             assert isinstance(results, dict), f'Output type set to "dict" but the result is of type {type(results)}'
 
@@ -152,7 +277,8 @@ class Layer:
         for output_template in self.outputs:
             tag_filters = output_template.tag_filters
 
-            for input_templates_values in itertools.product(*[tag_to_inputs[tag_flt.name] for tag_flt in tag_filters]):
+            for input_templates_values in iterate_consistent_combinations([tag_to_inputs[tag_flt.name]
+                                                                           for tag_flt in tag_filters]):
                 # print(input_templates_values)
                 tags = sum([value.tags for value in input_templates_values], [])
                 output_template_value = output_template.instantiate(tags)
@@ -162,15 +288,28 @@ class Layer:
 
         return actual_outputs
 
-    def init(self, state: dict[str, Any], state_producers: dict[str, list[Self]] | None = None) -> Self:
+    def init(self,
+             state: dict[str, Any],
+             state_producers: dict[str, list[Self]] | None = None,
+             state_index: TemplateIndex | None = None) -> Self:
+        """
+
+        :param state: User inputs.
+        :param state_producers: Mapping from every name in the state to the layers producing it.
+        :param state_index: Index of the names in ``state_producers``, built from it if not provided.
+        :return: The layer itself.
+        """
         if state_producers is None:
             state_producers = {key: [] for key in state.keys()}
 
+        if state_index is None:
+            state_index = TemplateIndex(state_producers.keys())
+
         actual_inputs = []
 
         # template_values = dict()
         for input_template in self._inputs:
-            actual_input_names = find_actual_input_names(input_template, list(state_producers.keys()))
+            actual_input_names = state_index.find(input_template)
 
             if actual_input_names is None:
                 return self
@@ -200,6 +339,24 @@ class Layer:
         # return [predecessor for predecessor in predecessors_set if predecessor is not None and predecessor != self]
         return [predecessor for predecessor in predecessors_set if predecessor != self]
 
+    def fingerprint(self) -> str:
+        """
+        Hash of the definition of the layer: class, name, templates, input/output/call types and code. It is used
+        by result caches to tell apart the outputs of different layers.
+
+        :raises UnhashableValueError: If the code of the layer can not be hashed.
+        """
+        return fingerprint_value((type(self).__module__, type(self).__qualname__, self.name,
+                                  list(map(str, self._inputs)), list(map(str, self._outputs)),
+                                  self.__input_type, self.__output_type, self.__call_type, self._code()))
+
+    def _code(self) -> Any:
+        """
+        What the layer executes, hashed by ``fingerprint``. Layers wrapping a function return it together with
+        the options changing its results.
+        """
+        return type(self).call
+
     @property
     def inputs(self) -> list[Template]:
         return self._inputs
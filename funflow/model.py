@@ -1,16 +1,99 @@
-from typing import Any, Self
+import itertools
+import json
+import os
+import queue
+import threading
+from concurrent.futures import Executor
+from typing import Any, Iterable, Iterator, Self
+from .cache import Cache
+from .disk_cache import DiskCache
+from .distributed import DistributedBackend, DistributedRun
+from .executors import create_executor, EXECUTORS
 from .layer import Layer
+from .plan import ExecutionPlan, to_target
+from .release import StateRelease
+from .result_cache import ResultCache
+from .shared_state import SharedMemoryTransport, start_resource_tracker
 from .template_engine import create_graph, topological_order_to_nx
 from .templates import Template, TemplateValue
 
 
+_END_OF_STREAM = object()
+
+
+class _StreamError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def put_item(items: queue.Queue, item: Any, stop: threading.Event, timeout: float = 0.1) -> bool:
+    # Waits for room in the queue, giving up when the stream is stopped
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def get_item(items: queue.Queue, stop: threading.Event, timeout: float = 0.1) -> Any | None:
+    while not stop.is_set():
+        try:
+            return items.get(timeout=timeout)
+        except queue.Empty:
+            continue
+    return None
+
+
 class Model(Layer):
     def __init__(self,
                  layers: Layer | list[Layer] = None,
                  inputs: list[str] = None,
                  outputs: list[str] = None,
+                 executor: str | Executor | None = None,
+                 max_workers: int | None = None,
+                 scheduler: str = "levels",
+                 max_concurrency: int | None = None,
+                 cache: ResultCache | DiskCache | None = None,
+                 incremental: bool = False,
+                 release_intermediates: bool = False,
+                 shared_memory: bool = False,
+                 backend: DistributedBackend | None = None,
                  **kwargs
                  ):
+        """
+
+        :param layers: Layers composing the model.
+        :param inputs:
+        :param outputs:
+        :param executor: "threads", "processes" or an Executor instance used to run concurrently the layers of
+            the same level. If None, the layers are run serially.
+        :param max_workers: Number of workers of the executor created when ``executor`` is a string.
+        :param scheduler: "levels" waits for all the layers of a level before starting the next one, "dataflow"
+            starts each layer as soon as its predecessors have completed. When using "dataflow" without an
+            executor, a thread pool with ``max_workers`` workers is used.
+        :param max_concurrency: Maximum number of layers running at the same time on the event loop when the model
+            is called with ``acall``. If None, there is no limit.
+        :param cache: If provided, every layer is wrapped in a Cache storing its outputs in ``cache``, so the
+            layers whose inputs did not change since a previous call, possibly of another process when using a
+            DiskCache, are not executed again.
+        :param incremental: If True, the model keeps the state of the last call, so that ``update`` can recompute
+            only the layers affected by a change of some inputs.
+        :param release_intermediates: If True, each value is dropped from the state as soon as all the layers
+            reading it have run, unless it matches the outputs of the model (or the targets of the call). The
+            peak size of the values retained during the last call is available as ``peak_retained_bytes``. It has no
+            effect on models without outputs, which return the whole state.
+        :param shared_memory: If True, the NumPy arrays (and array-backed pandas columns) exchanged with the layers
+            run by a process pool go through shared memory blocks instead of being pickled. Layers get read-only
+            views of their input arrays, and the arrays they return are returned by the model as read-only views.
+            It is used by ``__call__``, while ``acall`` and ``stream`` pickle the values as usual.
+        :param backend: If provided, the layers are run on the nodes of this cluster (e.g. a TCPBackend) instead of
+            an executor. The intermediate values stay on the nodes, each layer runs on the node holding most of its
+            inputs, and only the values returned by the model are sent back. It is used by ``__call__``, while
+            ``acall``, ``stream`` and ``update`` run the layers locally.
+        :param kwargs: Additional arguments passed to Layer.
+        """
         super().__init__(
             inputs=inputs,
             outputs=outputs,
@@ -22,31 +105,381 @@ class Model(Layer):
         if isinstance(layers, Layer):
             layers = [layers]
 
-        self._layers = layers if layers is not None else []
-        # self._state = dict()
+        self.__cache = cache
+        self._layers = [self.__wrap_layer(layer) for layer in layers] if layers is not None else []
+        # (input names, targets) => plan, targets are None for the plans computing every output
+        self.__plans: dict[tuple[frozenset[str], tuple[str, ...] | None], ExecutionPlan] = dict()
+
+        assert executor is None or isinstance(executor, Executor) or executor in EXECUTORS, \
+            f"Allowed executors are {list(EXECUTORS.keys())} or an Executor instance, but got {executor}"
+        assert scheduler in ["levels", "dataflow"], \
+            f"Allowed schedulers are 'levels' and 'dataflow', but got {scheduler}"
+        assert backend is None or (executor is None and not shared_memory), \
+            "backend can not be used together with an executor or shared_memory"
+        if scheduler == "dataflow" and executor is None and backend is None:
+            executor = "threads"
+
+        self.__scheduler = scheduler
+        self.__max_concurrency = max_concurrency
+        self.__executor_spec = executor
+        self.__max_workers = max_workers
+        self.__executor = executor if isinstance(executor, Executor) else None
+        assert not (incremental and release_intermediates), \
+            "incremental and release_intermediates can not be used together"
+
+        self.__incremental = incremental
+        self.__release_intermediates = release_intermediates
+
+        assert not shared_memory or executor is not None, "shared_memory requires an executor"
+        self.__shared_memory = shared_memory
+        self.__backend = backend
+        if shared_memory:
+            # Worker processes started afterwards share the resource tracker of this process
+            start_resource_tracker()
+        self.__peak_retained_bytes: int | None = None
+        self.__state: dict[str, Any] | None = None
+        self.__state_plan: ExecutionPlan | None = None
+
+    def __wrap_layer(self, layer: Layer) -> Layer:
+        if self.__cache is None or isinstance(layer, Cache):
+            return layer
+
+        return Cache(layer, store=self.__cache)
 
     def add_layer(self, layer: Layer) -> Self:
-        self._layers.append(layer)
+        self._layers.append(self.__wrap_layer(layer))
+        self.__plans.clear()
+        return self
+
+    def compile(self,
+                input_names: Iterable[str],
+                targets: Iterable[str | Template] | None = None) -> ExecutionPlan:
+        """
+        Returns the execution plan of the model for the given input names. Plans are cached by the set of input
+        names and the targets, so the graph is built only the first time a set of input names is seen.
+
+        :param input_names: Names of the values that will be provided to the model.
+        :param targets: If provided, the plan only contains the layers needed to compute the names matching them.
+        :return: The execution plan.
+        """
+        input_names = [str(TemplateValue(name)) for name in input_names]
+        key = (frozenset(input_names), None)
+
+        if targets is not None:
+            targets = list(map(to_target, targets))
+            targets_key = (key[0], tuple(map(str, targets)))
+
+            # The plan for the targets can be available without the full plan, e.g. when loaded by load_plan
+            if targets_key in self.__plans:
+                return self.__plans[targets_key]
+
+        if key not in self.__plans:
+            self.__plans[key] = ExecutionPlan(self._layers, input_names)
+
+        if targets is None:
+            return self.__plans[key]
+
+        self.__plans[targets_key] = self.__plans[key].select(targets)
+        return self.__plans[targets_key]
+
+    def clear_plans(self) -> Self:
+        self.__plans.clear()
         return self
 
+    def save_plan(self,
+                  path: str | os.PathLike,
+                  input_names: Iterable[str],
+                  targets: Iterable[str | Template] | None = None):
+        """
+        Compiles the plan for the given input names and targets and writes it to a JSON file, from which
+        ``load_plan`` restores it without resolving the templates of the layers again.
+
+        :param path: Path of the file.
+        :param input_names: Names of the values that will be provided to the model.
+        :param targets: If provided, the plan only contains the layers needed to compute the names matching them.
+        :raises ValueError: If several layers of the model have the same name.
+        """
+        data = self.compile(input_names, targets).to_dict()
+        data["targets"] = None if targets is None else list(map(str, map(to_target, targets)))
+
+        with open(path, "w") as file:
+            json.dump(data, file, separators=(",", ":"))
+
+    def load_plan(self, path: str | os.PathLike, input_names: Iterable[str] | None = None) -> ExecutionPlan:
+        """
+        Reads a plan written by ``save_plan`` and attaches it to the layers of the model, so that calls with the
+        same input names (and targets) use it instead of compiling a new plan.
+
+        :param path: Path of the file.
+        :param input_names: If provided, the input names the plan must have been saved for.
+        :raises ValueError: If the file is not a valid plan, or if the layers of the model or the input names differ
+            from those of the saved plan.
+        :return: The loaded plan.
+        """
+        with open(path) as file:
+            data = json.load(file)
+
+        plan = ExecutionPlan.from_dict(data, self._layers)
+
+        if input_names is not None:
+            input_names = frozenset(str(TemplateValue(name)) for name in input_names)
+            if input_names != plan.input_names:
+                raise ValueError(f"The plan was saved for the inputs {sorted(plan.input_names)}, "
+                                 f"but got {sorted(input_names)}")
+
+        targets = data.get("targets")
+        self.__plans[(plan.input_names, None if targets is None else tuple(targets))] = plan
+        return plan
+
+    def __call__(self, *args, targets: Iterable[str | Template] | None = None, **kwargs: Any) -> dict[str, Any]:
+        """
+        Runs the model on the inputs provided as keyword arguments.
+
+        :param targets: If provided, only the layers needed to compute the names matching these templates are
+            executed, and only those names are returned. Tags select the names by value, e.g. "y, i: 2".
+        """
+        if targets is None:
+            return super().__call__(*args, **kwargs)
+
+        targets = list(map(to_target, targets))
+        state = {str(TemplateValue(name)): value for name, value in kwargs.items()}
+        release = self.__create_release(targets)
+        state = self.__run(self.compile(state.keys(), targets), state, release, targets)
+        self.__record_release(release)
+
+        return self.__select_targets(state, targets)
+
+    async def acall(self, *args, targets: Iterable[str | Template] | None = None, **kwargs: Any) -> dict[str, Any]:
+        """
+        Asynchronous counterpart of ``__call__``.
+        """
+        if targets is None:
+            return await super().acall(*args, **kwargs)
+
+        targets = list(map(to_target, targets))
+        state = {str(TemplateValue(name)): value for name, value in kwargs.items()}
+        release = self.__create_release(targets)
+        state = await self.compile(state.keys(), targets).arun(state, self.__max_concurrency, release)
+        self.__record_release(release)
+
+        return self.__select_targets(state, targets)
+
+    @staticmethod
+    def __select_targets(state: dict[str, Any], targets: list[Template]) -> dict[str, Any]:
+        return {name: value for name, value in state.items() if any(target.match(name) for target in targets)}
+
     def call(self, **kwargs: Any) -> Any:
         state = kwargs.copy()
+        plan = self.__get_plan(state)
+        release = self.__create_release(self.outputs)
+        state = self.__run(plan, state, release, self.outputs)
+        self.__record_release(release)
 
-        topological_order, state_producer = create_graph(self._layers, state)
+        return self.__keep_state(plan, state)
 
-        for layers in topological_order:
+    async def call_async(self, **kwargs: Any) -> Any:
+        state = kwargs.copy()
+        plan = self.__get_plan(state)
+        release = self.__create_release(self.outputs)
+        state = await plan.arun(state, self.__max_concurrency, release)
+        self.__record_release(release)
+
+        return self.__keep_state(plan, state)
+
+    def __run(self,
+              plan: ExecutionPlan,
+              state: dict[str, Any],
+              release: StateRelease | None,
+              kept_templates: list[Template]) -> dict[str, Any]:
+        if self.__backend is not None:
+            return self.__run_distributed(plan, state, release, kept_templates)
+
+        if not self.__shared_memory:
+            return plan.run(state, self.executor, self.__scheduler, release)
+
+        transport = SharedMemoryTransport()
+        try:
+            return plan.run(state, self.executor, self.__scheduler, release, transport)
+        finally:
+            transport.close()
+
+    def __run_distributed(self,
+                          plan: ExecutionPlan,
+                          state: dict[str, Any],
+                          release: StateRelease | None,
+                          kept_templates: list[Template]) -> dict[str, Any]:
+        # Only the values returned by the model are fetched, the incremental state needs all of them
+        keep = None
+        if kept_templates and not self.__incremental:
+            keep = lambda name: any(template.match(name) for template in kept_templates)
+
+        run = DistributedRun(self.__backend, keep)
+        try:
+            plan.run(state, None, self.__scheduler, release, run)
+            return run.gather(state)
+        finally:
+            run.close()
+
+    def __create_release(self, kept_templates: list[Template]) -> StateRelease | None:
+        if not self.__release_intermediates or not kept_templates:
+            return None
+
+        return StateRelease(lambda name: any(template.match(name) for template in kept_templates))
+
+    def __record_release(self, release: StateRelease | None):
+        if release is not None:
+            self.__peak_retained_bytes = release.peak_bytes
+
+    @property
+    def peak_retained_bytes(self) -> int | None:
+        """
+        Peak estimated size in bytes of the state during the last call, when ``release_intermediates`` is True.
+        """
+        return self.__peak_retained_bytes
+
+    def __keep_state(self, plan: ExecutionPlan, state: dict[str, Any]) -> dict[str, Any]:
+        if not self.__incremental:
+            return state
+
+        # The returned state is a copy, so that changes made by the caller do not affect the next update
+        self.__state = state
+        self.__state_plan = plan
+        return dict(state)
+
+    def update(self, **changed: Any) -> dict[str, Any]:
+        """
+        Recomputes the outputs of the last call after some of its inputs changed. Only the layers downstream of the
+        changed inputs are executed again, and a GridMap only calls its function for the combinations using a
+        changed value. Requires ``incremental=True``.
+
+        :param changed: New values of some inputs. If a name was not an input of the last call, the model is
+            called again with all the inputs.
+        :return: The outputs of the model, as returned by calling it with the updated inputs.
+        """
+        assert self.__incremental, "update requires a model created with incremental=True"
+        assert self.__state is not None, "update requires a previous call of the model"
+
+        changed = {str(TemplateValue(name)): value for name, value in changed.items()}
+        plan = self.__state_plan
+
+        if not changed.keys() <= plan.input_names:
+            # New inputs change the graph, so the whole model is run again
+            inputs = {name: self.__state[name] for name in plan.input_names}
+            return self(**{**inputs, **changed})
+
+        # The layers run on a copy, so that the state of the last call is kept if one of them fails
+        state = plan.run_changed({**self.__state, **changed}, changed.keys())
+        self.__state = state
+
+        return self.__select_outputs(state)
+
+    def __select_outputs(self, state: dict[str, Any]) -> dict[str, Any]:
+        if not self.outputs:
+            return dict(state)
 
-            # INFO: this could be parallelized
-            for layer in layers:
-                actual_input_names = layer.actual_inputs
+        return {name: value for name, value in state.items()
+                if any(output_template.match(name) for output_template in self.outputs)}
 
-                layer_inputs = {str(name): state[str(name)] for name in actual_input_names}
-                layer_outputs = layer(**layer_inputs)
-                state.update(layer_outputs)
+    def stream(self, inputs: Iterable[dict[str, Any]], buffer_size: int = 1) -> Iterator[dict[str, Any]]:
+        """
+        Runs the model on a stream of input batches, yielding the outputs of each batch in order.
 
-        return state
+        Each level of the execution plan is a stage run by its own thread, and the stages are connected by queues
+        of at most ``buffer_size`` batches. A batch enters the first levels while the previous ones are still in
+        the last levels, and the batches are read from ``inputs`` only when the first stage has room for them.
+        The layers of a level run on the executor of the model, if any.
+
+        :param inputs: Iterable of dictionaries of inputs, all with the same names.
+        :param buffer_size: Maximum number of batches waiting between two stages.
+        :return: Iterator over the outputs, as returned by calling the model on each batch.
+        """
+        assert buffer_size > 0, f"buffer_size must be positive, but got {buffer_size}"
+
+        inputs = iter(inputs)
+        first_inputs = next(inputs, None)
+        if first_inputs is None:
+            return
+
+        plan = self.compile(first_inputs.keys())
+        queues = [queue.Queue(maxsize=buffer_size) for _ in range(len(plan.levels) + 1)]
+        stop = threading.Event()
+
+        def feed():
+            try:
+                for batch in itertools.chain([first_inputs], inputs):
+                    state = {str(TemplateValue(name)): value for name, value in batch.items()}
+
+                    if frozenset(state) != plan.input_names:
+                        raise ValueError(f"Every batch must have the inputs {sorted(plan.input_names)}, "
+                                         f"but got {sorted(state)}")
+
+                    if not put_item(queues[0], (state, self.__create_release(self.outputs)), stop):
+                        return
+
+                put_item(queues[0], _END_OF_STREAM, stop)
+            except BaseException as e:
+                put_item(queues[0], _StreamError(e), stop)
+
+        def run_stage(index: int):
+            while (item := get_item(queues[index], stop)) is not None:
+                if item is not _END_OF_STREAM and not isinstance(item, _StreamError):
+                    try:
+                        plan.run_stage(index, item[0], self.executor, item[1])
+                    except BaseException as e:
+                        item = _StreamError(e)
+
+                put_item(queues[index + 1], item, stop)
+
+                if item is _END_OF_STREAM or isinstance(item, _StreamError):
+                    return
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += [threading.Thread(target=run_stage, args=(i,), daemon=True) for i in range(len(plan.levels))]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while (item := queues[-1].get()) is not _END_OF_STREAM:
+                if isinstance(item, _StreamError):
+                    raise item.error
+
+                state, release = item
+                self.__record_release(release)
+                yield self.__select_outputs(state)
+        finally:
+            # Also reached when the caller stops iterating early
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _code(self):
+        return [layer.fingerprint() for layer in self._layers]
+
+    def __get_plan(self, state: dict[str, Any]) -> ExecutionPlan:
+        plan = self.__plans.get((frozenset(state), None))
+        if plan is None:
+            plan = self.compile(state.keys())
+
+        return plan
+
+    @property
+    def executor(self) -> Executor | None:
+        # Executors requested by name are created on first use and owned by the model
+        if self.__executor is None and self.__executor_spec is not None:
+            self.__executor = create_executor(self.__executor_spec, self.__max_workers)
+        return self.__executor
+
+    def shutdown(self, wait: bool = True) -> Self:
+        """
+        Shuts down the executor created by the model, if any. Executor instances provided by the user are left
+        untouched.
+        """
+        if isinstance(self.__executor_spec, str) and self.__executor is not None:
+            self.__executor.shutdown(wait=wait)
+            self.__executor = None
+        return self
 
     def create_graph(self, inputs: dict[str, Any]):
         topological_order, state_producer = create_graph(self._layers, inputs)
         G = topological_order_to_nx(topological_order)
-        return G
\ No newline at end of file
+        return G
@@ -0,0 +1,27 @@
+import importlib
+import sys
+from types import ModuleType
+
+
+def loaded_module(name: str) -> ModuleType | None:
+    """
+    Returns the module ``name`` if it has already been imported, otherwise None. Values of the types defined by an
+    optional dependency (e.g. NumPy arrays) can only exist once it has been imported, so checking the type of a
+    value does not require importing the dependency.
+    """
+    return sys.modules.get(name)
+
+
+def import_optional(name: str, extra: str) -> ModuleType:
+    """
+    Imports an optional dependency on first use.
+
+    :param name: Name of the module.
+    :param extra: Extra of the package installing the module.
+    :raises ImportError: If the module is not installed.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError as e:
+        raise ImportError(f"The module '{name}' is required by this feature, "
+                          f"install it with: pip install funflow[{extra}]") from e
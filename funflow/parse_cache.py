@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+DEFAULT_PARSE_CACHE_SIZE = 2 ** 16
+
+
+class ParseCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    max_size: int | None
+    current_size: int
+
+
+class ParseCache:
+    """
+    Thread safe LRU cache from strings to the objects parsed from them.
+
+    A ``max_size`` of None makes the cache unbounded, a ``max_size`` of 0 disables it.
+    """
+
+    def __init__(self, max_size: int | None = DEFAULT_PARSE_CACHE_SIZE):
+        assert max_size is None or max_size >= 0, f"max_size must be None or non negative, but got {max_size}"
+
+        self.__max_size = max_size
+        self.__data: OrderedDict[str, Any] = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        if self.__max_size == 0:
+            return None
+
+        with self.__lock:
+            value = self.__data.get(key)
+
+            if value is None:
+                self.__misses += 1
+                return None
+
+            self.__data.move_to_end(key)
+            self.__hits += 1
+            return value
+
+    def put(self, key: str, value: Any):
+        if self.__max_size == 0:
+            return
+
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+
+            if self.__max_size is not None and len(self.__data) > self.__max_size:
+                self.__data.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            self.__hits = 0
+            self.__misses = 0
+
+    @property
+    def max_size(self) -> int | None:
+        return self.__max_size
+
+    @max_size.setter
+    def max_size(self, max_size: int | None):
+        assert max_size is None or max_size >= 0, f"max_size must be None or non negative, but got {max_size}"
+
+        with self.__lock:
+            self.__max_size = max_size
+
+            while max_size is not None and len(self.__data) > max_size:
+                self.__data.popitem(last=False)
+
+    def info(self) -> ParseCacheInfo:
+        return ParseCacheInfo(self.__hits, self.__misses, self.__max_size, len(self.__data))
+
+
+# Caches used when parsing TemplateValue and Tag strings
+template_value_cache = ParseCache()
+tag_cache = ParseCache()
+
+
+def parse_cache_info() -> dict[str, ParseCacheInfo]:
+    """
+    Returns hits, misses, maximum size and current size of the TemplateValue and Tag parsing caches.
+    """
+    return {"template_value": template_value_cache.info(), "tag": tag_cache.info()}
+
+
+def set_parse_cache_size(max_size: int | None):
+    """
+    Sets the maximum number of strings kept by each parsing cache. None makes the caches unbounded and 0 disables
+    them, in which case every string is parsed again.
+    """
+    template_value_cache.max_size = max_size
+    tag_cache.max_size = max_size
+
+
+def clear_parse_cache():
+    template_value_cache.clear()
+    tag_cache.clear()
@@ -0,0 +1,497 @@
+import asyncio
+import copy
+from collections import defaultdict
+from concurrent.futures import Executor, Future, wait, FIRST_COMPLETED
+from typing import Any, Iterable
+from . import profiling
+from .fingerprint import fingerprint_value
+from .executors import (run_level, call_layer, submit_layer, get_layer_result, discard_layer_results, is_remote,
+                        LayerExecutionError, Transport)
+from .layer import Layer
+from .release import StateRelease
+from .template_engine import create_graph
+from .template_index import TemplateIndex
+from .tag_filter import ValueTagFilter
+from .templates import Template
+
+
+def to_target(target: str | Template) -> Template:
+    """
+    Returns the template matching the names selected by ``target``. The tags of a target select the names by
+    value, so they are turned into value filters: e.g. "y, i: 2" matches "y, i: 2" but not "y, i: 1".
+    """
+    template = target if isinstance(target, Template) else Template(target)
+    filters = [ValueTagFilter(tag.name, tag.value) for tag in template.tags] + template.tag_filters
+    return Template(template.name, filters=filters)
+
+
+# Version of the dictionaries produced by ExecutionPlan.to_dict
+PLAN_FORMAT_VERSION = 1
+
+_PLAN_KEYS = ("input_names", "layers", "levels", "state_producers")
+_PLAN_LAYER_KEYS = ("name", "signature", "actual_inputs", "actual_outputs", "predecessors", "call_names")
+
+
+def _check_plan_format(data: dict[str, Any]):
+    """
+    Checks that ``data`` has the structure written by ``ExecutionPlan.to_dict`` and that the layers referenced by
+    the levels, the state producers and the predecessors are saved layers.
+
+    :raises ValueError: If ``data`` is malformed.
+    """
+    missing = [key for key in _PLAN_KEYS if key not in data]
+    if missing:
+        raise ValueError(f"Malformed plan, the keys {missing} are missing")
+
+    if not isinstance(data["layers"], list) or not all(isinstance(layer_data, dict) for layer_data in data["layers"]):
+        raise ValueError("Malformed plan, the layers must be a list of dictionaries")
+
+    for layer_data in data["layers"]:
+        missing = [key for key in _PLAN_LAYER_KEYS if key not in layer_data]
+        if missing:
+            raise ValueError(f"Malformed plan, the keys {missing} of the layer {layer_data.get('name')} are missing")
+        if len(layer_data["call_names"]) != 2:
+            raise ValueError(f"Malformed plan, the call names of the layer {layer_data['name']} must be a pair")
+
+    saved_names = {layer_data["name"] for layer_data in data["layers"]}
+    referenced = {name for level in data["levels"] for name in level}
+    referenced.update(name for producers in data["state_producers"].values() for name in producers)
+    referenced.update(name for layer_data in data["layers"] for name in layer_data["predecessors"])
+    unknown = sorted(referenced - saved_names)
+    if unknown:
+        raise ValueError(f"Malformed plan, the layers {unknown} are referenced but not saved")
+
+
+def layer_signature(layer: Layer) -> str:
+    """
+    Hash of what determines the position of a layer in the graph: its class, name and templates. Unlike the
+    fingerprint of the layer, it does not depend on its code.
+    """
+    return fingerprint_value((type(layer).__module__, type(layer).__qualname__, layer.name,
+                              list(map(str, layer.inputs)), list(map(str, layer.outputs))))
+
+
+class ExecutionPlan:
+    """
+    Execution graph of a list of layers resolved for a fixed set of input names.
+
+    The plan snapshots the topological levels, the state producers and, for every layer, the actual input names,
+    output names and predecessors found by the template engine. Running the plan does not rebuild the graph, and
+    the layers are called without being initialised again.
+    """
+
+    def __init__(self, layers: list[Layer], input_names: Iterable[str]):
+        """
+
+        :param layers: Layers to be arranged in the execution graph.
+        :param input_names: Names of the values provided by the user, in canonical form.
+        """
+        input_names = list(input_names)
+        self.__input_names = frozenset(input_names)
+
+        levels, state_producers = create_graph(layers, dict.fromkeys(input_names))
+
+        # Layer attributes are overwritten every time a layer is initialised (e.g. by a standalone call),
+        # so the resolved names are copied in the plan.
+        self.__levels: list[list[Layer]] = [list(level) for level in levels]
+        self.__state_producers: dict[str, list[Layer]] = {name: list(producers)
+                                                          for name, producers in state_producers.items()}
+        self.__actual_inputs: dict[Layer, list[str]] = {}
+        self.__actual_outputs: dict[Layer, list[str]] = {}
+        self.__predecessors: dict[Layer, list[Layer]] = {}
+
+        # The template engine collects the predecessors in a set, they are sorted by position to be deterministic
+        position = {layer: i for i, layer in enumerate(self.layers)}
+        for layer in self.layers:
+            self.__actual_inputs[layer] = list(map(str, layer.actual_inputs))
+            self.__actual_outputs[layer] = list(map(str, layer.actual_outputs))
+            self.__predecessors[layer] = sorted(layer.predecessors, key=position.__getitem__)
+
+        # Names used to call each layer, resolved once as a standalone call with the layer inputs would do
+        self.__call_names: dict[Layer, tuple[list[str], list[str]]] = {}
+        for layer in self.layers:
+            layer.init(dict.fromkeys(self.__actual_inputs[layer]))
+            self.__call_names[layer] = (list(map(str, layer.actual_inputs)), list(map(str, layer.actual_outputs)))
+
+        self.__index_writers()
+
+    def __index_writers(self):
+        self.__rank: dict[Layer, int] = {layer: i for i, layer in enumerate(self.layers)}
+
+        # Rank of the last layer producing each name, whose value is the one kept in the state
+        self.__last_writer: dict[str, int] = {name: self.__rank[layer]
+                                              for layer in self.layers for name in self.__actual_outputs[layer]}
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Returns the resolved graph as a JSON serialisable dictionary, in which the layers are referenced by name.
+        ``from_dict`` rebuilds the plan from it without resolving the templates again.
+
+        :raises ValueError: If several layers have the same name.
+        """
+        layers = list(self.__actual_inputs.keys())
+        names = [layer.name for layer in layers]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"Layers with the same name can not be serialised: {duplicates}")
+
+        return {
+            "version": PLAN_FORMAT_VERSION,
+            "input_names": sorted(self.__input_names),
+            "layers": [{"name": layer.name,
+                        "signature": layer_signature(layer),
+                        "actual_inputs": self.__actual_inputs[layer],
+                        "actual_outputs": self.__actual_outputs[layer],
+                        "predecessors": [predecessor.name for predecessor in self.__predecessors[layer]],
+                        "call_names": list(self.__call_names[layer])}
+                       for layer in layers],
+            "levels": [[layer.name for layer in level] for level in self.__levels],
+            "state_producers": {name: [layer.name for layer in producers]
+                                for name, producers in self.__state_producers.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], layers: list[Layer]) -> "ExecutionPlan":
+        """
+        Rebuilds a plan serialised by ``to_dict`` on ``layers``, which must be the layers the plan was created from
+        or layers with the same names and templates, e.g. those of the same model in another process.
+
+        :raises ValueError: If the format of ``data`` is not supported or malformed, or if the layers differ from the
+            serialised ones.
+        """
+        if not isinstance(data, dict) or data.get("version") != PLAN_FORMAT_VERSION:
+            raise ValueError(f"Unsupported plan format, expected version {PLAN_FORMAT_VERSION}")
+        _check_plan_format(data)
+
+        layers_by_name = {layer.name: layer for layer in layers}
+        saved_names = [layer_data["name"] for layer_data in data["layers"]]
+
+        if len(layers_by_name) != len(layers) or sorted(layers_by_name) != sorted(saved_names):
+            raise ValueError(f"The plan was saved for the layers {sorted(saved_names)}, "
+                             f"but got {sorted(layer.name for layer in layers)}")
+
+        changed = [layer_data["name"] for layer_data in data["layers"]
+                   if layer_signature(layers_by_name[layer_data["name"]]) != layer_data["signature"]]
+        if changed:
+            raise ValueError(f"The templates of the layers {changed} changed since the plan was saved")
+
+        plan = cls.__new__(cls)
+        plan.__input_names = frozenset(data["input_names"])
+        plan.__levels = [[layers_by_name[name] for name in level] for level in data["levels"]]
+        plan.__state_producers = {name: [layers_by_name[producer] for producer in producers]
+                                  for name, producers in data["state_producers"].items()}
+        plan.__actual_inputs = {}
+        plan.__actual_outputs = {}
+        plan.__predecessors = {}
+        plan.__call_names = {}
+
+        for layer_data in data["layers"]:
+            layer = layers_by_name[layer_data["name"]]
+            plan.__actual_inputs[layer] = list(layer_data["actual_inputs"])
+            plan.__actual_outputs[layer] = list(layer_data["actual_outputs"])
+            plan.__predecessors[layer] = [layers_by_name[name] for name in layer_data["predecessors"]]
+            call_input_names, call_output_names = layer_data["call_names"]
+            plan.__call_names[layer] = (list(call_input_names), list(call_output_names))
+
+        plan.__index_writers()
+        return plan
+
+    def run(self,
+            state: dict[str, Any],
+            executor: Executor | None = None,
+            scheduler: str = "levels",
+            release: StateRelease | None = None,
+            transport: Transport | None = None) -> dict[str, Any]:
+        """
+        Executes all the layers of the plan updating ``state`` in place.
+
+        :param state: Initial state, its keys must match the input names of the plan.
+        :param executor: If provided, the layers are run concurrently on it.
+        :param scheduler: "levels" runs the plan level by level, waiting for a level to complete before starting
+            the next one. "dataflow" dispatches each layer as soon as all its predecessors have completed. In both
+            cases, when several layers produce the same output the value of the last layer in the plan is kept.
+        :param release: If provided, it drops from the state the names that are no longer needed as the layers run.
+        :param transport: If provided, the layers are submitted through it: a SharedMemoryTransport exchanges the
+            arrays with the layers run on ``executor`` through shared memory, and a DistributedRun runs the layers on
+            remote nodes, without an executor. The caller must close it after the run.
+        :return: The state updated with the outputs of every layer.
+        """
+        assert scheduler in ["levels", "dataflow"], \
+            f"Allowed schedulers are 'levels' and 'dataflow', but got {scheduler}"
+
+        if scheduler == "dataflow" and (executor is not None or is_remote(transport)):
+            self.__start_release(state, release, transport)
+            return self.__run_dataflow(state, executor, release, transport)
+
+        for index in range(len(self.__levels)):
+            self.run_stage(index, state, executor, release, transport)
+
+        return state
+
+    def run_stage(self,
+                  index: int,
+                  state: dict[str, Any],
+                  executor: Executor | None = None,
+                  release: StateRelease | None = None,
+                  transport: Transport | None = None) -> dict[str, Any]:
+        """
+        Executes the layers of the level ``index`` of the plan, updating ``state`` in place. Running all the stages
+        of a state in order is equivalent to ``run`` with the "levels" scheduler.
+
+        :param index: Index of the level in ``levels``.
+        :param state: State produced by the previous stages.
+        :param executor: If provided, the layers of the level are run concurrently on it.
+        :param release: If provided, it drops from the state the names that are no longer needed as the layers run.
+        :param transport: If provided, the layers are submitted through it, see ``run``.
+        :return: The state updated with the outputs of the layers of the level.
+        """
+        level = self.__levels[index]
+
+        if index == 0:
+            self.__start_release(state, release, transport)
+
+        if profiling.active_profilers:
+            return profiling.profile_call("level", f"Level {index}", ", ".join(layer.name for layer in level),
+                                          len(level),
+                                          lambda: self.__run_level(level, state, executor, release, transport), len)
+
+        return self.__run_level(level, state, executor, release, transport)
+
+    def __run_level(self,
+                    level: list[Layer],
+                    state: dict[str, Any],
+                    executor: Executor | None,
+                    release: StateRelease | None,
+                    transport: Transport | None) -> dict[str, Any]:
+        if (executor is None or len(level) == 1) and not is_remote(transport):
+            for layer in level:
+                try:
+                    layer_outputs = call_layer(layer, *self.__call_args(layer, state))
+                except Exception as e:
+                    # Same error as the layers run on the executor, whatever the shape of the level
+                    raise LayerExecutionError(layer.name, e) from e
+                state.update(layer_outputs)
+                self.__layer_done(state, release, layer, layer_outputs, transport)
+            return state
+
+        level_call_args = [self.__call_args(layer, state) for layer in level]
+        for layer, layer_outputs in zip(level, run_level(level, level_call_args, executor, transport)):
+            state.update(layer_outputs)
+            self.__layer_done(state, release, layer, layer_outputs, transport)
+
+        return state
+
+    def __start_release(self,
+                        state: dict[str, Any],
+                        release: StateRelease | None,
+                        transport: Transport | None = None):
+        if release is not None:
+            release.start(state, (self.__actual_inputs[layer] for layer in self.layers))
+        if transport is not None:
+            transport.start(self.__actual_inputs[layer] for layer in self.layers)
+
+    def __layer_done(self,
+                     state: dict[str, Any],
+                     release: StateRelease | None,
+                     layer: Layer,
+                     layer_outputs: dict,
+                     transport: Transport | None = None):
+        if release is not None:
+            release.layer_done(state, self.__actual_inputs[layer], layer_outputs.keys())
+        if transport is not None:
+            transport.layer_done(self.__actual_inputs[layer])
+
+    def run_changed(self, state: dict[str, Any], changed_names: Iterable[str]) -> dict[str, Any]:
+        """
+        Executes again only the layers downstream of ``changed_names``, updating in place a state produced by a
+        previous run. The layers are run serially in the order of the plan, and each of them only marks as changed
+        the outputs it recomputed, e.g. the combinations of a GridMap using a changed value.
+
+        :param state: State of a previous run, with the new values of the changed names.
+        :param changed_names: Names whose value changed since the previous run.
+        :return: The updated state.
+        """
+        changed_names = set(changed_names)
+
+        for layer in self.layers:
+            changed_inputs = changed_names.intersection(self.__actual_inputs[layer])
+
+            if not changed_inputs:
+                continue
+
+            try:
+                layer_outputs = layer._call_changed(*self.__call_args(layer, state), changed_inputs)
+            except Exception as e:
+                raise LayerExecutionError(layer.name, e) from e
+
+            for name, value in layer_outputs.items():
+                if self.__rank[layer] >= self.__last_writer.get(name, -1):
+                    state[name] = value
+                    changed_names.add(name)
+
+        return state
+
+    async def arun(self,
+                   state: dict[str, Any],
+                   max_concurrency: int | None = None,
+                   release: StateRelease | None = None) -> dict[str, Any]:
+        """
+        Asynchronous counterpart of ``run``. Each layer is awaited as soon as all its predecessors have completed,
+        so independent layers run concurrently on the event loop.
+
+        :param state: Initial state, its keys must match the input names of the plan.
+        :param max_concurrency: Maximum number of layers running at the same time. If None, there is no limit.
+        :param release: If provided, it drops from the state the names that are no longer needed as the layers run.
+        :return: The state updated with the outputs of every layer.
+        """
+        self.__start_release(state, release)
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency is not None else None
+        writers: dict[str, int] = dict()
+        tasks: dict[Layer, asyncio.Task] = dict()
+
+        async def run_layer(_layer: Layer):
+            await asyncio.gather(*(tasks[predecessor] for predecessor in self.__predecessors[_layer]))
+
+            try:
+                if semaphore is None:
+                    layer_outputs = await _layer._acall_initialized(*self.__call_args(_layer, state))
+                else:
+                    async with semaphore:
+                        layer_outputs = await _layer._acall_initialized(*self.__call_args(_layer, state))
+            except Exception as e:
+                raise LayerExecutionError(_layer.name, e) from e
+
+            self.__merge_outputs(state, writers, _layer, layer_outputs)
+            self.__layer_done(state, release, _layer, layer_outputs)
+
+        # Layers are sorted topologically, so the tasks of the predecessors are always created first
+        for layer in self.layers:
+            tasks[layer] = asyncio.create_task(run_layer(layer))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        return state
+
+    def __merge_outputs(self, state: dict[str, Any], writers: dict[str, int], layer: Layer, layer_outputs: dict):
+        # When several layers produce the same name, the output of the last layer in the plan is kept
+        for name, value in layer_outputs.items():
+            if self.__rank[layer] >= writers.get(name, -1):
+                state[name] = value
+                writers[name] = self.__rank[layer]
+
+    def __run_dataflow(self,
+                       state: dict[str, Any],
+                       executor: Executor | None,
+                       release: StateRelease | None,
+                       transport: Transport | None) -> dict[str, Any]:
+        layers = self.layers
+        rank = self.__rank
+
+        waiting = {layer: set(self.__predecessors[layer]) for layer in layers}
+        successors = defaultdict(list)
+        for layer in layers:
+            for predecessor in waiting[layer]:
+                successors[predecessor].append(layer)
+
+        writers: dict[str, int] = dict()  # state name => rank of the layer that wrote it
+        running: dict[Future, Layer] = dict()
+
+        def submit(_layer: Layer):
+            running[submit_layer(executor, _layer, self.__call_args(_layer, state), transport)] = _layer
+
+        for layer in layers:
+            if not waiting[layer]:
+                submit(layer)
+
+        try:
+            while running:
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+
+                for future in sorted(done, key=lambda f: rank[running[f]]):
+                    layer = running.pop(future)
+                    layer_outputs = get_layer_result(layer, future, transport)
+                    self.__merge_outputs(state, writers, layer, layer_outputs)
+                    self.__layer_done(state, release, layer, layer_outputs, transport)
+
+                    for successor in successors[layer]:
+                        waiting[successor].discard(layer)
+                        if not waiting[successor]:
+                            submit(successor)
+        except LayerExecutionError:
+            discard_layer_results(running.keys(), transport)
+            raise
+
+        return state
+
+    def select(self, targets: Iterable[str | Template]) -> "ExecutionPlan":
+        """
+        Returns a plan with only the layers needed to compute the names matching ``targets``: the layers producing
+        them and, recursively, their predecessors.
+
+        :param targets: Templates of the names to be computed, see ``to_target``.
+        :raises ValueError: If no input or output of the plan matches one of the targets.
+        """
+        targets = list(map(to_target, targets))
+        index = TemplateIndex(self.__state_producers.keys())
+
+        missing_targets = [str(target) for target in targets if index.find(target) is None]
+        if missing_targets:
+            raise ValueError(f"Unable to find the targets: {missing_targets}")
+
+        stack = [producer for target in targets for name in index.find(target)
+                 for producer in self.__state_producers[name]]
+        needed = set()
+
+        while stack:
+            layer = stack.pop()
+
+            if layer not in needed:
+                needed.add(layer)
+                stack.extend(self.__predecessors[layer])
+
+        # The snapshots of the layers are shared, only the levels are filtered
+        plan = copy.copy(self)
+        plan.__levels = [level for level in ([layer for layer in level if layer in needed]
+                                             for level in self.__levels) if level]
+        return plan
+
+    def layer_inputs(self, layer: Layer, state: dict[str, Any]) -> dict[str, Any]:
+        return {name: state[name] for name in self.__actual_inputs[layer]}
+
+    def __call_args(self, layer: Layer, state: dict[str, Any]) -> tuple[dict[str, Any], list[str], list[str]]:
+        return self.layer_inputs(layer, state), *self.__call_names[layer]
+
+    def actual_inputs(self, layer: Layer) -> list[str]:
+        return self.__actual_inputs[layer]
+
+    def actual_outputs(self, layer: Layer) -> list[str]:
+        return self.__actual_outputs[layer]
+
+    def predecessors(self, layer: Layer) -> list[Layer]:
+        return self.__predecessors[layer]
+
+    @property
+    def input_names(self) -> frozenset[str]:
+        return self.__input_names
+
+    @property
+    def levels(self) -> list[list[Layer]]:
+        return self.__levels
+
+    @property
+    def layers(self) -> list[Layer]:
+        return [layer for level in self.__levels for layer in level]
+
+    @property
+    def state_producers(self) -> dict[str, list[Layer]]:
+        return self.__state_producers
+
+    def __repr__(self):
+        return (f"ExecutionPlan(inputs={sorted(self.__input_names)}, "
+                f"levels={[[layer.name for layer in level] for level in self.__levels]})")
@@ -0,0 +1,339 @@
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, NamedTuple
+
+# Profilers currently recording. Instrumented code only checks that the list is empty when profiling is disabled.
+active_profilers: list["Profiler"] = []
+_active_profilers_lock = threading.Lock()
+
+
+class ProfileRecord(NamedTuple):
+    kind: str  # "layer", "combination" (a function call of a GridMap) or "level" (a stage of an ExecutionPlan)
+    name: str
+    label: str  # Input names of a combination, empty for the other kinds
+    start: float  # time.perf_counter() at the start
+    wall_time: float
+    cpu_time: float  # CPU time of the thread running the call
+    n_inputs: int
+    n_outputs: int
+    allocated_bytes: int | None  # Net bytes allocated during the call, None if memory is not traced
+    process_id: int
+    thread_id: int
+    thread_name: str
+    error: str | None = None  # repr of the exception raised by the call, None if it succeeded
+
+
+class ProfileSummary(NamedTuple):
+    kind: str
+    name: str
+    calls: int
+    wall_time: float
+    cpu_time: float
+    max_wall_time: float
+    n_inputs: int
+    n_outputs: int
+    allocated_bytes: int | None
+    errors: int
+
+
+class Profiler:
+    """
+    Context manager recording the execution of the layers run while it is active, in any thread of the process.
+    A record is made for each layer call, each function call of a GridMap and each level of an execution plan run
+    with the "levels" scheduler, and ``report`` summarises them. The calls run by a ProcessPoolExecutor, of a Model
+    or of a GridMap, are recorded in the worker process and their records are sent back with the results, but the
+    hooks are not called for them. Layers run by a distributed backend are not recorded.
+    """
+
+    def __init__(self,
+                 on_layer_start: Callable[[Any, dict[str, Any]], None] | None = None,
+                 on_layer_end: Callable[[Any, ProfileRecord], None] | None = None,
+                 trace_memory: bool = False):
+        """
+
+        :param on_layer_start: Called with the layer and its inputs before a layer runs in this process.
+        :param on_layer_end: Called with the layer and its record after a layer runs in this process, also when it
+            fails.
+        :param trace_memory: If True, the net bytes allocated by each call are measured with tracemalloc, which
+            slows down the execution considerably. Allocations made by concurrent calls are not told apart.
+        """
+        self.on_layer_start = on_layer_start
+        self.on_layer_end = on_layer_end
+        self.__trace_memory = trace_memory
+        self.__started_tracemalloc = False
+        self.__records: list[ProfileRecord] = []
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        if self.__trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracemalloc = True
+
+        with _active_profilers_lock:
+            active_profilers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with _active_profilers_lock:
+            active_profilers.remove(self)
+
+        if self.__started_tracemalloc:
+            tracemalloc.stop()
+            self.__started_tracemalloc = False
+
+    @property
+    def trace_memory(self) -> bool:
+        return self.__trace_memory
+
+    def add(self, record: ProfileRecord):
+        with self.__lock:
+            self.__records.append(record)
+
+    @property
+    def records(self) -> list[ProfileRecord]:
+        with self.__lock:
+            return list(self.__records)
+
+    def clear(self):
+        with self.__lock:
+            self.__records.clear()
+
+    def summary(self, kinds: tuple[str, ...] = ("layer", "combination")) -> list[ProfileSummary]:
+        """
+        Aggregates the records by kind and name, sorted by cumulative wall time.
+
+        :param kinds: Kinds of records to aggregate.
+        """
+        groups = defaultdict(list)
+        for record in self.records:
+            if record.kind in kinds:
+                groups[(record.kind, record.name)].append(record)
+
+        summaries = []
+        for (kind, name), records in groups.items():
+            allocated = [record.allocated_bytes for record in records if record.allocated_bytes is not None]
+            summaries.append(ProfileSummary(kind=kind,
+                                            name=name,
+                                            calls=len(records),
+                                            wall_time=sum(record.wall_time for record in records),
+                                            cpu_time=sum(record.cpu_time for record in records),
+                                            max_wall_time=max(record.wall_time for record in records),
+                                            n_inputs=sum(record.n_inputs for record in records),
+                                            n_outputs=sum(record.n_outputs for record in records),
+                                            allocated_bytes=sum(allocated) if allocated else None,
+                                            errors=sum(record.error is not None for record in records)))
+
+        return sorted(summaries, key=lambda summary: summary.wall_time, reverse=True)
+
+    def report(self, kinds: tuple[str, ...] = ("layer", "combination")) -> str:
+        """
+        Returns the summary formatted as a table.
+        """
+        header = ("Kind", "Name", "Calls", "Wall (s)", "CPU (s)", "Max wall (s)", "Inputs", "Outputs", "Allocated",
+                  "Errors")
+        rows = [(summary.kind, summary.name, str(summary.calls), f"{summary.wall_time:.6f}",
+                 f"{summary.cpu_time:.6f}", f"{summary.max_wall_time:.6f}", str(summary.n_inputs),
+                 str(summary.n_outputs), "-" if summary.allocated_bytes is None else str(summary.allocated_bytes),
+                 str(summary.errors))
+                for summary in self.summary(kinds)]
+
+        widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+        lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+                 for row in [header, *rows]]
+        lines.insert(1, "  ".join("-" * width for width in widths))
+
+        return "\n".join(lines)
+
+
+class _Span:
+    """
+    Measures a call and adds its record to the active profilers.
+    """
+
+    def __init__(self, kind: str, name: str, label: str = "", n_inputs: int = 0):
+        self.__kind = kind
+        self.__name = name
+        self.__label = label
+        self.__n_inputs = n_inputs
+        self.__profilers = list(active_profilers)
+        self.__trace_memory = (tracemalloc.is_tracing()
+                               and any(profiler.trace_memory for profiler in self.__profilers))
+
+    def start(self):
+        self.__start_memory = tracemalloc.get_traced_memory()[0] if self.__trace_memory else None
+        self.__start_cpu = time.thread_time()
+        self.__start = time.perf_counter()
+
+    def end(self, n_outputs: int = 0, error: BaseException | None = None) -> ProfileRecord:
+        wall_time = time.perf_counter() - self.__start
+        cpu_time = time.thread_time() - self.__start_cpu
+        allocated_bytes = None
+        if self.__start_memory is not None:
+            allocated_bytes = max(0, tracemalloc.get_traced_memory()[0] - self.__start_memory)
+
+        thread = threading.current_thread()
+        record = ProfileRecord(self.__kind, self.__name, self.__label, self.__start, wall_time, cpu_time,
+                               self.__n_inputs, n_outputs, allocated_bytes, os.getpid(), thread.ident, thread.name,
+                               None if error is None else repr(error))
+
+        for profiler in self.__profilers:
+            profiler.add(record)
+
+        return record
+
+    @property
+    def profilers(self) -> list[Profiler]:
+        return self.__profilers
+
+
+def _end_layer_span(span: _Span, layer: Any, outputs: dict[str, Any] | None, error: BaseException | None):
+    record = span.end(0 if outputs is None else len(outputs), error)
+
+    for profiler in span.profilers:
+        if profiler.on_layer_end is not None:
+            profiler.on_layer_end(layer, record)
+
+
+def profile_layer(layer: Any, inputs: dict[str, Any], run: Callable[[], dict[str, Any]]) -> dict[str, Any]:
+    """
+    Runs ``run``, the execution of ``layer`` on ``inputs``, recording it in the active profilers.
+    """
+    span = _Span("layer", layer.name, n_inputs=len(inputs))
+    for profiler in span.profilers:
+        if profiler.on_layer_start is not None:
+            profiler.on_layer_start(layer, inputs)
+
+    span.start()
+    outputs, error = None, None
+    try:
+        outputs = run()
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _end_layer_span(span, layer, outputs, error)
+
+    return outputs
+
+
+async def aprofile_layer(layer: Any,
+                         inputs: dict[str, Any],
+                         run: Callable[[], Awaitable[dict[str, Any]]]) -> dict[str, Any]:
+    """
+    Asynchronous counterpart of ``profile_layer``. The CPU time includes the other tasks run by the event loop
+    while the layer is awaited.
+    """
+    span = _Span("layer", layer.name, n_inputs=len(inputs))
+    for profiler in span.profilers:
+        if profiler.on_layer_start is not None:
+            profiler.on_layer_start(layer, inputs)
+
+    span.start()
+    outputs, error = None, None
+    try:
+        outputs = await run()
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _end_layer_span(span, layer, outputs, error)
+
+    return outputs
+
+
+def profile_call(kind: str,
+                 name: str,
+                 label: str,
+                 n_inputs: int,
+                 run: Callable[[], Any],
+                 count_outputs: Callable[[Any], int] | None = None) -> Any:
+    """
+    Runs ``run`` recording it in the active profilers, e.g. a function call of a GridMap or a level of a plan.
+
+    :param count_outputs: Returns the number of outputs in the result of ``run``. If None, it is 0.
+    """
+    span = _Span(kind, name, label, n_inputs)
+    span.start()
+    try:
+        result = run()
+    except BaseException as e:
+        span.end(error=e)
+        raise
+
+    span.end(count_outputs(result) if count_outputs is not None else 0)
+    return result
+
+
+async def aprofile_call(kind: str,
+                        name: str,
+                        label: str,
+                        n_inputs: int,
+                        run: Callable[[], Awaitable[Any]],
+                        count_outputs: Callable[[Any], int] | None = None) -> Any:
+    """
+    Asynchronous counterpart of ``profile_call``.
+    """
+    span = _Span(kind, name, label, n_inputs)
+    span.start()
+    try:
+        result = await run()
+    except BaseException as e:
+        span.end(error=e)
+        raise
+
+    span.end(count_outputs(result) if count_outputs is not None else 0)
+    return result
+
+
+class _WorkerResult(NamedTuple):
+    result: Any
+    error: Exception | None
+    records: list[ProfileRecord]
+
+
+def submit(executor: Executor, func: Callable, *args: Any) -> Future:
+    """
+    Submits ``func(*args)`` to ``executor``. If profiling is active and ``executor`` is a ProcessPoolExecutor, the
+    call is profiled in the worker process, and the result of the future must be passed to ``worker_result``.
+    """
+    if active_profilers and isinstance(executor, ProcessPoolExecutor):
+        trace_memory = any(profiler.trace_memory for profiler in active_profilers)
+        return executor.submit(_call_profiled, trace_memory, func, *args)
+
+    return executor.submit(func, *args)
+
+
+def worker_result(result: Any) -> Any:
+    """
+    Returns the result of a call submitted by ``submit``, adding the records made in the worker to the active
+    profilers.
+
+    :raises Exception: The exception raised by the call.
+    """
+    if not isinstance(result, _WorkerResult):
+        return result
+
+    for profiler in list(active_profilers):
+        for record in result.records:
+            profiler.add(record)
+
+    if result.error is not None:
+        raise result.error
+    return result.result
+
+
+def _call_profiled(trace_memory: bool, func: Callable, *args: Any) -> _WorkerResult:
+    # A forked worker inherits copies of the profilers active when it started, whose records would be lost
+    active_profilers.clear()
+
+    with Profiler(trace_memory=trace_memory) as profiler:
+        try:
+            result = func(*args)
+        except Exception as e:
+            return _WorkerResult(None, e, profiler.records)
+
+    return _WorkerResult(result, None, profiler.records)
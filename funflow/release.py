@@ -0,0 +1,113 @@
+from collections import Counter
+from typing import Any, Callable, Iterable
+from .result_cache import estimate_size
+
+
+class ConsumerCounts:
+    """
+    Counts, for every name of a state, the layers that still have to read it while a plan runs. A name can be
+    released once it has no remaining consumer.
+    """
+
+    def __init__(self):
+        self.__remaining: Counter[str] = Counter()
+
+    def add(self, layers_input_names: Iterable[list[str]]):
+        """
+        :param layers_input_names: For each layer that will run, the names it reads from the state.
+        """
+        for input_names in layers_input_names:
+            self.__remaining.update(set(input_names))
+
+    def consume(self, input_names: Iterable[str]) -> list[str]:
+        """
+        Records that a layer reading ``input_names`` has run.
+
+        :return: The names among ``input_names`` that no remaining layer reads.
+        """
+        released = []
+        for name in dict.fromkeys(input_names):
+            self.__remaining[name] -= 1
+            if self.__remaining[name] <= 0:
+                released.append(name)
+
+        return released
+
+    def is_consumed(self, name: str) -> bool:
+        # Names that no layer reads are consumed from the start
+        return self.__remaining[name] <= 0
+
+
+class StateRelease:
+    """
+    Drops the names of a state as soon as all the layers consuming them have run, unless ``keep`` returns True
+    for them, and tracks the bytes retained by the state while a plan runs.
+
+    An instance is meant for a single run of a plan.
+    """
+
+    def __init__(self, keep: Callable[[str], bool]):
+        """
+
+        :param keep: Returns True for the names that must be kept until the end of the run, e.g. the outputs.
+        """
+        self.__keep = keep
+        self.__kept: dict[str, bool] = dict()
+        self.__consumers = ConsumerCounts()
+        self.__sizes: dict[str, int] = dict()
+        self.__current_bytes = 0
+        self.__peak_bytes = 0
+
+    def start(self, state: dict[str, Any], layers_input_names: Iterable[list[str]]):
+        """
+        Counts the consumers of every name and drops the inputs that are never consumed.
+
+        :param layers_input_names: For each layer that will run, the names it reads from the state.
+        """
+        self.__consumers.add(layers_input_names)
+        self.__add(state, list(state.keys()))
+
+    def layer_done(self, state: dict[str, Any], input_names: list[str], output_names: Iterable[str]):
+        """
+        Records the outputs written by a layer in the state, then releases its inputs.
+        """
+        self.__add(state, [name for name in output_names if name in state])
+
+        for name in self.__consumers.consume(input_names):
+            self.__release(state, name)
+
+    def __add(self, state: dict[str, Any], names: list[str]):
+        for name in names:
+            size = estimate_size(state[name])
+            self.__current_bytes += size - self.__sizes.get(name, 0)
+            self.__sizes[name] = size
+
+        self.__peak_bytes = max(self.__peak_bytes, self.__current_bytes)
+
+        for name in names:
+            self.__release(state, name)
+
+    def __release(self, state: dict[str, Any], name: str):
+        if not self.__consumers.is_consumed(name) or name not in state:
+            return
+
+        if name not in self.__kept:
+            self.__kept[name] = self.__keep(name)
+
+        if self.__kept[name]:
+            return
+
+        del state[name]
+        self.__current_bytes -= self.__sizes.pop(name, 0)
+
+    @property
+    def current_bytes(self) -> int:
+        return self.__current_bytes
+
+    @property
+    def peak_bytes(self) -> int:
+        """
+        Maximum estimated size in bytes of the values retained by the state at the end of a layer, including its
+        outputs and its inputs.
+        """
+        return self.__peak_bytes
@@ -0,0 +1,111 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, NamedTuple
+from .optional import loaded_module
+
+DEFAULT_MAX_ENTRIES = 128
+
+
+class ResultCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    max_entries: int | None
+    max_bytes: int | None
+    current_entries: int
+    current_bytes: int
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Returns an estimate of the memory used by ``value`` in bytes. NumPy arrays and pandas objects are measured from
+    their buffers and containers recursively.
+    """
+    np, pd = loaded_module("numpy"), loaded_module("pandas")
+    if np is not None and isinstance(value, np.ndarray):
+        return value.nbytes
+    if pd is not None and isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if pd is not None and isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(map(estimate_size, value))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    Thread safe LRU store of layer outputs, bounded by the number of entries and by their estimated size in bytes.
+    The least recently used entries are evicted first, and outputs larger than ``max_bytes`` are never stored.
+
+    A bound of None means no limit. When pickled, e.g. to send a cached layer to a worker process, only the bounds
+    are kept and the copy starts empty.
+    """
+
+    def __init__(self, max_entries: int | None = DEFAULT_MAX_ENTRIES, max_bytes: int | None = None):
+        assert max_entries is None or max_entries >= 0, \
+            f"max_entries must be None or non negative, but got {max_entries}"
+        assert max_bytes is None or max_bytes >= 0, f"max_bytes must be None or non negative, but got {max_bytes}"
+
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__data: OrderedDict[str, tuple[dict[str, Any], int]] = OrderedDict()
+        self.__current_bytes = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self.__lock:
+            entry = self.__data.get(key)
+
+            if entry is None:
+                self.__misses += 1
+                return None
+
+            self.__data.move_to_end(key)
+            self.__hits += 1
+            return dict(entry[0])
+
+    def put(self, key: str, outputs: dict[str, Any]):
+        size = estimate_size(outputs)
+
+        if self.__max_entries == 0 or (self.__max_bytes is not None and size > self.__max_bytes):
+            return
+
+        with self.__lock:
+            if key in self.__data:
+                self.__current_bytes -= self.__data.pop(key)[1]
+
+            self.__data[key] = (dict(outputs), size)
+            self.__current_bytes += size
+            self.__evict()
+
+    def __evict(self):
+        while ((self.__max_entries is not None and len(self.__data) > self.__max_entries)
+               or (self.__max_bytes is not None and self.__current_bytes > self.__max_bytes)):
+            _, (_, size) = self.__data.popitem(last=False)
+            self.__current_bytes -= size
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            self.__current_bytes = 0
+            self.__hits = 0
+            self.__misses = 0
+
+    def info(self) -> ResultCacheInfo:
+        return ResultCacheInfo(self.__hits, self.__misses, self.__max_entries, self.__max_bytes,
+                               len(self.__data), self.__current_bytes)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__data
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __reduce__(self):
+        return ResultCache, (self.__max_entries, self.__max_bytes)
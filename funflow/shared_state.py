@@ -0,0 +1,297 @@
+import pickle
+import weakref
+from collections import defaultdict
+from concurrent.futures import Executor, Future
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Iterable, NamedTuple
+from . import profiling
+from .layer import Layer
+from .optional import loaded_module
+from .release import ConsumerCounts
+
+# Arrays smaller than this are pickled, as creating and mapping a block costs more than copying them
+DEFAULT_MIN_BYTES = 2 ** 16
+
+
+class SharedArray(NamedTuple):
+    """
+    Reference to a C-contiguous NumPy array stored at the start of a shared memory block.
+    """
+    block: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+class SharedSeries(NamedTuple):
+    values: SharedArray
+    index: Any
+    name: Any
+
+
+class SharedFrame(NamedTuple):
+    columns: list[Any]  # SharedArray for the columns backed by NumPy arrays, the values of the other columns
+    column_names: Any
+    index: Any
+
+
+def start_resource_tracker():
+    """
+    Starts the resource tracker of the process if it is not running. Worker processes started afterwards share it,
+    so the blocks created by a worker and unlinked by the parent process are tracked by the same process.
+    """
+    resource_tracker.ensure_running()
+
+
+def is_shareable(value: Any, min_bytes: int) -> bool:
+    np = loaded_module("numpy")
+    return (np is not None and isinstance(value, np.ndarray) and not value.dtype.hasobject
+            and value.nbytes >= min_bytes)
+
+
+def to_shared(value: Any, min_bytes: int, share_array: Callable[[Any], SharedArray]) -> Any:
+    """
+    Replaces the NumPy arrays in ``value``, and in the columns of pandas objects, with references to shared memory
+    blocks created by ``share_array``. Other values are returned unchanged, to be pickled.
+    """
+    pd = loaded_module("pandas")
+
+    if is_shareable(value, min_bytes):
+        return share_array(value)
+
+    if pd is not None and isinstance(value, pd.Series) and is_shareable(value.to_numpy(), min_bytes):
+        return SharedSeries(share_array(value.to_numpy()), value.index, value.name)
+
+    if pd is not None and isinstance(value, pd.DataFrame) and value.memory_usage(deep=False).sum() >= min_bytes:
+        columns = []
+        for i in range(value.shape[1]):
+            column = value.iloc[:, i]
+            columns.append(share_array(column.to_numpy()) if is_shareable(column.to_numpy(), 0) else column)
+        return SharedFrame(columns, value.columns, value.index)
+
+    return value
+
+
+def from_shared(value: Any, attach: Callable[[SharedArray], Any]) -> Any:
+    """
+    Inverse of ``to_shared``: replaces the references to shared memory blocks with views returned by ``attach``.
+    Data frames are rebuilt from the views of their columns, which pandas may copy.
+    """
+    if isinstance(value, SharedArray):
+        return attach(value)
+
+    if isinstance(value, SharedSeries):
+        pd = loaded_module("pandas")
+        return pd.Series(attach(value.values), index=value.index, name=value.name, copy=False)
+
+    if isinstance(value, SharedFrame):
+        pd = loaded_module("pandas")
+        columns = [attach(column) if isinstance(column, SharedArray) else column for column in value.columns]
+        frame = pd.DataFrame(dict(enumerate(columns)), index=value.index, copy=False)
+        frame.columns = value.column_names
+        return frame
+
+    return value
+
+
+def attach_block(array: SharedArray) -> Any:
+    """
+    Returns a read-only view of an array stored in a shared memory block. The block stays mapped as long as the view
+    (or any view derived from it) is alive.
+    """
+    import numpy as np  # References to arrays are only created when NumPy is available
+
+    block = shared_memory.SharedMemory(array.block)
+    view = np.ndarray(array.shape, np.dtype(array.dtype), buffer=block.buf)
+    view.flags.writeable = False
+
+    # Closing a block unmaps it even if arrays still point to it, so it is closed only when the view is collected
+    weakref.finalize(view, block.close)
+    return view
+
+
+def create_block(array: Any) -> SharedArray:
+    """
+    Copies an array into a new shared memory block, which exists until it is unlinked.
+    """
+    import numpy as np
+
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    view = np.ndarray(array.shape, array.dtype, buffer=block.buf)
+    view[...] = array
+    del view
+    block.close()
+
+    return SharedArray(block.name, array.shape, array.dtype.str)
+
+
+def create_pickled_block(value: Any) -> str:
+    """
+    Pickles a value into a new shared memory block, which exists until it is unlinked, and returns the block name.
+    """
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    block.close()
+
+    return block.name
+
+
+def load_pickled_block(block_name: str) -> Any:
+    """
+    Returns a copy of the value stored by ``create_pickled_block``. The bytes following the pickle are ignored.
+    """
+    block = shared_memory.SharedMemory(block_name)
+    try:
+        return pickle.loads(block.buf)
+    finally:
+        block.close()
+
+
+def unlink_block(block_name: str):
+    try:
+        shared_memory.SharedMemory(block_name).unlink()
+    except FileNotFoundError:  # Already removed, e.g. by the resource tracker of an exited worker
+        pass
+
+
+def call_layer_shared(layer: Layer,
+                      layer_inputs: dict[str, Any],
+                      actual_input_names: list[str],
+                      actual_output_names: list[str],
+                      min_bytes: int) -> dict[str, Any]:
+    """
+    Calls a layer in a worker process on inputs whose arrays are references to shared memory blocks. The layer
+    receives read-only views of the blocks, and the arrays of its outputs are written to new blocks, which are
+    unlinked by the process receiving them.
+    """
+    created = []
+
+    def share_array(array: Any) -> SharedArray:
+        created.append(create_block(array))
+        return created[-1]
+
+    try:
+        inputs = {name: from_shared(value, attach_block) for name, value in layer_inputs.items()}
+        outputs = layer._call_initialized(inputs, actual_input_names, actual_output_names)
+        return {name: to_shared(value, min_bytes, share_array) for name, value in outputs.items()}
+    except BaseException:
+        for shared_array in created:
+            unlink_block(shared_array.block)
+        raise
+
+
+class SharedMemoryTransport:
+    """
+    Moves the NumPy arrays (and the array-backed pandas columns) exchanged with the layers run in worker processes
+    through shared memory blocks instead of pickling them. Workers get read-only views of their inputs, and the
+    arrays they return are mapped in the state without being copied, as read-only views.
+
+    The blocks of a name are unlinked as soon as all the layers reading it have run, and their memory is freed once
+    the views referencing them are collected. An instance is meant for a single run of a plan.
+    """
+    # The layers still run in this process when there is no concurrency to gain
+    remote = False
+
+    def __init__(self, min_bytes: int = DEFAULT_MIN_BYTES):
+        """
+
+        :param min_bytes: Arrays smaller than this are pickled.
+        """
+        self.__min_bytes = min_bytes
+        self.__blocks: set[str] = set()  # Blocks not unlinked yet
+        self.__shared: dict[int, tuple[Any, Any]] = dict()  # id of a value => (value, its reference)
+        self.__name_blocks: dict[str, set[str]] = defaultdict(set)
+        self.__block_names: dict[str, set[str]] = defaultdict(set)
+        self.__consumers = ConsumerCounts()
+
+    def start(self, layers_input_names: Iterable[list[str]]):
+        """
+        :param layers_input_names: For each layer that will run, the names it reads from the state.
+        """
+        self.__consumers.add(layers_input_names)
+
+    def submit(self,
+               executor: Executor,
+               layer: Layer,
+               layer_inputs: dict[str, Any],
+               actual_input_names: list[str],
+               actual_output_names: list[str]) -> Future:
+        """
+        Submits the call of ``layer`` to ``executor``, sharing its input arrays. The result of the future must be
+        passed to ``receive``, after ``profiling.worker_result``.
+        """
+        shared_inputs = {name: self.__share(name, value) for name, value in layer_inputs.items()}
+        return profiling.submit(executor, call_layer_shared, layer, shared_inputs, actual_input_names,
+                                actual_output_names, self.__min_bytes)
+
+    def receive(self, outputs: dict[str, Any]) -> dict[str, Any]:
+        """
+        Maps the arrays of the outputs returned by a worker, taking ownership of their blocks.
+        """
+        result = dict()
+
+        for name, reference in outputs.items():
+            self.__add_references(name, reference)
+            result[name] = from_shared(reference, attach_block)
+
+            if result[name] is not reference:
+                self.__shared[id(result[name])] = (result[name], reference)
+
+        return result
+
+    def layer_done(self, input_names: list[str]):
+        """
+        Unlinks the blocks that no remaining layer reads.
+        """
+        for name in self.__consumers.consume(input_names):
+            for block_name in self.__name_blocks.pop(name, ()):
+                self.__block_names[block_name].discard(name)
+                if not self.__block_names[block_name]:
+                    self.__unlink(block_name)
+
+    def close(self):
+        """
+        Unlinks all the blocks. The views in the state stay valid.
+        """
+        self.__shared.clear()
+        for block_name in list(self.__blocks):
+            self.__unlink(block_name)
+
+    def __share(self, name: str, value: Any) -> Any:
+        if id(value) in self.__shared and self.__shared[id(value)][0] is value:
+            reference = self.__shared[id(value)][1]
+        else:
+            reference = to_shared(value, self.__min_bytes, create_block)
+            if reference is not value:
+                self.__shared[id(value)] = (value, reference)
+
+        self.__add_references(name, reference)
+        return reference
+
+    def __add_references(self, name: str, reference: Any):
+        for block_name in self.__referenced_blocks(reference):
+            self.__blocks.add(block_name)
+            self.__name_blocks[name].add(block_name)
+            self.__block_names[block_name].add(name)
+
+    @staticmethod
+    def __referenced_blocks(reference: Any) -> list[str]:
+        if isinstance(reference, SharedArray):
+            return [reference.block]
+        if isinstance(reference, SharedSeries):
+            return [reference.values.block]
+        if isinstance(reference, SharedFrame):
+            return [column.block for column in reference.columns if isinstance(column, SharedArray)]
+        return []
+
+    def __unlink(self, block_name: str):
+        if block_name not in self.__blocks:
+            return
+
+        self.__blocks.discard(block_name)
+        unlink_block(block_name)
+
+        # Without consumers, a value is no longer sent to the workers
+        for key, (_, reference) in list(self.__shared.items()):
+            if block_name in self.__referenced_blocks(reference):
+                del self.__shared[key]
@@ -51,6 +51,10 @@ class ValueTagFilter(TagFilter):
     def _match(self, tag: str | Tag) -> bool:
         return tag.name == self._name and tag.value == self.__value
 
+    @property
+    def value(self) -> str:
+        return self.__value
+
     def __repr__(self):
         return f"ValueTagFilter({self._name}, {self.__value})"
 
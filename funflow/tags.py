@@ -1,4 +1,6 @@
 import warnings
+import weakref
+from .parse_cache import tag_cache
 
 TAG_VALUE_SEPARATOR = ":"
 
@@ -11,10 +13,28 @@ def get_tag_name(tag_str: str):
 
 
 class Tag:
-    def __init__(self, name: str = None, value: str = None):
+    """
+    Immutable tag made of a name and a value.
+
+    Tags are interned: creating a tag equal to an existing one returns the existing object, and the string
+    representation and the hash are computed only once. Parsed strings are kept in the ``tag_cache``.
+    """
+    __slots__ = ("__name", "__value", "__str", "__hash", "__weakref__")
+
+    # Tags by canonical string
+    __instances = weakref.WeakValueDictionary()
+
+    def __new__(cls, name: str = None, value: str = None):
+        tag_str = None
+
         if value is None:
+            tag = tag_cache.get(name)
+            if tag is not None:
+                return tag
+
             assert TAG_VALUE_SEPARATOR in name, "At least one between name and value must contain the Tag value!"
 
+            tag_str = name
             name, value = name.split(TAG_VALUE_SEPARATOR)
         # elif tag_str is not None and name is not None or value is not None:
         #     warnings.warn(
@@ -23,8 +43,26 @@ class Tag:
         #         UserWarning
         #     )
 
-        self.__name = name.strip()
-        self.__value = value.strip()
+        name = name.strip()
+        value = value.strip()
+        key = (TAG_VALUE_SEPARATOR + " ").join([name, value])
+
+        tag = Tag.__instances.get(key)
+        if tag is None:
+            tag = super().__new__(cls)
+            tag.__name = name
+            tag.__value = value
+            tag.__str = key
+            tag.__hash = hash(key)
+            Tag.__instances[key] = tag
+
+        if tag_str is not None:
+            tag_cache.put(tag_str, tag)
+
+        return tag
+
+    def __reduce__(self):
+        return Tag, (self.__name, self.__value)
 
     @property
     def name(self) -> str:
@@ -35,17 +73,19 @@ class Tag:
         return self.__value
 
     def __str__(self):
-        return (TAG_VALUE_SEPARATOR + " ").join([self.__name, self.__value])
+        return self.__str
 
     def __repr__(self):
         return f'Tag("{self.__name}", "{self.__value}")'
 
     def __hash__(self):
-        return hash(str(self))
+        return self.__hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
+
         if isinstance(other, str):
             other = Tag(other)
 
-        return str(self) == str(other)
-
+        return self.__str == str(other)
@@ -1,131 +1,115 @@
-import itertools
-from typing import Any
+from collections import deque
 
 from .layer import Layer
+from .template_index import TemplateIndex
 from .template_utils import *
-import networkx as nx
+from .optional import import_optional
 
 
-def any_output_match_input_template(input_template: list[Template], output_template_values: list[TemplateValue]) -> bool:
-    return any(template.match(template_value)
-               for template, template_value in itertools.product(input_template, output_template_values))
-    # for input_name in input_template:
-    #
-    #     actual_input_names = find_actual_input_names(input_name, output_template_values)
-    #     if actual_input_names is not None:
-    #         # print(f"input_name: {input_name}, actual_names: {actual_input_names}")
-    #         return True
-    #
-    # return False
-
-
-def find_node_successor(node: Layer, ordered: list[Layer]):
-    return [ordered_node for ordered_node in ordered
-            if node != ordered_node and any_output_match_input_template(ordered_node.inputs, node.actual_outputs)]
-
-
-def process_node(node: Layer,
-                 ordered: list[Layer],
-                 quarantined: list[Layer],
-                 processing: list[Layer],
-                 state_producers: dict[str, list[Layer]],
-                 user_inputs: dict[str, Any],
-                 ):
-    node.init(user_inputs, state_producers)
-
-    actual_outputs = node.actual_outputs
-    actual_inputs = node.actual_inputs
-    # predecessors = node.predecessors
-
-    # print("\nStart Processing Node:", node)
-    # print(f"Predecessor: {list(map(lambda x: x.name, predecessors))}")
-    # print(f"Ordered: {list(map(lambda x: x.name, ordered))}")
-    # print(f"Quarantined: {list(map(lambda x: x.name, quarantined))}")
-
-    if node in quarantined:
-        raise Exception(
-            # f"Cyclical graph detected! Nodes involved: {dict(zip(map(lambda x: x.name, quarantined), quarantined))}")
-            f"Cyclical graph detected! Nodes involved: {list(map(lambda x: x.name, quarantined))}")
-
-    if actual_inputs is not None:
-
-        for actual_name in actual_outputs:
-            if node not in state_producers[str(actual_name)]:
-                state_producers[str(actual_name)].append(node)
-
-        successors = find_node_successor(node, ordered)
-
-        # print(f"Successors: {list(map(lambda x: x.name, successors))}")  # DEBUG
-        ordered.append(node)
-
-        if successors:
-            quarantined.append(node)
-            # processing.extend(successors)  # extend without duplicates
-
-            for successor in successors:
-                ordered.remove(successor)
+def create_graph(layers: list[Layer], user_inputs: dict) -> tuple[list[list[Layer]], dict[str, list[Layer]]]:
+    """
+    Resolves the actual inputs and outputs of every layer and arranges the layers in topological levels.
+
+    Layers are resolved from a work queue: a layer is initialised once all its input templates match a name in the
+    state, and it is queued again whenever another layer registers as producer of a name matching one of its input
+    templates. Producers and consumers are found through indexes, so the work is roughly linear in the number of
+    edges of the graph.
+
+    :param layers: Layers to be arranged.
+    :param user_inputs: User inputs, only the keys are used.
+    :return: The layers grouped in topological levels and the producers of every name in the state.
+    """
+    state_producers = defaultdict(list)  # state[actual_input_name] => list of producers
 
-            for successor in successors:
-                process_node(successor, ordered, quarantined, processing, state_producers, user_inputs)
+    for _input in user_inputs.keys():
+        state_producers[_input] = []
 
-            quarantined.remove(node)
+    state_index = TemplateIndex(state_producers.keys())
 
-        return True
+    consumers = defaultdict(list)  # input template name => list of (layer, input template)
+    for layer in layers:
+        for input_template in layer.inputs:
+            consumers[input_template.name].append((layer, input_template))
 
-    return False
+    queue = deque(layers)
+    queued = set(layers)
+    resolved = set()
 
+    while queue:
+        layer = queue.popleft()
+        queued.discard(layer)
 
-def create_graph(layers: list[Layer], user_inputs: dict) -> tuple[list[list[Layer]], dict[str, list[Layer]]]:
-    state_producers = defaultdict(list)  # state[actual_input_name] => list of producers
+        # Wait until a name matching each input template is available, the layer is queued again when it appears
+        if not all(state_index.find(input_template) is not None for input_template in layer.inputs):
+            continue
 
-    for _input in user_inputs.keys():
-        state_producers[_input] = []
+        layer.init(user_inputs, state_producers, state_index)
+        resolved.add(layer)
 
-    nodes = layers.copy()
-    processing = nodes
-    ordered = []
-    quarantined = []
+        for actual_name in map(str, layer.actual_outputs):
+            if layer in state_producers[actual_name]:
+                continue
 
-    while nodes:
-        node = nodes.pop(0)
+            state_producers[actual_name].append(layer)
+            state_index.add(actual_name)
 
-        result_processing = process_node(node, ordered, quarantined, processing, state_producers, user_inputs)
+            # Consumers of the new name must be initialised again to include it among their inputs
+            template_value = state_index.template_value(actual_name)
+            for consumer, input_template in consumers[template_value.name]:
+                if consumer is not layer and consumer not in queued and input_template.match(template_value):
+                    queue.append(consumer)
+                    queued.add(consumer)
 
-        if not result_processing:
-            nodes.append(node)
+    unresolved = [layer.name for layer in layers if layer not in resolved]
+    if unresolved:
+        raise ValueError(f"Unable to find the inputs of the layers: {unresolved}")
 
-    layered = ordered_to_leveled(ordered)
+    layered = ordered_to_leveled([layer for layer in layers if layer in resolved])
 
     return layered, state_producers
 
 
 def ordered_to_leveled(ordered: list[Layer]) -> list[list[Layer]]:
-    result = []
+    """
+    Groups the layers in levels: each layer is placed in the level after the last level containing one of its
+    predecessors. Layers in the same level keep the order they have in ``ordered``.
+    """
+    position = {layer: i for i, layer in enumerate(ordered)}
+
+    missing_predecessors = dict()
+    successors = defaultdict(list)
+    for layer in ordered:
+        predecessors = {predecessor for predecessor in layer.predecessors if predecessor in position}
+        missing_predecessors[layer] = len(predecessors)
+        for predecessor in predecessors:
+            successors[predecessor].append(layer)
 
-    current_level_layers = []
-    already_included = []
-    remaining = ordered.copy()
-
-    while remaining:
+    result = []
+    current_level_layers = [layer for layer in ordered if not missing_predecessors[layer]]
 
-        # print(len(remaining))  # DEBUG
+    while current_level_layers:
+        result.append(current_level_layers)
 
-        for layer in remaining.copy():
-            if ((not any(map(lambda p: p in current_level_layers, layer.predecessors))) and
-                    all(map(lambda p: p in already_included, layer.predecessors))):
-                # print(layer)
+        next_level_layers = []
+        for layer in current_level_layers:
+            for successor in successors[layer]:
+                missing_predecessors[successor] -= 1
+                if not missing_predecessors[successor]:
+                    next_level_layers.append(successor)
 
-                current_level_layers.append(layer)
-                already_included.append(layer)
-                remaining.remove(layer)
+        current_level_layers = sorted(next_level_layers, key=position.__getitem__)
 
-        result.append(current_level_layers)
-        current_level_layers = []
+    if sum(map(len, result)) < len(ordered):
+        raise Exception(f"Cyclical graph detected! Nodes involved: "
+                        f"{[layer.name for layer in ordered if missing_predecessors[layer]]}")
 
     return result
 
 
-def topological_order_to_nx(topological_order: list[list[Layer]]) -> nx.DiGraph:
+def topological_order_to_nx(topological_order: list[list[Layer]]) -> "networkx.DiGraph":
+    # networkx is only needed for the visualisation, so it is imported on first use
+    nx = import_optional("networkx", "vis")
+
     # PLOT VARIABLE WITH LAYERS AS EDGES
     ordered = sum(topological_order, [])
     layer = 1
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from typing import Iterable
+from .tag_filter import NoTagFilter, ValueTagFilter
+from .templates import Template, TemplateValue
+
+
+class TemplateIndex:
+    """
+    Index of state names used to find the names matching a Template without scanning the whole state.
+
+    Names are parsed once when added, and indexed by template value name, by (name, tag name) and by
+    (name, tag name, tag value). Matching a template is then a lookup followed by a set intersection. The index
+    preserves the insertion order of the names, so the results are the same as scanning the names with
+    ``Template.match``.
+    """
+
+    def __init__(self, names: Iterable[str] = None):
+        self.__position: dict[str, int] = dict()
+        self.__template_values: dict[str, TemplateValue] = dict()
+        self.__by_name: dict[str, set[str]] = defaultdict(set)
+        self.__by_tag: dict[tuple[str, str], set[str]] = defaultdict(set)
+        self.__by_tag_value: dict[tuple[str, str, str], set[str]] = defaultdict(set)
+        self.__unparsed: list[str] = []  # Names that can not be parsed as a TemplateValue
+
+        if names is not None:
+            self.update(names)
+
+    def add(self, name: str):
+        if name in self.__position:
+            return
+
+        self.__position[name] = len(self.__position)
+
+        try:
+            template_value = TemplateValue(name)
+        except (ValueError, AssertionError):
+            self.__unparsed.append(name)
+            return
+
+        self.__template_values[name] = template_value
+        self.__by_name[template_value.name].add(name)
+        for tag in template_value.tags:
+            self.__by_tag[(template_value.name, tag.name)].add(name)
+            self.__by_tag_value[(template_value.name, tag.name, tag.value)].add(name)
+
+    def update(self, names: Iterable[str]):
+        for name in names:
+            self.add(name)
+
+    def find(self, template: Template) -> list[str] | None:
+        """
+        Finds the indexed names matching ``template``, in insertion order.
+
+        :return: The matching names, or None if no name matches the template (as ``find_actual_input_names``).
+        """
+        candidate_sets = [self.__by_name.get(template.name, set())]
+        other_filters = []
+
+        for tag_filter in template.tag_filters:
+            if type(tag_filter) is NoTagFilter:
+                candidate_sets.append(self.__by_tag.get((template.name, tag_filter.name), set()))
+            elif type(tag_filter) is ValueTagFilter:
+                candidate_sets.append(self.__by_tag_value.get((template.name, tag_filter.name, tag_filter.value),
+                                                              set()))
+            else:  # Custom filters can not be indexed
+                other_filters.append(tag_filter)
+
+        candidate_sets.sort(key=len)
+        candidates = candidate_sets[0].intersection(*candidate_sets[1:])
+
+        if other_filters:
+            candidates = {name for name in candidates
+                          if all(any(map(tag_filter.match, self.__template_values[name].tags))
+                                 for tag_filter in other_filters)}
+
+        if self.__unparsed:
+            candidates.update(name for name in self.__unparsed if template.match(name))
+
+        if not candidates:
+            return None
+
+        return sorted(candidates, key=self.__position.__getitem__)
+
+    def template_value(self, name: str) -> TemplateValue:
+        return self.__template_values[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__position
+
+    def __len__(self) -> int:
+        return len(self.__position)
@@ -1,6 +1,7 @@
 import re
 from collections import defaultdict
 import itertools
+from typing import Iterable, Iterator
 
 from .templates import Template, TemplateValue
 
@@ -68,3 +69,65 @@ def create_name_to_inputs_mapping(input_template_values: list[TemplateValue]) ->
         name_to_inputs[input_templ.name].add(input_templ)
 
     return name_to_inputs
+
+
+def iterate_consistent_combinations(candidates: list[Iterable[TemplateValue]]) -> Iterator[tuple[TemplateValue, ...]]:
+    """
+    Yields the combinations of ``itertools.product(*candidates)`` in which no two template values have different
+    values for the same tag name, in the same order as ``itertools.product``.
+
+    The combinations are built one element at a time, as a hash join on the tag names shared with the partial
+    combination, so conflicting partial combinations are discarded as soon as they appear and the work depends on
+    the number of consistent combinations rather than on the size of the product.
+    """
+    candidates = [list(values) for values in candidates]
+    if any(not values for values in candidates):
+        return
+
+    # For each list, the candidates grouped by their set of tag names, as (position, value, tags) tuples
+    groups = []
+    for values in candidates:
+        by_tag_names = defaultdict(list)
+        for position, value in enumerate(values):
+            tags = {tag.name: tag.value for tag in value.tags}
+            by_tag_names[frozenset(tags)].append((position, value, tags))
+        groups.append(by_tag_names)
+
+    # (list index, tag names of the group, shared tag names) => shared tag values => candidates
+    join_indexes = dict()
+
+    def get_matching_candidates(i: int, bound_tags: dict[str, str]) -> list[tuple[int, TemplateValue, dict]]:
+        matching = []
+
+        for tag_names, members in groups[i].items():
+            shared_tag_names = tuple(sorted(tag_names.intersection(bound_tags)))
+
+            if not shared_tag_names:
+                matching.extend(members)
+                continue
+
+            index_key = (i, tag_names, shared_tag_names)
+            if index_key not in join_indexes:
+                join_index = defaultdict(list)
+                for member in members:
+                    join_index[tuple(member[2][tag_name] for tag_name in shared_tag_names)].append(member)
+                join_indexes[index_key] = join_index
+
+            matching.extend(join_indexes[index_key].get(tuple(bound_tags[name] for name in shared_tag_names), []))
+
+        if len(groups[i]) > 1:
+            matching.sort(key=lambda member: member[0])
+
+        return matching
+
+    def extend(i: int, bound_tags: dict[str, str], combination: list[TemplateValue]):
+        if i == len(candidates):
+            yield tuple(combination)
+            return
+
+        for _, value, tags in get_matching_candidates(i, bound_tags):
+            combination.append(value)
+            yield from extend(i + 1, bound_tags | tags, combination)
+            combination.pop()
+
+    yield from extend(0, {}, [])
@@ -1,4 +1,7 @@
 import warnings
+import weakref
+
+from .parse_cache import template_value_cache
 
 from .tags import Tag, get_tag_name
 from .tag_filter import TagFilter
@@ -22,18 +25,56 @@ def find_duplicate_tags(tags: list[Tag]) -> list[str]:
 
 
 class TemplateValue:
-    def __init__(self, name: str, tags: list[Tag] = None):
+    """
+    Immutable name with a set of tags, e.g. "X_train, dataset: raw, version: 1".
+
+    Template values are interned: parsing a string already seen, or building a value equal to an existing one,
+    returns the existing object. The canonical string and the hash are computed only once. Parsed strings are kept
+    in the ``template_value_cache``.
+    """
+    __slots__ = ("__name", "__tags", "__str", "__hash", "__weakref__")
+
+    # Template values by canonical string
+    __instances = weakref.WeakValueDictionary()
+
+    def __new__(cls, name: str, tags: list[Tag] = None):
+        template_value_str = None
+
         if tags is None:
+            template_value = template_value_cache.get(name)
+            if template_value is not None:
+                return template_value
+
+            template_value_str = name
             name, *tag_strings = name.split(TAG_SEPARATOR)
             tags = map(Tag, tag_strings)
 
-        self.__name = name.strip()
+        name = name.strip()
 
         tags = list(set(tags))  # Use the set to remove duplicate tags
         duplicate_tags = find_duplicate_tags(tags)
         if duplicate_tags:
             raise ValueError(f"Multiple values for the same tag found: {duplicate_tags}.")
-        self.__tags = sorted(tags, key=lambda x: x.name)
+        tags = tuple(sorted(tags, key=lambda x: x.name))
+
+        key = (TAG_SEPARATOR + " ").join([name, *map(str, tags)])
+
+        template_value = TemplateValue.__instances.get(key)
+        if template_value is None:
+            template_value = super().__new__(cls)
+            template_value.__name = name
+            template_value.__tags = tags
+            template_value.__str = key
+            template_value.__hash = hash(key)
+            TemplateValue.__instances[key] = template_value
+
+        if template_value_str is not None:
+            template_value_cache.put(template_value_str, template_value)
+
+        return template_value
+
+    def __reduce__(self):
+        return TemplateValue, (self.__name, list(self.__tags))
 
     @property
     def name(self) -> str:
@@ -44,26 +85,23 @@ class TemplateValue:
         return list(self.__tags)
 
     def __str__(self):
-        substrings = [self.name]
-
-        if self.__tags:
-            tags_str = (TAG_SEPARATOR + " ").join(map(str, self.__tags))
-            substrings.append(tags_str)
-
-        return (TAG_SEPARATOR + " ").join(substrings)
+        return self.__str
 
     def __repr__(self):
         tags_repr = ", ".join([f'"{tag.name}"= {repr(tag)}' for tag in self.__tags])
         return f'TemplateValue("{self.__name}", [{tags_repr}])'
 
     def __hash__(self):
-        return hash(str(self))
+        return self.__hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
+
         if isinstance(other, str):
             other = TemplateValue(other)
 
-        return str(self) == str(other)
+        return self.__str == str(other)
 
     def to_dict(self, include_name: bool = True):
         d = dict(map(lambda x: (x.name, x.value), self.__tags))
@@ -102,10 +140,15 @@ class Template:
 
     def match(self, templ_value: str | TemplateValue) -> bool:
         if isinstance(templ_value, str):
-            name, *tags = templ_value.split(TAG_SEPARATOR)
-        else:  # isinstance(templ_value, TemplateValue)
-            name = templ_value.name
-            tags = templ_value.tags
+            try:
+                templ_value = TemplateValue(templ_value)
+            except (ValueError, AssertionError):
+                # Strings that are not valid template values are matched on the raw tag strings
+                name, *tags = templ_value.split(TAG_SEPARATOR)
+                return name.strip() == self.__name and self.match_tags(tags)
+
+        name = templ_value.name
+        tags = templ_value.tags
 
         return name.strip() == self.__name and self.match_tags(tags)
 
@@ -0,0 +1,137 @@
+import json
+import os
+from collections import defaultdict
+from typing import Any, Iterable
+from .plan import ExecutionPlan
+from .profiling import Profiler, ProfileRecord
+
+# Lane of the level spans, the thread ids of the other lanes are the ids of the threads running the calls
+LEVELS_LANE = 0
+
+# Names of the process lanes, a lane per process that made calls, worker lanes are followed by the process id
+PROCESS_NAME = "FunFlow"
+WORKER_PROCESS_NAME = "FunFlow worker"
+
+
+def chrome_trace_events(records: Iterable[ProfileRecord], plan: ExecutionPlan | None = None) -> list[dict[str, Any]]:
+    """
+    Converts profile records into Chrome Trace Events. Every layer call and every function call of a GridMap is a
+    span in the lane of the thread that ran it, grouped by process: the calls run by process pool workers are in
+    the lanes of their worker process. The levels of the plans run with the "levels" scheduler are spans in a
+    separate "Levels" lane, the "dataflow" scheduler has no levels. The calls run by a distributed backend are not
+    recorded, so they have no spans.
+
+    :param records: Records of a Profiler.
+    :param plan: If provided, the spans of its layers are annotated with their level and linked by flow arrows to
+        the spans of their predecessors, showing the dependencies between the layers.
+    :return: The list of events, timestamps are in microseconds from the first record.
+    """
+    records = sorted(records, key=lambda record: record.start)
+    if not records:
+        return []
+
+    pid = os.getpid()
+    # The perf_counter clock is shared by the processes of a machine, so the start times of the workers are comparable
+    origin = records[0].start
+    events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": LEVELS_LANE, "args": {"name": PROCESS_NAME}},
+              {"name": "thread_name", "ph": "M", "pid": pid, "tid": LEVELS_LANE, "args": {"name": "Levels"}}]
+
+    worker_ids = sorted({record.process_id for record in records if record.process_id != pid})
+    events += [{"name": "process_name", "ph": "M", "pid": worker_id, "tid": 0,
+                "args": {"name": f"{WORKER_PROCESS_NAME} {worker_id}"}}
+               for worker_id in worker_ids]
+
+    thread_names = {}
+    for record in records:
+        if record.kind != "level":
+            thread_names.setdefault((record.process_id, record.thread_id), record.thread_name)
+    events += [{"name": "thread_name", "ph": "M", "pid": process_id, "tid": thread_id, "args": {"name": thread_name}}
+               for (process_id, thread_id), thread_name in thread_names.items()]
+
+    levels, predecessors = dict(), dict()
+    if plan is not None:
+        for index, level in enumerate(plan.levels):
+            for layer in level:
+                levels[layer.name] = index
+                predecessors[layer.name] = [predecessor.name for predecessor in plan.predecessors(layer)]
+
+    for record in records:
+        args = {"inputs": record.n_inputs, "outputs": record.n_outputs, "cpu_time": record.cpu_time}
+        if record.allocated_bytes is not None:
+            args["allocated_bytes"] = record.allocated_bytes
+        if record.error is not None:
+            args["error"] = record.error
+
+        if record.kind == "level":
+            args["layers"] = record.label
+        elif record.kind == "combination":
+            args["layer"] = record.name
+        elif record.name in levels:
+            args["level"] = levels[record.name]
+
+        events.append({"name": record.label if record.kind == "combination" else record.name,
+                       "cat": record.kind,
+                       "ph": "X",
+                       "ts": _to_microseconds(record.start - origin),
+                       "dur": _to_microseconds(record.wall_time),
+                       "pid": record.process_id,
+                       "tid": LEVELS_LANE if record.kind == "level" else record.thread_id,
+                       "args": args})
+
+    events += _flow_events([record for record in records if record.kind == "layer"], predecessors, origin)
+
+    return events
+
+
+def _flow_events(records: list[ProfileRecord],
+                 predecessors: dict[str, list[str]],
+                 origin: float) -> list[dict[str, Any]]:
+    # Each call of a layer is linked to the last call of each predecessor completed before it started
+    calls = defaultdict(list)
+    for record in records:
+        calls[record.name].append(record)
+
+    events = []
+    for record in records:
+        for predecessor_name in predecessors.get(record.name, []):
+            completed = [predecessor for predecessor in calls[predecessor_name]
+                         if predecessor.start + predecessor.wall_time <= record.start]
+            if not completed:
+                continue
+
+            predecessor = completed[-1]
+            flow_id = len(events) // 2
+            events.append({"name": "dependency", "cat": "dependency", "ph": "s", "id": flow_id,
+                           "pid": predecessor.process_id, "tid": predecessor.thread_id,
+                           "ts": _to_microseconds(predecessor.start - origin)})
+            events.append({"name": "dependency", "cat": "dependency", "ph": "f", "bp": "e", "id": flow_id,
+                           "pid": record.process_id, "tid": record.thread_id,
+                           "ts": _to_microseconds(record.start - origin)})
+
+    return events
+
+
+def _to_microseconds(seconds: float) -> float:
+    return round(seconds * 1e6, 3)
+
+
+def write_chrome_trace(path: str | os.PathLike,
+                       records: Profiler | Iterable[ProfileRecord],
+                       plan: ExecutionPlan | None = None):
+    """
+    Writes the records of a run in the Chrome Trace Event format, which can be opened with Perfetto
+    (https://ui.perfetto.dev) or chrome://tracing.
+
+        with Profiler() as profiler:
+            model(**inputs)
+        write_chrome_trace("trace.json", profiler, model.compile(inputs.keys()))
+
+    :param path: Path of the JSON file.
+    :param records: Profiler, or its records.
+    :param plan: If provided, the dependencies between its layers are drawn, see ``chrome_trace_events``.
+    """
+    if isinstance(records, Profiler):
+        records = records.records
+
+    with open(path, "w") as file:
+        json.dump({"traceEvents": chrome_trace_events(records, plan), "displayTimeUnit": "ms"}, file)
@@ -32,6 +32,6 @@ setuptools.setup(
     extras_require={
         "vis": ["networkx", "graphviz"]
     },
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=["benchmarks", "benchmarks.*"]),
     include_package_data=True,
 )
\ No newline at end of file
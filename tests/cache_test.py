@@ -0,0 +1,148 @@
+import pickle
+import threading
+import unittest
+import warnings
+
+from funflow import Model, Functional, GridMap, Cache, ResultCache, fingerprint_value, fingerprint_function
+from funflow.fingerprint import UnhashableValueError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class CallCounter:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, name: str, func):
+        def counted(*args):
+            self.calls.append(name)
+            return func(*args)
+        return counted
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def test_values(self):
+        self.assertEqual(fingerprint_value({"a": [1, 2.5, "x"]}), fingerprint_value({"a": [1, 2.5, "x"]}))
+        self.assertNotEqual(fingerprint_value(1), fingerprint_value("1"))
+        self.assertNotEqual(fingerprint_value((1, 2)), fingerprint_value((2, 1)))
+        self.assertEqual(fingerprint_value({1, 2, 3}), fingerprint_value({3, 2, 1}))
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_numpy(self):
+        x = np.arange(10.0)
+        self.assertEqual(fingerprint_value(x), fingerprint_value(x.copy()))
+        self.assertEqual(fingerprint_value(x[::2]), fingerprint_value(x[::2].copy()))
+        self.assertNotEqual(fingerprint_value(x), fingerprint_value(x.astype(np.float32)))
+        self.assertNotEqual(fingerprint_value(x), fingerprint_value(x.reshape(2, 5)))
+
+    def test_functions(self):
+        self.assertEqual(fingerprint_function(lambda x: x + 1), fingerprint_function(lambda x: x + 1))
+        self.assertNotEqual(fingerprint_function(lambda x: x + 1), fingerprint_function(lambda x: x + 2))
+
+        def scale(factor):
+            return lambda x: x * factor
+
+        self.assertNotEqual(fingerprint_function(scale(2)), fingerprint_function(scale(3)))
+        self.assertEqual(fingerprint_function(scale(2)), fingerprint_value(scale(2)))
+
+    def test_self_references(self):
+        def factorial(n):
+            return 1 if n <= 1 else n * factorial(n - 1)
+
+        values = [1]
+        values.append(values)
+
+        with self.assertRaises(UnhashableValueError):
+            fingerprint_function(factorial)
+        with self.assertRaises(UnhashableValueError):
+            fingerprint_value(values)
+
+        # Values referenced several times without cycles are hashed as usual
+        shared = [1, 2]
+        self.assertEqual(fingerprint_value([shared, shared]), fingerprint_value([[1, 2], [1, 2]]))
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_max_entries(self):
+        store = ResultCache(max_entries=2)
+        store.put("a", {"x": 1})
+        store.put("b", {"x": 2})
+        store.get("a")
+        store.put("c", {"x": 3})
+
+        self.assertIn("a", store)
+        self.assertNotIn("b", store)
+        self.assertEqual(store.get("c"), {"x": 3})
+
+    def test_max_bytes(self):
+        store = ResultCache(max_entries=None, max_bytes=1000)
+        store.put("small", {"x": 1})
+        store.put("large", {"x": b"0" * 2000})
+
+        self.assertIn("small", store)
+        self.assertNotIn("large", store)
+        self.assertLessEqual(store.info().current_bytes, 1000)
+
+    def test_pickle(self):
+        store = ResultCache(max_entries=3)
+        store.put("a", {"x": 1})
+        copy = pickle.loads(pickle.dumps(store))
+
+        self.assertEqual(len(copy), 0)
+        self.assertEqual(copy.info().max_entries, 3)
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.counter = CallCounter()
+        self.double = Cache(Functional(self.counter("double", lambda x: x * 2), inputs="x", outputs="y"))
+        self.add = Cache(Functional(self.counter("add", lambda y, z: y + z), inputs=["y", "z"], outputs="w"))
+        self.model = Model([self.add, self.double], outputs=["w"])
+
+    def test_only_affected_layers_are_recomputed(self):
+        self.assertEqual(self.model(x=1, z=1), {"w": 3})
+        self.assertEqual(self.model(x=1, z=2), {"w": 4})
+        self.assertEqual(self.model(x=1, z=2), {"w": 4})
+
+        self.assertEqual(self.counter.calls, ["double", "add", "add"])
+        self.assertEqual(self.double.store.info().hits, 2)
+
+    def test_same_results_as_uncached_model(self):
+        layers = [GridMap(lambda x: x + 1, inputs="x", outputs="y"), Functional(sum, inputs="y", outputs="s",
+                                                                                call_type="tuple")]
+        inputs = {"x, i: 1": 1, "x, i: 2": 2}
+        cached_model = Model([Cache(layer) for layer in layers])
+
+        self.assertEqual(cached_model(**inputs), Model(layers)(**inputs))
+        self.assertEqual(cached_model(**inputs), Model(layers)(**inputs))
+
+    def test_standalone_call(self):
+        self.assertEqual(self.double(x=2), {"y": 4})
+        self.assertEqual(self.double(x=2), {"y": 4})
+        self.assertEqual(self.counter.calls, ["double"])
+
+    def test_unhashable_inputs(self):
+        layer = Cache(Functional(lambda x: 1, inputs="x", outputs="y"))
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.assertEqual(layer(x=threading.Lock()), {"y": 1})
+
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(len(layer.store), 0)
+
+    def test_shared_store(self):
+        store = ResultCache()
+        first = Cache(Functional(lambda x: x + 1, inputs="x", outputs="y"), store=store)
+        second = Cache(Functional(lambda x: x + 2, inputs="x", outputs="y"), store=store)
+
+        self.assertEqual(first(x=1), {"y": 2})
+        self.assertEqual(second(x=1), {"y": 3})
+        self.assertEqual(len(store), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import pickle
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from funflow import Model, Functional, DiskCache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CALLS = []
+
+
+def expensive(x):
+    CALLS.append(x)
+    return x * 2
+
+
+class DiskCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_values(self):
+        store = DiskCache(self.directory.name)
+        store.put("a", {"x": 1, "y": [1, 2]})
+
+        self.assertIn("a", store)
+        self.assertEqual(store.get("a"), {"x": 1, "y": [1, 2]})
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.info().hits, 1)
+        self.assertEqual(store.info().misses, 1)
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_arrays_are_memory_mapped(self):
+        store = DiskCache(self.directory.name)
+        store.put("a", {"x": np.arange(100.0), "empty": np.zeros(0)})
+        outputs = store.get("a")
+
+        self.assertIsInstance(outputs["x"], np.memmap)
+        self.assertFalse(outputs["x"].flags.writeable)
+        np.testing.assert_array_equal(outputs["x"], np.arange(100.0))
+        self.assertEqual(outputs["empty"].shape, (0,))
+
+        self.assertNotIsInstance(DiskCache(self.directory.name, mmap=False).get("a")["x"], np.memmap)
+
+    def test_eviction(self):
+        store = DiskCache(self.directory.name, max_entries=2)
+
+        for i, key in enumerate(["a", "b", "c"]):
+            store.put(key, {"x": i})
+            # The modification times must differ to tell which entry was used last
+            os.utime(os.path.join(self.directory.name, key, "outputs.pkl"), (i, i))
+
+        self.assertEqual(len(store), 2)
+        self.assertNotIn("a", store)
+
+        store = DiskCache(self.directory.name, max_bytes=0)
+        store.put("d", {"x": 1})
+        self.assertNotIn("d", store)
+
+    def test_eviction_in_batches(self):
+        store = DiskCache(self.directory.name, max_entries=10)
+
+        for i in range(11):
+            store.put(str(i), {"x": i})
+            os.utime(os.path.join(self.directory.name, str(i), "outputs.pkl"), (i, i))
+
+        # A tenth of the entries is freed, so the next write does not evict again
+        self.assertEqual(len(store), 9)
+        self.assertNotIn("0", store)
+        store.put("11", {"x": 11})
+        self.assertEqual(len(store), 10)
+
+    def test_entry_evicted_while_loading(self):
+        store = DiskCache(self.directory.name)
+        store.put("a", {"x": 1})
+
+        with mock.patch("funflow.disk_cache.os.utime", side_effect=FileNotFoundError):
+            self.assertEqual(store.get("a"), {"x": 1})
+        self.assertEqual(store.info().hits, 1)
+
+    def test_concurrent_writers(self):
+        store = DiskCache(self.directory.name)
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(lambda i: store.put("a", {"x": 1}), range(32)))
+
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.get("a"), {"x": 1})
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, ".tmp")), [])
+
+    def test_pickle(self):
+        store = DiskCache(self.directory.name)
+        store.put("a", {"x": 1})
+
+        self.assertEqual(pickle.loads(pickle.dumps(store)).get("a"), {"x": 1})
+
+    def test_model_warm_run(self):
+        CALLS.clear()
+
+        def create_model():
+            return Model([Functional(expensive, inputs="x", outputs="y", name="Expensive")],
+                         cache=DiskCache(self.directory.name))
+
+        self.assertEqual(create_model()(x=2), {"x": 2, "y": 4})
+        self.assertEqual(create_model()(x=2), {"x": 2, "y": 4})
+        self.assertEqual(create_model()(x=3), {"x": 3, "y": 6})
+        self.assertEqual(CALLS, [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import unittest
+
+from funflow import Model, Functional, LocalCluster, LayerExecutionError
+
+
+def produce(x):
+    return [x] * 10_000, os.getpid()
+
+
+def consume(values):
+    return sum(values), os.getpid()
+
+
+def add(a, b):
+    return a + b
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+def fail_with_both(a, b):
+    raise ValueError(len(a) + len(b))
+
+
+def create_layers() -> list:
+    return [Functional(produce, inputs="x", outputs=["a", "pid_a"], name="Produce A"),
+            Functional(produce, inputs="y", outputs=["b", "pid_b"], name="Produce B"),
+            Functional(consume, inputs="a", outputs=["sum_a", "pid_sum_a"], name="Consume A"),
+            Functional(consume, inputs="b", outputs=["sum_b", "pid_sum_b"], name="Consume B"),
+            Functional(add, inputs=["sum_a", "sum_b"], outputs="total", name="Total")]
+
+
+class DistributedTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cluster = LocalCluster(2)
+        cls.backend = cls.cluster.backend(timeout=30)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cluster.close()
+
+    def assertWorkersEmpty(self):
+        for node in self.backend.nodes:
+            self.assertEqual(self.backend.keys(node), [])
+
+    def test_call_matches_local_run(self):
+        for scheduler in ["levels", "dataflow"]:
+            result = Model(create_layers(), backend=self.backend, scheduler=scheduler)(x=1, y=2)
+            expected = Model(create_layers())(x=1, y=2)
+
+            self.assertEqual(result.keys(), expected.keys())
+            self.assertEqual(result["total"], 30_000)
+            self.assertEqual(result["a"], expected["a"])
+            self.assertWorkersEmpty()
+
+    def test_layers_run_where_their_inputs_are(self):
+        result = Model(create_layers(), backend=self.backend)(x=1, y=2)
+
+        self.assertNotEqual(result["pid_a"], result["pid_b"])
+        self.assertEqual(result["pid_sum_a"], result["pid_a"])
+        self.assertEqual(result["pid_sum_b"], result["pid_b"])
+        self.assertNotIn(os.getpid(), [result["pid_a"], result["pid_b"]])
+
+    def test_only_outputs_are_returned(self):
+        model = Model(create_layers(), outputs=["total"], backend=self.backend)
+
+        self.assertEqual(model(x=1, y=2), {"total": 30_000})
+        self.assertEqual(model(x=1, y=2, targets=["sum_a"]), {"sum_a": 10_000})
+        self.assertWorkersEmpty()
+
+    def test_error_contains_layer_name(self):
+        layers = create_layers() + [Functional(fail, inputs="total", outputs="z", name="Failing")]
+
+        with self.assertRaises(LayerExecutionError) as context:
+            Model(layers, backend=self.backend)(x=1, y=2)
+
+        self.assertEqual(context.exception.layer_name, "Failing")
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+        self.assertWorkersEmpty()
+
+    def test_failed_layer_inputs_are_dropped(self):
+        # The failing layers read an input of the model, stored on their node, and values fetched from another node
+        for layer in [Functional(fail, inputs="x", outputs="z", name="Failing"),
+                      Functional(fail_with_both, inputs=["a", "b"], outputs="z", name="Failing")]:
+            with self.assertRaises(LayerExecutionError):
+                Model(create_layers()[:2] + [layer], backend=self.backend)(x=1, y=2)
+
+            self.assertWorkersEmpty()
+
+    def test_requires_no_executor(self):
+        with self.assertRaises(AssertionError):
+            Model(create_layers(), executor="threads", backend=self.backend)
+
+
+if __name__ == '__main__':
+    unittest.main()
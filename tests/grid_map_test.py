@@ -0,0 +1,142 @@
+import os
+import pickle
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from funflow import GridMap
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def scale(x, factor):
+    return x * factor
+
+
+def worker_pid(x):
+    return os.getpid()
+
+
+class PickleCounter:
+    # Number of times an instance was pickled in this process
+    pickles = 0
+
+    def __init__(self, value):
+        self.value = value
+
+    def __reduce__(self):
+        PickleCounter.pickles += 1
+        return PickleCounter, (self.value,)
+
+
+def add_counted(x, counter):
+    return x + counter.value
+
+
+def scale_kwargs(x, factor):
+    return {"y": x * factor, "z": x}
+
+
+class GridMapParallelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.inputs = {f"x, a:{i}": i for i in range(10)}
+        self.inputs.update({f"factor, b:{i}": 10 ** i for i in range(3)})
+        self.expected = GridMap(scale, inputs=["x", "factor"], outputs=["y"])(**self.inputs)
+
+    def test_threads(self):
+        result = GridMap(scale, inputs=["x", "factor"], outputs=["y"], workers=4)(**self.inputs)
+
+        self.assertEqual(list(result.items()), list(self.expected.items()))
+
+    def test_processes(self):
+        result = GridMap(scale, inputs=["x", "factor"], outputs=["y"], workers=2, executor="processes",
+                         chunk_size=7)(**self.inputs)
+
+        self.assertEqual(list(result.items()), list(self.expected.items()))
+
+    def test_process_pool_is_reused(self):
+        layer = GridMap(worker_pid, inputs=["x"], outputs=["pid"], workers=2, executor="processes", chunk_size=1)
+        self.addCleanup(layer.shutdown)
+
+        # The workers are started on demand, so a call may run on some of them only
+        first_pids = set(layer(**self.inputs).values()) | set(layer(**self.inputs).values())
+        self.assertNotIn(os.getpid(), first_pids)
+        self.assertLessEqual(len(first_pids), 2)
+
+        # The pool is not sent with the layer
+        copy = pickle.loads(pickle.dumps(layer))
+        self.addCleanup(copy.shutdown)
+        self.assertEqual(copy(**{"x, a:1": 1}).keys(), {"pid, a: 1"})
+
+        layer.shutdown()
+        self.assertTrue(set(layer(**self.inputs).values()).isdisjoint(first_pids))
+
+    def test_shared_values_are_pickled_once(self):
+        layer = GridMap(add_counted, inputs=["x", "counter"], outputs=["y"], workers=2, executor="processes",
+                        chunk_size=1)
+        self.addCleanup(layer.shutdown)
+        inputs = {f"x, a:{i}": i for i in range(8)} | {"counter": PickleCounter(100)}
+
+        for _ in range(2):
+            PickleCounter.pickles = 0
+            result = layer(**inputs)
+
+            self.assertEqual(result, {f"y, a: {i}": i + 100 for i in range(8)})
+            self.assertEqual(PickleCounter.pickles, 1)
+
+    def test_executor_instance_with_kwargs(self):
+        layer = GridMap(scale_kwargs, inputs=["x", "factor"], outputs=["y", "z"], func_input_type="kwargs",
+                        func_output_type="dict")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            parallel_layer = GridMap(scale_kwargs, inputs=["x", "factor"], outputs=["y", "z"],
+                                     func_input_type="kwargs", func_output_type="dict", workers=2, executor=executor)
+            self.assertEqual(parallel_layer(**self.inputs), layer(**self.inputs))
+
+
+class GridMapBatchedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.inputs = {"x, a:1": 1, "x, a:2": 2, "x, a:3": 3, "factor, b:10": 10, "factor, b:100": 100}
+
+    def test_generic_objects_are_batched_as_lists(self):
+        calls = []
+
+        def batched_scale(x, factor):
+            calls.append(len(x))
+            return [value * f for value, f in zip(x, factor)]
+
+        result = GridMap(batched_scale, inputs=["x", "factor"], outputs=["y"], batched=True, batch_size=4)(
+            **self.inputs)
+
+        self.assertEqual(result, GridMap(scale, inputs=["x", "factor"], outputs=["y"])(**self.inputs))
+        self.assertEqual(calls, [4, 2])
+
+    def test_dict_outputs(self):
+        def batched_scale(x, factor):
+            return {"y": [value * f for value, f in zip(x, factor)], "z": x}
+
+        result = GridMap(batched_scale, inputs=["x", "factor"], outputs=["y", "z"], func_output_type="dict",
+                         batched=True)(**self.inputs)
+
+        self.assertEqual(result["y, a: 2, b: 100"], 200)
+        self.assertEqual(result["z, a: 2, b: 100"], 2)
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_arrays_are_stacked(self):
+        shapes = []
+
+        def batched_sum(x):
+            shapes.append(x.shape)
+            return x.sum(axis=1)
+
+        inputs = {"x, a:1": np.ones(3), "x, a:2": np.ones(3) * 2, "x, a:3": np.ones(5)}
+        result = GridMap(batched_sum, inputs=["x"], outputs=["s"], batched=True)(**inputs)
+
+        self.assertEqual(sorted(shapes), [(1, 5), (2, 3)])
+        self.assertEqual(result, {"s, a: 1": 3, "s, a: 2": 6, "s, a: 3": 5})
+
+
+if __name__ == '__main__':
+    unittest.main()
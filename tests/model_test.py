@@ -0,0 +1,564 @@
+import asyncio
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from funflow import (Model, Functional, GridMap, ExecutionPlan, LayerExecutionError, Template, NoTagFilter,
+                     ResultCache)
+
+
+def create_model():
+    layers = [
+        GridMap(lambda x, y: x * y, inputs=["x", "y"], outputs=["xy"], name="Multiply"),
+        GridMap(lambda xy: xy + 1, inputs=["xy"], outputs=["xy1"], name="Increment"),
+        Functional(lambda **kwargs: sum(kwargs.values()), inputs=["xy1"], outputs=["total"],
+                   call_type="kwargs", name="Sum"),
+    ]
+    return Model(layers, inputs=["x", "y"], outputs=["total"])
+
+
+def square(x):
+    return x ** 2
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+def create_wide_layers(n: int = 8) -> list:
+    return [Functional(square, inputs=["x"], outputs=[f"y, i:{i}"], name=f"Square {i}") for i in range(n)]
+
+
+class ModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = create_model()
+        self.inputs = {"x, a:1": 1, "x, a:2": 2, "y, b:10": 10, "y": 3}
+
+    def test_call(self):
+        self.assertEqual(self.model(**self.inputs), {"total": 43})
+
+    def test_compile(self):
+        plan = self.model.compile(self.inputs.keys())
+
+        self.assertIsInstance(plan, ExecutionPlan)
+        self.assertEqual([[layer.name for layer in level] for level in plan.levels],
+                         [["Multiply"], ["Increment"], ["Sum"]])
+        self.assertIn("x, a: 1", plan.input_names)
+
+    def test_plan_is_reused(self):
+        plan = self.model.compile(self.inputs.keys())
+
+        self.assertIs(self.model.compile(reversed(list(self.inputs.keys()))), plan)
+        self.assertEqual(self.model(**self.inputs), {"total": 43})
+        self.assertEqual(self.model(**{"x, a:1": 2, "x, a:2": 2, "y, b:10": 10, "y": 3}), {"total": 56})
+        self.assertIs(self.model.compile(self.inputs.keys()), plan)
+
+    def test_plan_depends_on_input_names(self):
+        plan = self.model.compile(self.inputs.keys())
+
+        self.assertIsNot(self.model.compile(["x", "y"]), plan)
+        self.assertEqual(self.model(x=2, y=3), {"total": 7})
+
+
+class CountingFunctional(Functional):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_count = 0
+
+    def init(self, *args, **kwargs):
+        self.init_count += 1
+        return super().init(*args, **kwargs)
+
+
+class ModelFastPathTestCase(unittest.TestCase):
+    def test_layers_are_not_initialised_on_repeated_calls(self):
+        layer = CountingFunctional(lambda x: x + 1, inputs=["x"], outputs=["y"])
+        model = Model([layer])
+
+        model(x=1)
+        init_count = layer.init_count
+        self.assertEqual(model(x=2), {"x": 2, "y": 3})
+        self.assertEqual(layer.init_count, init_count)
+
+    def test_standalone_call_initialises_layer(self):
+        layer = CountingFunctional(lambda x: x + 1, inputs=["x"], outputs=["y"])
+
+        self.assertEqual(layer(x=1), {"y": 2})
+        self.assertEqual(layer.init_count, 1)
+
+    def test_output_names_match_standalone_call(self):
+        # The output tags are resolved from the inputs of the layer, as in a standalone call
+        layer = Functional(lambda x: x + 1, inputs=["x"], outputs=[Template("y", filters=[NoTagFilter("a")])])
+        inputs = {"x, a:1": 1, "z, a:2": 0}
+
+        self.assertEqual(Model([layer])(**inputs)["y, a: 1"], layer(**{"x, a:1": 1})["y, a: 1"])
+
+
+class ModelExecutorTestCase(unittest.TestCase):
+    def test_threads(self):
+        model = Model(create_wide_layers(), executor="threads", max_workers=4)
+        result = model(x=3)
+        model.shutdown()
+
+        self.assertEqual(list(result.keys()), ["x"] + [f"y, i: {i}" for i in range(8)])
+        self.assertTrue(all(value == 9 for key, value in result.items() if key != "x"))
+
+    def test_processes(self):
+        model = Model(create_wide_layers(4), executor="processes", max_workers=2)
+        result = model(x=3)
+        model.shutdown()
+
+        self.assertEqual(result, Model(create_wide_layers(4))(x=3))
+
+    def test_executor_instance(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            model = Model(create_wide_layers(), executor=executor)
+            self.assertEqual(model(x=2), Model(create_wide_layers())(x=2))
+            self.assertIs(model.shutdown().executor, executor)
+
+    def test_error_contains_layer_name(self):
+        layers = create_wide_layers(2) + [Functional(fail, inputs=["x"], outputs=["z"], name="Failing")]
+        model = Model(layers, executor="threads")
+
+        with self.assertRaises(LayerExecutionError) as context:
+            model(x=1)
+        model.shutdown()
+
+        self.assertEqual(context.exception.layer_name, "Failing")
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+
+    def test_error_of_single_layer_level(self):
+        for executor in ["threads", None]:
+            model = Model([Functional(fail, inputs=["x"], outputs=["z"], name="Failing")], executor=executor)
+
+            with self.assertRaises(LayerExecutionError) as context:
+                model(x=1)
+            model.shutdown()
+
+            self.assertEqual(context.exception.layer_name, "Failing")
+            self.assertIsInstance(context.exception.__cause__, ValueError)
+
+    def test_invalid_executor(self):
+        with self.assertRaises(AssertionError):
+            Model(create_wide_layers(), executor="gpu")
+
+
+class ModelDataflowTestCase(unittest.TestCase):
+    @staticmethod
+    def create_skewed_model(scheduler: str) -> Model:
+        # "Slow" only completes once "Fast Successor", which belongs to the next level, has started
+        event = threading.Event()
+
+        def fast_successor(y):
+            event.set()
+            return y + 1
+
+        layers = [
+            Functional(lambda x: event.wait(timeout=2), inputs=["x"], outputs=["slow"], name="Slow"),
+            Functional(lambda x: x * 2, inputs=["x"], outputs=["y"], name="Fast"),
+            Functional(fast_successor, inputs=["y"], outputs=["z"], name="Fast Successor"),
+        ]
+        return Model(layers, executor="threads", max_workers=2, scheduler=scheduler)
+
+    def test_dataflow_does_not_wait_for_level(self):
+        model = self.create_skewed_model("dataflow")
+        self.assertEqual(model(x=1), {"x": 1, "slow": True, "y": 2, "z": 3})
+        model.shutdown()
+
+    def test_levels_waits_for_level(self):
+        model = self.create_skewed_model("levels")
+        self.assertFalse(model(x=1)["slow"])
+        model.shutdown()
+
+    def test_dataflow_matches_levels(self):
+        layers = create_model()._layers
+        dataflow_model = Model(layers, scheduler="dataflow", max_workers=3)
+        inputs = {"x, a:1": 1, "x, a:2": 2, "y, b:10": 10, "y": 3}
+
+        self.assertEqual(dataflow_model(**inputs), Model(layers)(**inputs))
+        dataflow_model.shutdown()
+
+    def test_duplicate_outputs_keep_plan_order(self):
+        layers = [
+            Functional(lambda x: x * 2, inputs=["x"], outputs=["y"], name="Double"),
+            Functional(lambda y: f"y: {y}", inputs=["y"], outputs=["description"], name="Describe Y"),
+            Functional(lambda x: f"x: {x}", inputs=["x"], outputs=["description"], name="Describe X"),
+        ]
+        expected = Model(layers)(x=10)
+
+        for _ in range(10):
+            model = Model(layers, scheduler="dataflow", max_workers=3)
+            self.assertEqual(model(x=10), expected)
+            model.shutdown()
+
+
+async def fetch(x):
+    await asyncio.sleep(0.01)
+    return x * 10
+
+
+class ModelAsyncTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_acall_matches_call(self):
+        model = create_model()
+        inputs = {"x, a:1": 1, "x, a:2": 2, "y, b:10": 10, "y": 3}
+
+        self.assertEqual(await model.acall(**inputs), model(**inputs))
+
+    async def test_async_functional(self):
+        layer = Functional(fetch, inputs=["x"], outputs=["y"])
+
+        self.assertEqual(await layer.acall(x=2), {"y": 20})
+        await asyncio.to_thread(lambda: self.assertEqual(layer(x=2), {"y": 20}))
+
+    async def test_async_grid_map(self):
+        layer = GridMap(fetch, inputs=["x"], outputs=["y"])
+        inputs = {"x, a:1": 1, "x, a:2": 2}
+
+        self.assertEqual(await layer.acall(**inputs), {"y, a: 1": 10, "y, a: 2": 20})
+
+    async def test_sync_call_in_running_loop(self):
+        for layer in [Functional(fetch, inputs=["x"], outputs=["y"]), GridMap(fetch, inputs=["x"], outputs=["y"])]:
+            with self.assertRaisesRegex(RuntimeError, "acall"):
+                layer(x=2)
+
+    async def test_independent_layers_run_concurrently(self):
+        running = []
+        max_running = []
+
+        async def track(x):
+            running.append(x)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(x)
+            return x
+
+        layers = [Functional(track, inputs=["x"], outputs=[f"y, i:{i}"]) for i in range(6)]
+
+        await Model(layers).acall(x=1)
+        self.assertEqual(max(max_running), 6)
+
+        max_running.clear()
+        await Model(layers, max_concurrency=2).acall(x=1)
+        self.assertEqual(max(max_running), 2)
+
+    async def test_acall_error_contains_layer_name(self):
+        layers = [Functional(fetch, inputs=["x"], outputs=["y"]),
+                  Functional(fail, inputs=["y"], outputs=["z"], name="Failing")]
+
+        with self.assertRaises(LayerExecutionError) as context:
+            await Model(layers).acall(x=1)
+
+        self.assertEqual(context.exception.layer_name, "Failing")
+
+
+RECORDED_CALLS = []
+
+
+def recorded_multiply(x, y):
+    RECORDED_CALLS.append(("multiply", x))
+    return x * y
+
+
+def recorded_total(**kwargs):
+    RECORDED_CALLS.append("total")
+    return sum(kwargs.values())
+
+
+class ModelIncrementalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+        def multiply(x, y):
+            self.calls.append(("multiply", x))
+            return x * y
+
+        def total(**kwargs):
+            self.calls.append("total")
+            return sum(kwargs.values())
+
+        def negate(y):
+            self.calls.append("negate")
+            return -y
+
+        self.layers = [GridMap(multiply, inputs=["x", "y"], outputs=["xy"]),
+                       Functional(total, inputs=["xy"], outputs=["total"], call_type="kwargs"),
+                       Functional(negate, inputs=["y"], outputs=["negative"])]
+        self.inputs = {"x, t: a": 1, "x, t: b": 2, "y": 10}
+
+    def test_update_recomputes_affected_combinations(self):
+        model = Model(self.layers, incremental=True)
+        model(**self.inputs)
+        self.calls.clear()
+
+        result = model.update(**{"x, t: b": 5})
+
+        self.assertEqual(self.calls, [("multiply", 5), "total"])
+        self.assertEqual(result, Model(self.layers)(**(self.inputs | {"x, t: b": 5})))
+
+    def test_update_downstream_of_shared_input(self):
+        model = Model(self.layers, outputs=["total", "negative"], incremental=True)
+        model(**self.inputs)
+
+        self.assertEqual(model.update(y=1), {"total": 3, "negative": -1})
+        self.assertEqual(model.update(y=2), {"total": 6, "negative": -2})
+
+    def test_update_with_new_input(self):
+        model = Model(self.layers, outputs=["xy"], incremental=True)
+        model(**self.inputs)
+
+        self.assertEqual(model.update(**{"x, t: c": 3}), {"xy, t: a": 10, "xy, t: b": 20, "xy, t: c": 30})
+
+    def test_update_with_changed_and_new_inputs(self):
+        model = Model(self.layers, outputs=["xy"], incremental=True)
+        model(**self.inputs)
+
+        self.assertEqual(model.update(**{"y": 1, "x, t: c": 3}), {"xy, t: a": 1, "xy, t: b": 2, "xy, t: c": 3})
+
+    def test_update_with_cache(self):
+        layers = [GridMap(recorded_multiply, inputs=["x", "y"], outputs=["xy"]),
+                  Functional(recorded_total, inputs=["xy"], outputs=["total"], call_type="kwargs")]
+        model = Model(layers, outputs=["total"], cache=ResultCache(), incremental=True)
+        model(**self.inputs)
+        RECORDED_CALLS.clear()
+
+        # Cache misses recompute only the affected combinations, hits return the stored outputs
+        self.assertEqual(model.update(**{"x, t: b": 5}), {"total": 60})
+        self.assertEqual(RECORDED_CALLS, [("multiply", 5), "total"])
+        RECORDED_CALLS.clear()
+
+        self.assertEqual(model.update(**{"x, t: b": 2}), {"total": 30})
+        self.assertEqual(RECORDED_CALLS, [])
+
+    def test_failed_update_keeps_state(self):
+        def check(y):
+            if y == 0:
+                raise ValueError(y)
+            return y
+
+        model = Model(self.layers + [Functional(check, inputs=["y"], outputs=["checked"])], outputs=["total"],
+                      incremental=True)
+        model(**self.inputs)
+
+        with self.assertRaises(LayerExecutionError):
+            model.update(y=0)
+
+        self.assertEqual(model.update(**{"x, t: b": 5}), {"total": 60})
+
+    def test_update_requires_incremental(self):
+        model = Model(self.layers)
+        model(**self.inputs)
+
+        with self.assertRaises(AssertionError):
+            model.update(y=1)
+
+
+class ModelTargetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+        def counted(name, func):
+            def wrapper(*args):
+                self.calls.append(name)
+                return func(*args)
+            return wrapper
+
+        self.model = Model([GridMap(counted("square", square), inputs="x", outputs="square"),
+                            GridMap(counted("cube", lambda x: x ** 3), inputs="x", outputs="cube"),
+                            Functional(counted("total", lambda *squares: sum(squares)), inputs="square",
+                                       outputs="total")])
+        self.inputs = {"x, i: 1": 1, "x, i: 2": 2}
+
+    def test_only_ancestors_are_executed(self):
+        self.assertEqual(self.model(**self.inputs, targets=["total"]), {"total": 5})
+        self.assertEqual(self.calls, ["square", "square", "total"])
+
+    def test_tags_select_by_value(self):
+        self.assertEqual(self.model(**self.inputs, targets=["cube, i: 2"]), {"cube, i: 2": 8})
+        self.assertNotIn("square", self.calls)
+
+    def test_plans_are_cached(self):
+        plan = self.model.compile(self.inputs.keys(), ["total"])
+
+        self.assertIs(self.model.compile(self.inputs.keys(), ["total"]), plan)
+        self.assertEqual(len(plan.layers), 2)
+
+    def test_unknown_target(self):
+        with self.assertRaises(ValueError):
+            self.model(**self.inputs, targets=["unknown"])
+
+    def test_acall(self):
+        self.assertEqual(asyncio.run(self.model.acall(**self.inputs, targets=["total"])), {"total": 5})
+
+
+class ModelSavePlanTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "plan.json")
+        self.inputs = {"x, i: 1": 1, "x, i: 2": 2, "y": 3}
+
+    @staticmethod
+    def create_layers():
+        return [CountingFunctional(lambda *xs: sum(xs), inputs="x", outputs="s", name="Sum"),
+                GridMap(lambda x, y: x * y, inputs=["x", "y"], outputs="xy", name="Multiply"),
+                GridMap(lambda xy, s: xy + s, inputs=["xy", "s"], outputs="z", name="Add")]
+
+    def test_load_plan(self):
+        model = Model(self.create_layers())
+        model.save_plan(self.path, self.inputs.keys())
+
+        layers = self.create_layers()
+        loaded = Model(layers)
+        plan = loaded.load_plan(self.path, self.inputs.keys())
+
+        self.assertEqual([[layer.name for layer in level] for level in plan.levels], [["Sum", "Multiply"], ["Add"]])
+        self.assertEqual(plan.predecessors(layers[2]), [layers[0], layers[1]])
+        self.assertIs(loaded.compile(self.inputs.keys()), plan)
+        self.assertEqual(loaded(**self.inputs), model(**self.inputs))
+        # The layers are called with the saved names, without resolving their templates
+        self.assertEqual(layers[0].init_count, 0)
+
+    def test_load_plan_with_targets(self):
+        Model(self.create_layers()).save_plan(self.path, self.inputs.keys(), targets=["s"])
+
+        layers = self.create_layers()
+        loaded = Model(layers)
+        loaded.load_plan(self.path)
+
+        self.assertEqual(loaded(**self.inputs, targets=["s"]), {"s": 3})
+        self.assertEqual(layers[0].init_count, 0)
+
+    def test_changed_layers_are_rejected(self):
+        Model(self.create_layers()).save_plan(self.path, self.inputs.keys())
+
+        with self.assertRaisesRegex(ValueError, "saved for the layers"):
+            Model(self.create_layers()[:2]).load_plan(self.path)
+
+        layers = self.create_layers()
+        layers[1] = GridMap(lambda x, y: x * y, inputs=["x", "y"], outputs="product", name="Multiply")
+        with self.assertRaisesRegex(ValueError, "templates of the layers \\['Multiply'\\] changed"):
+            Model(layers).load_plan(self.path)
+
+    def test_saved_order_is_deterministic(self):
+        model = Model(self.create_layers())
+        saved = model.compile(self.inputs.keys()).to_dict()
+
+        self.assertEqual(next(layer for layer in saved["layers"] if layer["name"] == "Add")["predecessors"],
+                         ["Sum", "Multiply"])
+
+    def test_malformed_plan_is_rejected(self):
+        data = Model(self.create_layers()).compile(self.inputs.keys()).to_dict()
+
+        def without_state_producers(plan):
+            del plan["state_producers"]
+
+        def without_call_names(plan):
+            del plan["layers"][0]["call_names"]
+
+        def with_unknown_level_layer(plan):
+            plan["levels"][0].append("Unknown")
+
+        for corrupt in [without_state_producers, without_call_names, with_unknown_level_layer]:
+            malformed = copy.deepcopy(data)
+            corrupt(malformed)
+            with open(self.path, "w") as file:
+                json.dump(malformed, file)
+
+            with self.assertRaisesRegex(ValueError, "Malformed plan"):
+                Model(self.create_layers()).load_plan(self.path)
+
+    def test_changed_inputs_are_rejected(self):
+        Model(self.create_layers()).save_plan(self.path, self.inputs.keys())
+
+        with self.assertRaisesRegex(ValueError, "saved for the inputs"):
+            Model(self.create_layers()).load_plan(self.path, ["x, i: 1", "y"])
+
+
+class ModelReleaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layers = [Functional(lambda x: x * 2, inputs="x", outputs="a"),
+                       Functional(lambda a: a + b"1", inputs="a", outputs="b"),
+                       Functional(lambda a: a + b"2", inputs="a", outputs="c"),
+                       Functional(lambda b, c: b + c, inputs=["b", "c"], outputs="d")]
+        self.inputs = {"x": b"0" * 100_000}
+
+    def test_same_outputs(self):
+        expected = Model(self.layers, outputs=["d"])(**self.inputs)
+
+        for executor, scheduler in [(None, "levels"), ("threads", "levels"), ("threads", "dataflow")]:
+            model = Model(self.layers, outputs=["d"], executor=executor, scheduler=scheduler,
+                          release_intermediates=True)
+            self.assertEqual(model(**self.inputs), expected)
+            model.shutdown()
+
+    def test_peak_retained_bytes(self):
+        model = Model(self.layers, outputs=["d"], release_intermediates=True)
+        model(**self.inputs)
+
+        # The peak is reached when d (400 KB) is produced while b and c (200 KB each) are still retained.
+        # Without releasing, x and a would be retained too, about 1.1 MB.
+        self.assertGreater(model.peak_retained_bytes, 800_000)
+        self.assertLess(model.peak_retained_bytes, 900_000)
+
+    def test_outputs_are_kept(self):
+        model = Model(self.layers, outputs=["a", "d"], release_intermediates=True)
+        self.assertEqual(set(model(**self.inputs)), {"a", "d"})
+
+    def test_targets(self):
+        model = Model(self.layers, outputs=["d"], release_intermediates=True)
+        self.assertEqual(set(model(**self.inputs, targets=["b"])), {"b"})
+
+
+class ModelStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.running = []
+        self.max_running = []
+        lock = threading.Lock()
+
+        def increment(x):
+            with lock:
+                self.running.append(x)
+                self.max_running.append(len(self.running))
+            time.sleep(0.01)
+            with lock:
+                self.running.remove(x)
+            return x + 1
+
+        layers = [Functional(increment, inputs="x" if i == 0 else f"a{i - 1}", outputs=f"a{i}") for i in range(3)]
+        self.model = Model(layers, outputs=["a2"])
+
+    def test_same_outputs_as_calls(self):
+        batches = [{"x": i} for i in range(8)]
+        self.assertEqual(list(self.model.stream(batches)), [self.model(**batch) for batch in batches])
+
+    def test_stages_are_pipelined(self):
+        list(self.model.stream({"x": i} for i in range(8)))
+        self.assertGreater(max(self.max_running), 1)
+
+    def test_inputs_are_read_lazily(self):
+        read = []
+
+        def batches():
+            for i in range(100):
+                read.append(i)
+                yield {"x": i}
+
+        stream = self.model.stream(batches(), buffer_size=1)
+        next(stream)
+        stream.close()
+
+        # Only the batches fitting in the queues between the stages have been read
+        self.assertLess(len(read), 10)
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            list(self.model.stream([{"x": 1}, {"y": 1}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from funflow import Model, Functional, GridMap, Profiler, LayerExecutionError, write_chrome_trace
+from funflow import profiling
+
+
+def increment(x):
+    return x + 1
+
+
+def double(x):
+    return x * 2
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def create_model(self):
+        return Model([GridMap(lambda x: time.sleep(0.002) or x * 2, inputs="x", outputs="y", name="Double"),
+                      Functional(sum, inputs="y", outputs="s", call_type="tuple", name="Sum")],
+                     outputs=["s"])
+
+    def test_records(self):
+        model = self.create_model()
+        inputs = {f"x, i: {i}": i for i in range(5)}
+
+        with Profiler() as profiler:
+            self.assertEqual(model(**inputs), {"s": 20})
+
+        records = profiler.records
+        self.assertEqual(sorted(record.name for record in records if record.kind == "layer"),
+                         sorted([model.name, "Double", "Sum"]))
+        self.assertEqual(len([record for record in records if record.kind == "combination"]), 5)
+        self.assertTrue(any(record.kind == "level" for record in records))
+
+        double = next(record for record in records if record.kind == "layer" and record.name == "Double")
+        self.assertEqual((double.n_inputs, double.n_outputs), (5, 5))
+        self.assertGreaterEqual(double.wall_time, 0.01)
+        self.assertIsNone(double.allocated_bytes)
+
+    def test_summary_and_report(self):
+        model = self.create_model()
+
+        with Profiler(trace_memory=True) as profiler:
+            model(**{f"x, i: {i}": i for i in range(3)})
+            model(**{f"x, i: {i}": i for i in range(3)})
+
+        summary = profiler.summary(("layer",))
+        self.assertEqual(summary[0].name, model.name)
+        self.assertEqual([item.wall_time for item in summary],
+                         sorted((item.wall_time for item in summary), reverse=True))
+        self.assertEqual(next(item for item in summary if item.name == "Sum").calls, 2)
+        self.assertIsNotNone(summary[0].allocated_bytes)
+
+        report = profiler.report()
+        self.assertTrue(report.startswith("Kind"))
+        self.assertIn("Double", report)
+
+    def test_hooks(self):
+        events = []
+        model = self.create_model()
+
+        with Profiler(on_layer_start=lambda layer, inputs: events.append(("start", layer.name)),
+                      on_layer_end=lambda layer, record: events.append(("end", record.name))):
+            model(**{"x, i: 0": 1})
+
+        self.assertEqual(events[0], ("start", model.name))
+        self.assertEqual(events[-1], ("end", model.name))
+        self.assertLess(events.index(("end", "Double")), events.index(("start", "Sum")))
+
+    def test_failing_layer(self):
+        def fail(x):
+            raise ValueError(x)
+
+        model = Model([Functional(fail, inputs="x", outputs="y", name="Fail")])
+        ended = []
+
+        with Profiler(on_layer_end=lambda layer, record: ended.append(record.name)) as profiler:
+            with self.assertRaises(LayerExecutionError):
+                model(x=1)
+
+        fail_record = next(record for record in profiler.records if record.name == "Fail")
+        self.assertEqual(fail_record.error, "ValueError(1)")
+        self.assertEqual(fail_record.n_outputs, 0)
+        self.assertIn("Fail", ended)
+        self.assertIn(model.name, ended)
+        self.assertEqual(next(item for item in profiler.summary() if item.name == "Fail").errors, 1)
+        self.assertTrue(all(record.error is None for record in profiler.records if record.kind == "combination"))
+
+    def test_process_workers(self):
+        model = Model([Functional(increment, inputs="x", outputs="a", name="A"),
+                       Functional(double, inputs="x", outputs="b", name="B"),
+                       Functional(fail, inputs="x", outputs="c", name="Fail")],
+                      executor="processes", max_workers=2)
+        self.addCleanup(model.shutdown)
+        layer = GridMap(double, inputs="x", outputs="y", workers=2, executor="processes", chunk_size=1, name="Double")
+        self.addCleanup(layer.shutdown)
+
+        with Profiler() as profiler:
+            with self.assertRaises(LayerExecutionError):
+                model(x=1)
+            layer(**{f"x, i: {i}": i for i in range(4)})
+
+        records = {(record.kind, record.name): record for record in profiler.records}
+        for name in ["A", "B", "Fail"]:
+            self.assertNotEqual(records[("layer", name)].process_id, os.getpid())
+        self.assertEqual(records[("layer", "Fail")].error, "ValueError(1)")
+
+        combinations = [record for record in profiler.records if record.kind == "combination"]
+        self.assertEqual(len(combinations), 4)
+        self.assertTrue(all(record.process_id != os.getpid() for record in combinations))
+        self.assertEqual(records[("layer", "Double")].process_id, os.getpid())
+
+    def test_inactive(self):
+        model = self.create_model()
+
+        with Profiler() as profiler:
+            pass
+        model(**{"x, i: 0": 1})
+
+        self.assertEqual(profiler.records, [])
+        self.assertEqual(profiling.active_profilers, [])
+
+
+class ChromeTraceTestCase(unittest.TestCase):
+    def test_write_chrome_trace(self):
+        model = Model([Functional(lambda x: x + 1, inputs="x", outputs="a", name="A"),
+                       Functional(lambda x: x + 2, inputs="x", outputs="b", name="B"),
+                       GridMap(lambda a, b: a * b, inputs=["a", "b"], outputs="c", name="C")],
+                      executor=ThreadPoolExecutor(2))
+        self.addCleanup(model.shutdown)
+
+        with Profiler() as profiler:
+            model(x=1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            write_chrome_trace(path, profiler, model.compile(["x"]))
+            with open(path) as file:
+                events = json.load(file)["traceEvents"]
+
+        spans = {(event["cat"], event["name"]): event for event in events if event["ph"] == "X"}
+        self.assertEqual(spans[("layer", "A")]["args"]["level"], 0)
+        self.assertEqual(spans[("layer", "C")]["args"]["level"], 1)
+        self.assertIn(("combination", "a, b"), spans)
+        self.assertEqual(spans[("level", "Level 0")]["args"]["layers"], "A, B")
+        self.assertGreaterEqual(spans[("layer", "C")]["ts"],
+                                spans[("layer", "A")]["ts"] + spans[("layer", "A")]["dur"])
+
+        thread_names = [event for event in events if event["ph"] == "M" and event["name"] == "thread_name"]
+        self.assertIn("Levels", [event["args"]["name"] for event in thread_names])
+        self.assertEqual([event["args"]["name"] for event in events if event["name"] == "process_name"], ["FunFlow"])
+        # C depends on A and B
+        self.assertEqual(len([event for event in events if event["ph"] == "s"]), 2)
+        self.assertEqual(len([event for event in events if event["ph"] == "f"]), 2)
+
+    def test_worker_process_lanes(self):
+        layer = GridMap(double, inputs="x", outputs="y", workers=2, executor="processes", chunk_size=1, name="Double")
+        self.addCleanup(layer.shutdown)
+
+        with Profiler() as profiler:
+            layer(**{f"x, i: {i}": i for i in range(4)})
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            write_chrome_trace(path, profiler)
+            with open(path) as file:
+                events = json.load(file)["traceEvents"]
+
+        worker_ids = {record.process_id for record in profiler.records if record.kind == "combination"}
+        process_names = {event["pid"]: event["args"]["name"] for event in events if event["name"] == "process_name"}
+
+        self.assertEqual(process_names[os.getpid()], "FunFlow")
+        for worker_id in worker_ids:
+            self.assertEqual(process_names[worker_id], f"FunFlow worker {worker_id}")
+        self.assertEqual({event["pid"] for event in events if event.get("cat") == "combination"}, worker_ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from funflow import Model, Functional, LayerExecutionError
+from funflow.shared_state import SharedMemoryTransport, SharedArray, start_resource_tracker
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def scale(x):
+    return x * 2.0
+
+
+def total(a, b):
+    return float(a.sum() + b.sum())
+
+
+def large_array(x):
+    return np.arange(100_000.0) + x
+
+
+def slow_large_array(x):
+    time.sleep(0.5)
+    return large_array(x)
+
+
+def fail_slowly(x):
+    time.sleep(0.5)
+    raise ValueError(x)
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+def shared_memory_blocks() -> set[str]:
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+
+def increment_in_place(x):
+    x += 1
+    return x
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class SharedMemoryTransportTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        start_resource_tracker()
+        cls.executor = ProcessPoolExecutor(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def assertUnlinked(self, block_name: str):
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(block_name)
+
+    def test_blocks_are_unlinked_after_the_last_consumer(self):
+        layer = Functional(scale, inputs="x", outputs="y").init({"x": None})
+        transport = SharedMemoryTransport(min_bytes=0)
+        transport.start([["x"], ["y"]])
+        x = np.arange(1000.0)
+
+        future = transport.submit(self.executor, layer, {"x": x}, ["x"], ["y"])
+        outputs = future.result()
+        self.assertIsInstance(outputs["y"], SharedArray)
+
+        y = transport.receive(outputs)["y"]
+        np.testing.assert_array_equal(y, x * 2)
+        self.assertFalse(y.flags.writeable)
+
+        transport.layer_done(["x"])
+        transport.layer_done(["y"])
+        self.assertUnlinked(outputs["y"].block)
+        # The views stay valid after the blocks are unlinked
+        np.testing.assert_array_equal(y, x * 2)
+
+    def test_small_arrays_are_pickled(self):
+        layer = Functional(scale, inputs="x", outputs="y").init({"x": None})
+        transport = SharedMemoryTransport()
+
+        outputs = transport.submit(self.executor, layer, {"x": np.arange(10.0)}, ["x"], ["y"]).result()
+        self.assertIsInstance(outputs["y"], np.ndarray)
+        transport.close()
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class ModelSharedMemoryTestCase(unittest.TestCase):
+    def create_model(self, *layers, scheduler: str = "levels"):
+        model = Model(list(layers), executor="processes", max_workers=2, shared_memory=True, scheduler=scheduler)
+        self.addCleanup(model.shutdown)
+        return model
+
+    def test_call(self):
+        x = np.random.rand(100_000)
+        model = self.create_model(Functional(scale, inputs="x", outputs="a", name="A"),
+                                  Functional(scale, inputs="x", outputs="b", name="B"),
+                                  Functional(total, inputs=["a", "b"], outputs="s", name="Total"))
+
+        result = model(x=x)
+        self.assertAlmostEqual(result["s"], 4 * x.sum())
+        np.testing.assert_array_equal(result["a"], x * 2)
+        self.assertFalse(result["a"].flags.writeable)
+
+    def test_inputs_are_read_only(self):
+        model = self.create_model(Functional(increment_in_place, inputs="x", outputs="a", name="A"),
+                                  Functional(scale, inputs="x", outputs="b", name="B"))
+
+        with self.assertRaises(LayerExecutionError):
+            model(x=np.zeros(100_000))
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "The shared memory blocks are not listed in /dev/shm")
+    def test_blocks_of_other_layers_are_unlinked_on_error(self):
+        # The other layer returns its array while the levels scheduler waits for the failing layer, and after the
+        # dataflow scheduler received the error
+        for scheduler, failing, other in [("levels", fail_slowly, large_array), ("dataflow", fail, slow_large_array)]:
+            model = self.create_model(Functional(failing, inputs="x", outputs="a", name="Failing"),
+                                      Functional(other, inputs="x", outputs="b", name="Other"), scheduler=scheduler)
+            blocks = shared_memory_blocks()
+
+            with self.assertRaises(LayerExecutionError):
+                model(x=1.0)
+
+            self.assertEqual(shared_memory_blocks() - blocks, set())
+
+    def test_requires_an_executor(self):
+        with self.assertRaises(AssertionError):
+            Model([Functional(scale, inputs="x", outputs="y")], shared_memory=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
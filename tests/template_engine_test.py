@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from funflow import Functional, GridMap, Model, create_graph
+
+try:
+    import networkx
+except ImportError:
+    networkx = None
+
+
+def identity(*args):
+    return args
+
+
+class CreateGraphTestCase(unittest.TestCase):
+    def test_levels(self):
+        layers = [
+            GridMap(identity, inputs=["y"], outputs=["z"], name="C"),
+            Functional(identity, inputs=["x"], outputs=["y, a:1"], name="A"),
+            Functional(identity, inputs=["x"], outputs=["y, a:2"], name="B"),
+        ]
+        levels, state_producers = create_graph(layers, {"x": None})
+
+        self.assertEqual([[layer.name for layer in level] for level in levels], [["A", "B"], ["C"]])
+        self.assertEqual({name: [layer.name for layer in producers] for name, producers in state_producers.items()},
+                         {"x": [], "y, a: 1": ["A"], "y, a: 2": ["B"], "z, a: 1": ["C"], "z, a: 2": ["C"]})
+        self.assertEqual(sorted(layer.name for layer in layers[0].predecessors), ["A", "B"])
+
+    def test_deep_pipeline(self):
+        # Layers listed in reverse topological order, each one is resolved only after its predecessor
+        layers = [Functional(identity, inputs=[f"v{i}"], outputs=[f"v{i + 1}"], name=f"Layer {i}")
+                  for i in reversed(range(2000))]
+        levels, _ = create_graph(layers, {"v0": None})
+
+        self.assertEqual(len(levels), 2000)
+        self.assertEqual(levels[-1][0].name, "Layer 1999")
+
+    def test_cycle(self):
+        layers = [Functional(identity, inputs=["a"], outputs=["b"], name="A"),
+                  Functional(identity, inputs=["b"], outputs=["a"], name="B")]
+
+        with self.assertRaisesRegex(Exception, "Cyclical graph detected"):
+            create_graph(layers, {"a": None})
+
+    def test_missing_inputs(self):
+        layers = [Functional(identity, inputs=["a", "c"], outputs=["b"], name="A")]
+
+        with self.assertRaisesRegex(ValueError, "A"):
+            create_graph(layers, {"a": None})
+
+
+class LazyImportTestCase(unittest.TestCase):
+    def test_optional_dependencies_are_not_imported(self):
+        script = "import sys, funflow; print(' '.join(sys.modules))"
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        modules = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                 cwd=root).stdout.split()
+
+        third_party = {module.split(".")[0] for module in modules} - set(sys.stdlib_module_names) - {"funflow"}
+        self.assertEqual({module for module in third_party if not module.startswith("_")}, set())
+        for module in ["networkx", "graphviz", "numpy", "pandas"]:
+            self.assertNotIn(module, modules)
+
+    @unittest.skipIf(networkx is None, "networkx is not installed")
+    def test_create_graph_imports_networkx(self):
+        model = Model([Functional(identity, inputs=["x"], outputs=["y"], name="A")])
+
+        self.assertTrue(model.create_graph({"x": None}).has_edge("A", "y"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,138 @@
+import itertools
+import pickle
 import unittest
 
+from funflow import Template, TemplateIndex, TemplateValue, Tag, NoTagFilter, ValueTagFilter, TagFilter
+from funflow import parse_cache_info, set_parse_cache_size, clear_parse_cache
+from funflow.parse_cache import DEFAULT_PARSE_CACHE_SIZE
+from funflow.template_utils import find_actual_input_names, iterate_consistent_combinations
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)  # add assertion here
+
+class InterningTestCase(unittest.TestCase):
+    def test_template_value_is_interned(self):
+        template_value = TemplateValue("x, b:2, a:1")
+
+        self.assertIs(TemplateValue("x, b:2, a:1"), template_value)
+        self.assertIs(TemplateValue("x,a: 1, b: 2"), template_value)
+        self.assertIs(TemplateValue("x", [Tag("b", "2"), Tag("a", "1")]), template_value)
+        self.assertIs(pickle.loads(pickle.dumps(template_value)), template_value)
+
+    def test_template_value_equality(self):
+        template_value = TemplateValue("x, b:2, a:1")
+
+        self.assertEqual(str(template_value), "x, a: 1, b: 2")
+        self.assertEqual(template_value, "x, a:1, b:2")
+        self.assertEqual(hash(template_value), hash("x, a: 1, b: 2"))
+        self.assertNotEqual(template_value, TemplateValue("x, a:1"))
+
+    def test_tag_is_interned(self):
+        tag = Tag("a:1")
+
+        self.assertIs(Tag(" a", "1 "), tag)
+        self.assertIs(pickle.loads(pickle.dumps(tag)), tag)
+        self.assertEqual(tag, "a: 1")
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            Tag("a:1").other = None
+
+        with self.assertRaises(AttributeError):
+            TemplateValue("x").other = None
+
+
+class ParseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        clear_parse_cache()
+
+    def tearDown(self):
+        set_parse_cache_size(DEFAULT_PARSE_CACHE_SIZE)
+        clear_parse_cache()
+
+    def test_hits_and_misses(self):
+        TemplateValue("cached, a:1")
+        TemplateValue("cached, a:1")
+        Template("cached").match("cached, a:1")
+
+        info = parse_cache_info()["template_value"]
+        self.assertEqual((info.hits, info.misses, info.current_size), (2, 1, 1))
+        self.assertEqual(parse_cache_info()["tag"].misses, 1)
+
+    def test_max_size(self):
+        set_parse_cache_size(2)
+        for i in range(5):
+            TemplateValue(f"cached, a:{i}")
+
+        self.assertEqual(parse_cache_info()["template_value"].current_size, 2)
+
+    def test_disabled(self):
+        set_parse_cache_size(0)
+        template_value = TemplateValue("cached, a:1")
+
+        self.assertIs(TemplateValue("cached, a:1"), template_value)
+        self.assertEqual(parse_cache_info()["template_value"], (0, 0, 0, 0))
+
+    def test_match_invalid_string(self):
+        self.assertTrue(Template("x").match("x, a:1, a:2"))
+        self.assertFalse(Template("y").match("x, a:1, a:2"))
+
+
+class EvenTagFilter(TagFilter):
+    def _match(self, tag: Tag) -> bool:
+        return tag.name == self.name and int(tag.value) % 2 == 0
+
+    def __repr__(self):
+        return f"EvenTagFilter({self.name})"
+
+    def __str__(self):
+        return f"{self.name}: {{even}}"
+
+
+class TemplateIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.names = ["x", "x, a:1", "x, a:2, b:1", "y, a:1", "x, b:2", "x, a:3, b:2", "y"]
+        self.index = TemplateIndex(self.names)
+
+    def assertSameAsScan(self, template: Template):
+        self.assertEqual(self.index.find(template), find_actual_input_names(template, self.names))
+
+    def test_find_by_name(self):
+        self.assertSameAsScan(Template("x"))
+        self.assertSameAsScan(Template("y"))
+        self.assertIsNone(self.index.find(Template("z")))
+
+    def test_find_with_filters(self):
+        self.assertSameAsScan(Template("x", filters=[NoTagFilter("a")]))
+        self.assertSameAsScan(Template("x", filters=[ValueTagFilter("b", "2")]))
+        self.assertSameAsScan(Template("x", filters=[NoTagFilter("a"), ValueTagFilter("b", "2")]))
+        self.assertSameAsScan(Template("x", filters=[EvenTagFilter("a")]))
+        self.assertIsNone(self.index.find(Template("y", filters=[NoTagFilter("b")])))
+
+    def test_incremental_update(self):
+        template = Template("x", filters=[NoTagFilter("a")])
+        self.index.add("x, a:0")
+
+        self.assertEqual(self.index.find(template)[-1], "x, a:0")
+        self.assertIn("x, a:0", self.index)
+        self.assertEqual(len(self.index), len(self.names) + 1)
+
+
+class ConsistentCombinationsTestCase(unittest.TestCase):
+    def test_matches_filtered_product(self):
+        candidates = [[TemplateValue(f"x, i: {i}") for i in range(3)] + [TemplateValue("x")],
+                      [TemplateValue(f"y, i: {i}, j: {j}") for i in range(3) for j in range(2)],
+                      [TemplateValue(f"z, j: {j}") for j in range(2)] + [TemplateValue("z, k: 0")]]
+
+        def is_consistent(combination):
+            tags = {tag for value in combination for tag in value.tags}
+            return len({tag.name for tag in tags}) == len(tags)
+
+        expected = [combination for combination in itertools.product(*candidates) if is_consistent(combination)]
+
+        self.assertEqual(list(iterate_consistent_combinations(candidates)), expected)
+
+    def test_empty_candidates(self):
+        self.assertEqual(list(iterate_consistent_combinations([])), [()])
+        self.assertEqual(list(iterate_consistent_combinations([[TemplateValue("x")], []])), [])
 
 
 if __name__ == '__main__':